@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+import tracemalloc
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from database import db
+
+
+def measure(function):
+    """Returns (seconds, peak traced bytes, result) of a call. Latency is timed on a separate run because tracing
+    allocations slows Python code down."""
+    started = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - started
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares get_table_as_df with the Arrow-native readers.")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--extra-columns", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db.set_default_database_file(os.path.join(directory, "benchmark.db"))
+        db.set_default_database_table_name("data")
+        db.initialize_database()
+        db.add_rows(
+            {
+                "name": f"experiment {i % 5000}",
+                "date": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+                "product": f"product_{i % 25}",
+                "datapath": f"/data/{i}.parquet",
+                **{f"Input{column}": i * column * 0.5 for column in range(args.extra_columns)},
+            }
+            for i in range(args.rows)
+        )
+
+        cases = {
+            "get_table_as_df": lambda: db.get_table_as_df(),
+            "get_table_as_arrow_df (all columns)": lambda: db.get_table_as_arrow_df(),
+            "get_table_as_arrow_df (id, date, product)": lambda: db.get_table_as_arrow_df(["id", "date", "product"]),
+            "get_table_as_arrow (id, date, product)": lambda: db.get_table_as_arrow(["id", "date", "product"]),
+        }
+        print(f"{args.rows} rows, {args.extra_columns + 5} columns")
+        for name, function in cases.items():
+            seconds, peak, result = measure(function)
+            size = result.nbytes if hasattr(result, "schema") and not hasattr(result, "memory_usage") else result.memory_usage(deep=True).sum()
+            print(f"{name:45s} {seconds * 1000:9.1f} ms  peak {peak / 1e6:8.1f} MB  result {size / 1e6:8.1f} MB")
+        db.close_db_connections()
+
+
+if __name__ == "__main__":
+    main()
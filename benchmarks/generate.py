@@ -0,0 +1,52 @@
+import os
+import sys
+import numpy as np
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from database import db
+
+PRODUCTS = [f"product_{i}" for i in range(25)]
+EXPERIMENT_KINDS = ["thermal", "vibration", "shock", "humidity", "endurance"]
+
+
+def generate_rows(count, extra_columns=6, datapaths=None, seed=0):
+    """Yields count synthetic experiment rows. Rows reference the given datapaths round-robin when provided."""
+    random = np.random.default_rng(seed)
+    for start in range(0, count, 100000):
+        size = min(100000, count - start)
+        days = random.integers(0, 5 * 365, size)
+        products = random.integers(0, len(PRODUCTS), size)
+        kinds = random.integers(0, len(EXPERIMENT_KINDS), size)
+        inputs = random.normal(size=(size, extra_columns)).round(4)
+        for offset in range(size):
+            index = start + offset
+            day = np.datetime64("2020-01-01") + int(days[offset])
+            yield {
+                "name": f"{EXPERIMENT_KINDS[kinds[offset]]} run {index}",
+                "date": str(day),
+                "product": PRODUCTS[products[offset]],
+                "datapath": datapaths[index % len(datapaths)] if datapaths else f"/data/experiment_{index}.parquet",
+                **{f"Input{column + 1}": float(inputs[offset, column]) for column in range(extra_columns)},
+            }
+
+
+def generate_experiment_files(directory, count, samples=100000, channels=4, seed=0):
+    """Writes count synthetic experiment data files (time plus noisy sine channels) as .npz and returns their paths."""
+    os.makedirs(directory, exist_ok=True)
+    random = np.random.default_rng(seed)
+    time = np.linspace(0, 100, samples)
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"experiment_{index}.npz")
+        channels_data = {f"channel_{channel}": np.sin(time * (channel + 1)) + random.normal(scale=0.1, size=samples) for channel in range(channels)}
+        np.savez(path, time=time, **channels_data)
+        paths.append(path)
+    return paths
+
+
+def build_database(db_file, table_name, count, extra_columns=6, datapaths=None, chunk_size=50000):
+    """Creates and fills a synthetic experiment table with count rows."""
+    db.initialize_database(db_file, table_name)
+    db.add_rows(generate_rows(count, extra_columns, datapaths), chunk_size=chunk_size, db_file=db_file, table_name=table_name)
@@ -0,0 +1,530 @@
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import inspect
+import sqlite3
+import platform
+import tempfile
+import argparse
+import statistics
+import subprocess
+import urllib.request
+
+import pyarrow as pa
+import pandas as pd
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPEED_DIRECTORY = os.path.join(AMAIAS_DIRECTORY, "speed")
+sys.path.append(AMAIAS_DIRECTORY)
+sys.path.append(SPEED_DIRECTORY)
+
+from database import db, partitions
+from benchmarks import generate
+
+TABLE_NAME = "data"
+DEFAULT_SIZES = "10k,100k"
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_NOISE_FLOOR = 0.001
+FULL_SCAN_LIMIT = 1000000
+STARTUP_TIMEOUT = 60
+
+BENCHMARKS = []
+
+
+def benchmark(name, full_scan=False):
+    """Registers a benchmark. The decorated function receives the context and the run index, does any untimed
+    setup and returns the callable to time. Full-scan benchmarks are skipped above --full-scan-limit rows."""
+    def register(function):
+        BENCHMARKS.append((name, function, full_scan))
+        return function
+    return register
+
+
+def parse_size(text):
+    """Parses a row count such as 10000, 10k or 10M."""
+    multipliers = {"k": 1000, "m": 1000000}
+    text = text.strip().lower()
+    return int(float(text[:-1]) * multipliers[text[-1]]) if text[-1] in multipliers else int(text)
+
+
+def result_rows(result):
+    """Returns the number of rows in a benchmarked result, or None when it isn't row-shaped."""
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    if isinstance(result, (list, pd.DataFrame, pd.Series, pa.Table)):
+        return len(result)
+    return None
+
+
+def time_runs(setup, context, repeat):
+    seconds, rows = [], None
+    for run in range(repeat):
+        function = setup(context, run)
+        started = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - started)
+        rows = result_rows(result)
+    return {"seconds": statistics.median(seconds), "min": min(seconds), "max": max(seconds), "runs": repeat, "rows": rows}
+
+
+def get_callback(app, name):
+    """Returns the undecorated function of a registered Dash callback."""
+    for callback in app.callback_map.values():
+        if "callback" in callback and callback["callback"].__name__ == name:
+            return inspect.unwrap(callback["callback"])
+    raise KeyError(name)
+
+
+def call_callback(function, *args, triggered_id=None):
+    """Calls a callback function outside a request, with ctx.triggered_id set like Dash would."""
+    from dash._callback_context import context_value
+    from dash._utils import AttributeDict
+
+    triggered_inputs = [{"prop_id": f"{triggered_id}.n_intervals", "value": None}] if triggered_id else []
+    context_value.set(AttributeDict(triggered_inputs=triggered_inputs))
+    return function(*args)
+
+
+def load_speed_app():
+    import app as speed_app
+    return speed_app.app
+
+
+def prepare_database(rows, extra_columns, data_directory):
+    """Returns (path of a pristine synthetic database with the given row count, seconds spent generating it or None
+    when it was reused from the data directory)."""
+    db_file = os.path.join(data_directory, f"synthetic_{rows}_{extra_columns}.db")
+    if os.path.exists(db_file):
+        return db_file, None
+    started = time.perf_counter()
+    generate.build_database(db_file + ".tmp", TABLE_NAME, rows, extra_columns)
+    db.close_db_connections()
+    os.replace(db_file + ".tmp", db_file)
+    return db_file, time.perf_counter() - started
+
+
+def sample_ids(db_file, count):
+    conn = sqlite3.connect(db_file)
+    try:
+        return [row[0] for row in conn.execute(f"SELECT id FROM {TABLE_NAME} ORDER BY random() LIMIT ?", (count,))]
+    finally:
+        conn.close()
+
+
+@benchmark("table_exists")
+def bench_table_exists(context, run):
+    return lambda: db.table_exists()
+
+
+@benchmark("get_column_names")
+def bench_get_column_names(context, run):
+    return lambda: db.get_column_names()
+
+
+@benchmark("get_table_schema")
+def bench_get_table_schema(context, run):
+    return lambda: db.get_table_schema()
+
+
+@benchmark("get_row")
+def bench_get_row(context, run):
+    return lambda: [db.get_row(row_id) for row_id in context["ids"][:100]]
+
+
+@benchmark("get_column", full_scan=True)
+def bench_get_column(context, run):
+    return lambda: db.get_column("name")
+
+
+@benchmark("get_table_as_df", full_scan=True)
+def bench_get_table_as_df(context, run):
+    return lambda: db.get_table_as_df()
+
+
+@benchmark("get_table_as_list", full_scan=True)
+def bench_get_table_as_list(context, run):
+    return lambda: db.get_table_as_list()
+
+
+@benchmark("get_table_as_arrow", full_scan=True)
+def bench_get_table_as_arrow(context, run):
+    return lambda: db.get_table_as_arrow()
+
+
+@benchmark("get_table_as_arrow_projected", full_scan=True)
+def bench_get_table_as_arrow_projected(context, run):
+    return lambda: db.get_table_as_arrow(columns=["id", "date", "product"])
+
+
+@benchmark("iter_table_chunks", full_scan=True)
+def bench_iter_table_chunks(context, run):
+    return lambda: sum(len(chunk) for chunk in db.iter_table_chunks(chunk_size=50000))
+
+
+@benchmark("get_table_page_first")
+def bench_get_table_page_first(context, run):
+    return lambda: db.get_table_page(0, 100)
+
+
+@benchmark("get_table_page_deep")
+def bench_get_table_page_deep(context, run):
+    start_row = max(context["rows"] - 100, 0)
+    return lambda: db.get_table_page(start_row, start_row + 100)
+
+
+@benchmark("get_table_page_sorted_filtered")
+def bench_get_table_page_sorted_filtered(context, run):
+    filters = [{"column": "product", "op": "=", "value": "product_3"}, {"column": "name", "op": "contains", "value": "run 1"}]
+    return lambda: db.get_table_page(0, 100, sort_model=[("date", "desc")], filters=filters)
+
+
+@benchmark("query_rows_indexed")
+def bench_query_rows_indexed(context, run):
+    filters = [{"column": "product", "op": "=", "value": "product_7"}, {"column": "date", "op": "between", "value": ("2021-01-01", "2021-01-31")}]
+    return lambda: db.query_rows(filters=filters, order_by=[("date", "asc")])
+
+
+@benchmark("query_rows_full_text")
+def bench_query_rows_full_text(context, run):
+    return lambda: db.query_rows(columns=["id", "name"], filters=[{"column": "name", "op": "match", "value": "thermal"}], limit=1000)
+
+
+@benchmark("get_statistics")
+def bench_get_statistics(context, run):
+    return lambda: db.get_statistics(context["ids"][:100])
+
+
+@benchmark("get_change_version")
+def bench_get_change_version(context, run):
+    return lambda: db.get_change_version()
+
+
+@benchmark("get_changes_since")
+def bench_get_changes_since(context, run):
+    for row_id in context["ids"][:100]:
+        db.edit_cell(row_id, "Input1", float(run))
+    version = db.get_change_version() - 100
+    return lambda: db.get_changes_since(version)
+
+
+@benchmark("add_row")
+def bench_add_row(context, run):
+    row = next(generate.generate_rows(1, context["extra_columns"], seed=run))
+    return lambda: [db.add_row(row) for _ in range(100)]
+
+
+@benchmark("add_rows")
+def bench_add_rows(context, run):
+    rows = list(generate.generate_rows(10000, context["extra_columns"], seed=run))
+    return lambda: db.add_rows(rows)
+
+
+@benchmark("add_statistics")
+def bench_add_statistics(context, run):
+    summaries = [
+        {"id": row_id, "channel": f"channel_{channel}", "count": 1000, "min": -1.0, "max": 1.0, "mean": 0.0, "std": 0.5}
+        for row_id in context["ids"][:100] for channel in range(8)
+    ]
+    return lambda: db.add_statistics(summaries)
+
+
+@benchmark("edit_cell")
+def bench_edit_cell(context, run):
+    return lambda: [db.edit_cell(row_id, "Input1", float(run)) for row_id in context["ids"][:100]]
+
+
+@benchmark("edit_row")
+def bench_edit_row(context, run):
+    return lambda: [db.edit_row(row_id, {"Input1": float(run), "Input2": -float(run)}) for row_id in context["ids"][:100]]
+
+
+@benchmark("delete_row")
+def bench_delete_row(context, run):
+    row_ids = context["ids"][100 + run * 10:110 + run * 10]
+    return lambda: [db.delete_row(row_id) for row_id in row_ids]
+
+
+@benchmark("apply_mutations_edits")
+def bench_apply_mutations_edits(context, run):
+    mutations = [{"op": "edit_cell", "id": row_id, "column": "Input1", "value": float(run)} for row_id in context["ids"][:1000]]
+    return lambda: db.apply_mutations(mutations, expected_version=db.get_change_version())
+
+
+@benchmark("apply_mutations_deletes")
+def bench_apply_mutations_deletes(context, run):
+    row_ids = context["ids"][1000 + run * 100:1100 + run * 100]
+    return lambda: db.apply_mutations([{"op": "delete", "ids": row_ids}])
+
+
+@benchmark("add_column")
+def bench_add_column(context, run):
+    return lambda: db.add_column(f"Benchmark{run}")
+
+
+@benchmark("delete_column", full_scan=True)
+def bench_delete_column(context, run):
+    return lambda: db.delete_column(f"Benchmark{run}")
+
+
+@benchmark("refactor_columns", full_scan=True)
+def bench_refactor_columns(context, run):
+    columns = [column for column in db.get_column_names() if column != "Input1"] + [f"Refactored{run}"]
+    return lambda: db.refactor_columns(columns)
+
+
+@benchmark("callback_refresh_initial")
+def bench_callback_refresh_initial(context, run):
+    refresh = get_callback(context["app"], "refresh_database_table")
+    return lambda: call_callback(refresh, 0, {})
+
+
+@benchmark("callback_refresh_unchanged")
+def bench_callback_refresh_unchanged(context, run):
+    refresh = get_callback(context["app"], "refresh_database_table")
+    _, store, _ = call_callback(refresh, 0, {})
+    return lambda: call_callback(refresh, 1, store, triggered_id="database-refresh-interval")
+
+
+@benchmark("callback_refresh_delta")
+def bench_callback_refresh_delta(context, run):
+    refresh = get_callback(context["app"], "refresh_database_table")
+    _, store, _ = call_callback(refresh, 0, {})
+    for row_id in context["ids"][:100]:
+        db.edit_cell(row_id, "Input2", float(run))
+    return lambda: call_callback(refresh, 1, store, triggered_id="database-refresh-interval")
+
+
+@benchmark("callback_get_rows")
+def bench_callback_get_rows(context, run):
+    get_rows = get_callback(context["app"], "get_database_rows")
+    request = {"startRow": 0, "endRow": 50, "sortModel": [{"colId": "date", "sort": "desc"}], "filterModel": {}}
+    return lambda: call_callback(get_rows, request)
+
+
+def run_size(rows, args, app):
+    db_file, generate_seconds = prepare_database(rows, args.extra_columns, args.data_directory)
+    results = {}
+    if generate_seconds is not None:
+        results["ingest_add_rows"] = {"seconds": generate_seconds, "min": generate_seconds, "max": generate_seconds, "runs": 1, "rows": rows}
+
+    with tempfile.TemporaryDirectory(dir=args.data_directory) as directory:
+        working_file = os.path.join(directory, "benchmark.db")
+        shutil.copyfile(db_file, working_file)
+        db.set_default_database_file(working_file)
+        db.set_default_database_table_name(TABLE_NAME)
+        db.initialize_database()
+        # Ids are sampled first, a partitioned table keeps its rows in the partitions
+        context = {"rows": rows, "extra_columns": args.extra_columns, "ids": sample_ids(working_file, 2000), "app": app}
+        if args.partition:
+            partitions.enable_partitioning(args.partition)
+
+        for name, setup, full_scan in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            if full_scan and rows > args.full_scan_limit:
+                results[name] = {"skipped": True}
+                continue
+            results[name] = time_runs(setup, context, args.repeat)
+            print(f"{rows:>10} {name:<34} {results[name]['seconds'] * 1000:>10.2f} ms", flush=True)
+        db.close_db_connections()
+        if args.startup_runs:
+            results.update(run_startup(working_file, rows, args))
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def http_request(url, payload=None):
+    data = json.dumps(payload).encode() if payload is not None else None
+    headers = {"Content-Type": "application/json"} if data else {}
+    with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers), timeout=STARTUP_TIMEOUT) as response:
+        return response.read()
+
+
+def time_startup(db_file, fast_start, directory):
+    """Starts the SPEED server on db_file and times, from process start, the first byte of the page (TTFB) and the
+    first rows of the grid (TTI), requesting what the browser would: page, layout, callbacks and first grid block."""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, os.path.join(SPEED_DIRECTORY, "app.py"), "--db-file", db_file, "--table-name", TABLE_NAME, "--port", str(port), "--no-debug"]
+    started = time.perf_counter()
+    server = subprocess.Popen(command + (["--fast-start"] if fast_start else []), cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError("The SPEED server exited during startup")
+            if time.perf_counter() - started > STARTUP_TIMEOUT:
+                raise TimeoutError("The SPEED server didn't start")
+            try:
+                http_request(base_url + "/")
+                break
+            except OSError:
+                time.sleep(0.01)
+        ttfb = time.perf_counter() - started
+
+        http_request(base_url + "/_dash-layout")
+        dependencies = json.loads(http_request(base_url + "/_dash-dependencies"))
+        get_rows = next(dependency for dependency in dependencies if dependency["output"].endswith("getRowsResponse"))
+        request = {"startRow": 0, "endRow": 50, "sortModel": [], "filterModel": {}}
+        http_request(base_url + "/_dash-update-component", {
+            "output": get_rows["output"],
+            "outputs": {"id": "database-table", "property": "getRowsResponse"},
+            "inputs": [{"id": "database-table", "property": "getRowsRequest", "value": request}],
+            "changedPropIds": ["database-table.getRowsRequest"],
+            "state": [],
+        })
+        return ttfb, time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run_startup(db_file, rows, args):
+    """Times SPEED's cold start against a table, with and without --fast-start."""
+    results = {}
+    with tempfile.TemporaryDirectory(dir=args.data_directory) as directory:
+        for fast_start in (False, True):
+            runs = [time_startup(db_file, fast_start, directory) for _ in range(args.startup_runs)]
+            suffix = "_fast_start" if fast_start else ""
+            for index, name in enumerate(["startup_ttfb", "startup_tti"]):
+                seconds = [run[index] for run in runs]
+                results[name + suffix] = {"seconds": statistics.median(seconds), "min": min(seconds), "max": max(seconds), "runs": len(seconds), "rows": rows}
+    for name, result in results.items():
+        print(f"{rows:>10} {name:<34} {result['seconds'] * 1000:>10.2f} ms", flush=True)
+    return results
+
+
+def run_miner(args):
+    """Times uploading and ingesting synthetic experiment files through the MINER routes."""
+    from miner import app as miner_app
+    from storage import blobstore
+
+    with tempfile.TemporaryDirectory(dir=args.data_directory) as directory:
+        miner_app.UPLOAD_DIRECTORY = os.path.join(directory, "uploads")
+        miner_app.DATA_DIRECTORY = os.path.join(directory, "experiments")
+        os.makedirs(miner_app.UPLOAD_DIRECTORY)
+        os.makedirs(miner_app.DATA_DIRECTORY)
+        blobstore.set_blob_root(miner_app.DATA_DIRECTORY)
+        db.set_default_database_file(os.path.join(directory, "miner.db"))
+        db.set_default_database_table_name(TABLE_NAME)
+        db.initialize_database()
+
+        paths = generate.generate_experiment_files(os.path.join(directory, "source"), args.files, samples=args.samples)
+        client = miner_app.app.test_client()
+
+        def upload_and_ingest():
+            started = time.perf_counter()
+            upload_ids = []
+            for path in paths:
+                with open(path, "rb") as file:
+                    response = client.put(f"/uploads/{os.path.basename(path)}", data=file)
+                upload_ids.append(response.get_json()["upload_id"])
+            upload_seconds = time.perf_counter() - started
+
+            experiments = [{"upload_id": upload_id, "name": f"ingested {index}", "date": "2024-01-01", "product": "product_0"} for index, upload_id in enumerate(upload_ids)]
+            started = time.perf_counter()
+            report = client.post("/ingest", json={"experiments": experiments}).get_json()
+            return upload_seconds, time.perf_counter() - started, report
+
+        upload_seconds, ingest_seconds, report = upload_and_ingest()
+        ingested, stored_bytes = len(report["ids"]), report["stored_bytes"]
+        # The same files again are recognized as already stored and skip processing
+        _, duplicate_seconds, report = upload_and_ingest()
+        duplicates = len(report["ids"])
+        db.close_db_connections()
+
+    results = {
+        "miner_upload": {"seconds": upload_seconds, "min": upload_seconds, "max": upload_seconds, "runs": 1, "rows": len(paths)},
+        "miner_ingest": {"seconds": ingest_seconds, "min": ingest_seconds, "max": ingest_seconds, "runs": 1, "rows": ingested, "stored_bytes": stored_bytes},
+        "miner_ingest_duplicates": {"seconds": duplicate_seconds, "min": duplicate_seconds, "max": duplicate_seconds, "runs": 1, "rows": duplicates},
+    }
+    for name, result in results.items():
+        print(f"{'miner':>10} {name:<34} {result['seconds'] * 1000:>10.2f} ms", flush=True)
+    return results
+
+
+def compare(results, baseline, threshold, noise_floor):
+    """Returns the benchmarks whose median got slower than the baseline by more than threshold (a fraction) and
+    by more than noise_floor seconds, as [(key, baseline seconds, current seconds)]."""
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if not previous or "seconds" not in previous or "seconds" not in result:
+            continue
+        if result["seconds"] > previous["seconds"] * (1 + threshold) and result["seconds"] - previous["seconds"] > noise_floor:
+            regressions.append((key, previous["seconds"], result["seconds"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the db layer, the SPEED grid callbacks and MINER ingestion on synthetic data.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated row counts, e.g. 10k,100k,1M,10M")
+    parser.add_argument("--extra-columns", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="*", help="benchmark names to run")
+    parser.add_argument("--full-scan-limit", type=int, default=FULL_SCAN_LIMIT, help="skip full-table benchmarks above this many rows")
+    parser.add_argument("--files", type=int, default=8, help="experiment files ingested through MINER, 0 to skip")
+    parser.add_argument("--startup-runs", type=int, default=1, help="cold starts of the SPEED server timed per size, 0 to skip")
+    parser.add_argument("--samples", type=int, default=100000, help="samples per channel in each experiment file")
+    parser.add_argument("--result-cache", action="store_true", help="enable the result cache while benchmarking")
+    parser.add_argument("--partition", choices=sorted(partitions.PARTITION_GRANULARITIES), help="partition the table by date before benchmarking")
+    parser.add_argument("--data-directory", default=None, help="keeps generated databases here to reuse them across runs")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="slowdown fraction reported as a regression")
+    parser.add_argument("--noise-floor", type=float, default=DEFAULT_NOISE_FLOOR, help="ignore slowdowns smaller than this many seconds")
+    args = parser.parse_args()
+
+    temporary_directory = None
+    if args.data_directory is None:
+        temporary_directory = tempfile.TemporaryDirectory()
+        args.data_directory = temporary_directory.name
+    os.makedirs(args.data_directory, exist_ok=True)
+    db.set_result_cache_enabled(args.result_cache)
+
+    app = load_speed_app()
+    results = {}
+    try:
+        for rows in [parse_size(size) for size in args.sizes.split(",")]:
+            results.update({f"{rows}/{name}": result for name, result in run_size(rows, args, app).items()})
+        if args.files:
+            results.update({f"miner/{name}": result for name, result in run_miner(args).items()})
+    finally:
+        if temporary_directory is not None:
+            temporary_directory.cleanup()
+
+    output = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "result_cache": args.result_cache,
+            "partition": args.partition,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(output, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold, args.noise_floor)
+        for key, previous, current in regressions:
+            print(f"REGRESSION {key}: {previous * 1000:.2f} ms -> {current * 1000:.2f} ms ({current / previous:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (threshold {args.threshold:.0%})")
+
+
+if __name__ == "__main__":
+    main()
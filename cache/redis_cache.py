@@ -1,14 +1,202 @@
-from redis import Redis
+import hashlib
 import json
+import threading
+import time
+from collections import OrderedDict
+
+from utils import lazy
+
+pd = lazy.lazy_import("pandas")
+pa = lazy.lazy_import("pyarrow")
+
+try:
+    from redis import Redis
+    from redis.retry import Retry
+    from redis.backoff import NoBackoff
+    from redis.exceptions import RedisError
+except ImportError:
+    Redis = None
+    RedisError = OSError
+
+REDIS_HOST = "localhost"
+REDIS_PORT = 6379
+REDIS_DB = 0
+
+DEFAULT_TTL = 300
+MEMORY_CACHE_MAX_ENTRIES = 256
+ARROW_COMPRESSION = "zstd"
+
+KEY_PREFIX = "speed"
+
+# Commands aren't retried: a failed cache access costs a recomputation, while retries with backoff held up every
+# startup without a Redis server for seconds
+redis_client = Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, socket_connect_timeout=0.5, socket_timeout=2, retry=Retry(NoBackoff(), 0)) if Redis else None
+
+cache_backend = None
+cache_backend_lock = threading.Lock()
+
+
+class MemoryBackend:
+    """In-process LRU cache with per-entry TTL. Used when Redis isn't available."""
+
+    def __init__(self, max_entries=MEMORY_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (value, None if ttl is None else time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            value = int((self.entries.get(key) or (b"0", None))[0]) + 1
+            self.entries[key] = (str(value).encode(), None)
+            return value
+
+
+class RedisBackend:
+    """Redis cache shared by all worker processes. Eviction beyond the TTL follows the server's maxmemory-policy."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+
+def set_cache_backend(backend):
+    global cache_backend
+    cache_backend = backend
+
+
+def get_cache_backend():
+    """Returns the cache backend, using Redis when it is reachable and an in-process cache otherwise."""
+    global cache_backend
+    if cache_backend is None:
+        with cache_backend_lock:
+            if cache_backend is None:
+                try:
+                    redis_client.ping()
+                    cache_backend = RedisBackend(redis_client)
+                except (AttributeError, RedisError, OSError):
+                    cache_backend = MemoryBackend()
+    return cache_backend
+
+
+def write_arrow_stream(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression=ARROW_COMPRESSION)) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def serialize_value(value):
+    """Serializes Arrow tables, DataFrames and Series as compressed Arrow IPC and everything else as JSON."""
+    if lazy.is_loaded("pyarrow") and isinstance(value, pa.Table):
+        return b"T" + write_arrow_stream(value)
+    if lazy.is_loaded("pandas") and isinstance(value, (pd.DataFrame, pd.Series)):
+        frame = value.to_frame(name="value") if isinstance(value, pd.Series) else value
+        table = pa.Table.from_pandas(frame)
+        if isinstance(value, pd.Series):
+            table = table.replace_schema_metadata({**table.schema.metadata, b"series_name": json.dumps(value.name).encode()})
+        return (b"S" if isinstance(value, pd.Series) else b"D") + write_arrow_stream(table)
+    return b"J" + json.dumps(value).encode()
+
+
+def deserialize_value(data):
+    kind, payload = data[:1], data[1:]
+    if kind == b"J":
+        return json.loads(payload)
+    table = pa.ipc.open_stream(payload).read_all()
+    if kind == b"T":
+        return table
+    frame = table.to_pandas()
+    if kind == b"S":
+        series = frame["value"]
+        series.name = json.loads(table.schema.metadata[b"series_name"])
+        return series
+    return frame
 
-redis_client = Redis(host='localhost', port=6379, db=0)
 
 def set_cache(key, value):
-    redis_client.set(key, json.dumps(value))
+    get_cache_backend().set(key, json.dumps(value).encode())
 
 def get_cache(key):
-    value = redis_client.get(key)
+    value = get_cache_backend().get(key)
     return json.loads(value) if value else None
 
 def clear_cache(key):
-    redis_client.delete(key)
\ No newline at end of file
+    get_cache_backend().delete(key)
+
+
+def get_table_version(namespace):
+    """Returns the write version of a table namespace. Every write to the table bumps it."""
+    try:
+        value = get_cache_backend().get(f"{KEY_PREFIX}:version:{namespace}")
+    except RedisError:
+        return None
+    return int(value) if value else 0
+
+
+def bump_table_version(namespace):
+    """Marks every cached result of a table namespace as stale."""
+    try:
+        get_cache_backend().incr(f"{KEY_PREFIX}:version:{namespace}")
+    except RedisError:
+        pass
+
+
+def cached_result(namespace, function_name, args, loader, ttl=DEFAULT_TTL, data_version=None):
+    """Returns the cached result of loader() for (function_name, args) at the table's current version,
+    calling loader() and caching its result on a miss. Results that can't be serialized aren't cached.
+    data_version, a version read from the data source itself, is part of the key as well, so writes that didn't
+    bump the table version (e.g. made by a process using another cache) still miss."""
+    version = get_table_version(namespace)
+    if version is None:
+        return loader()
+
+    args_digest = hashlib.sha1(json.dumps(args, sort_keys=True, default=str).encode()).hexdigest()
+    key = f"{KEY_PREFIX}:result:{namespace}:{version}:{data_version}:{function_name}:{args_digest}"
+    backend = get_cache_backend()
+    try:
+        data = backend.get(key)
+    except RedisError:
+        data = None
+    if data is not None:
+        return deserialize_value(data)
+
+    value = loader()
+    try:
+        backend.set(key, serialize_value(value), ttl)
+    except (TypeError, ValueError, pa.ArrowException, RedisError):
+        pass
+    return value
@@ -0,0 +1,64 @@
+import os
+import sys
+import argparse
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from database import db, partitions
+
+AGGREGATES_SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "aggregates.sql")
+
+
+def install_aggregates(conn, table_name, source_name=None):
+    """Creates the aggregate tables of table_name and the triggers maintaining them on source_name, the table itself
+    by default or one of its partitions. Must run inside a write transaction."""
+    db.run_sql_script(conn, AGGREGATES_SCHEMA_FILE, {"table_name": table_name, "source_name": source_name or table_name})
+
+
+def rebuild_aggregates(db_file=None, table_name=None):
+    """Recomputes the aggregate tables from the rows of the table (or of its partitions), e.g. to backfill a database
+    created before they existed. Returns the number of products."""
+    db_file = db.resolve_database_file(db_file)
+    table_name = db.resolve_database_table_name(table_name)
+
+    with db.transaction(db_file) as conn:
+        install_aggregates(conn, table_name)
+        conn.execute(f"DELETE FROM {table_name}_daily_counts")
+        conn.execute(f"DELETE FROM {table_name}_product_counts")
+        for source_name in partitions.get_read_tables(None, db_file, table_name):
+            conn.execute(f"""
+                INSERT INTO {table_name}_daily_counts (product, day, count, latest_id, latest_date)
+                SELECT product, day, count, id, date FROM (
+                    SELECT COALESCE(product, '') AS product, substr(date, 1, 10) AS day, id, date,
+                        COUNT(*) OVER days AS count, ROW_NUMBER() OVER (days ORDER BY date DESC, id DESC) AS position
+                    FROM {source_name}
+                    WINDOW days AS (PARTITION BY COALESCE(product, ''), substr(date, 1, 10))
+                ) WHERE position = 1
+                ON CONFLICT (product, day) DO UPDATE SET
+                    count = count + excluded.count,
+                    latest_id = CASE WHEN excluded.latest_date > latest_date OR (excluded.latest_date = latest_date AND excluded.latest_id > latest_id) THEN excluded.latest_id ELSE latest_id END,
+                    latest_date = CASE WHEN excluded.latest_date > latest_date THEN excluded.latest_date ELSE latest_date END
+            """)
+        conn.execute(f"""
+            INSERT INTO {table_name}_product_counts (product, count, latest_id, latest_date)
+            SELECT product, count, latest_id, latest_date FROM (
+                SELECT product, latest_id, latest_date,
+                    SUM(count) OVER products AS count, ROW_NUMBER() OVER (products ORDER BY day DESC) AS position
+                FROM {table_name}_daily_counts
+                WINDOW products AS (PARTITION BY product)
+            ) WHERE position = 1
+        """)
+        products = conn.execute(f"SELECT COUNT(*) FROM {table_name}_product_counts").fetchone()[0]
+    db.invalidate_table_results(db_file, table_name)
+    return products
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuilds the per-product and per-day aggregates of an experiment table.")
+    parser.add_argument("db_file")
+    parser.add_argument("table_name")
+    args = parser.parse_args()
+
+    db.initialize_database(args.db_file, args.table_name)
+    print(f"Rebuilt the aggregates of {rebuild_aggregates(args.db_file, args.table_name)} products")
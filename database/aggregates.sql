@@ -0,0 +1,92 @@
+-- Aggregates of {table_name} kept up to date by triggers on {source_name}, which is the table itself or one of its
+-- partitions. Days are the first 10 characters of the date and experiments without a product count under ''.
+-- The latest run of a (product, day) or product is the row with the greatest (date, id).
+CREATE TABLE IF NOT EXISTS {table_name}_daily_counts (
+    product TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    latest_id INTEGER,
+    latest_date TEXT,
+    PRIMARY KEY (product, day)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS {table_name}_daily_counts_day ON {table_name}_daily_counts (day);
+
+CREATE TABLE IF NOT EXISTS {table_name}_product_counts (
+    product TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    latest_id INTEGER,
+    latest_date TEXT
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS {source_name}_aggregates_insert AFTER INSERT ON {source_name}
+BEGIN
+    INSERT INTO {table_name}_daily_counts (product, day, count, latest_id, latest_date)
+    VALUES (COALESCE(NEW.product, ''), substr(NEW.date, 1, 10), 1, NEW.id, NEW.date)
+    ON CONFLICT (product, day) DO UPDATE SET
+        count = count + 1,
+        latest_id = CASE WHEN excluded.latest_date > latest_date OR (excluded.latest_date = latest_date AND excluded.latest_id > latest_id) THEN excluded.latest_id ELSE latest_id END,
+        latest_date = CASE WHEN excluded.latest_date > latest_date THEN excluded.latest_date ELSE latest_date END;
+    INSERT INTO {table_name}_product_counts (product, count, latest_id, latest_date)
+    VALUES (COALESCE(NEW.product, ''), 1, NEW.id, NEW.date)
+    ON CONFLICT (product) DO UPDATE SET
+        count = count + 1,
+        latest_id = CASE WHEN excluded.latest_date > latest_date OR (excluded.latest_date = latest_date AND excluded.latest_id > latest_id) THEN excluded.latest_id ELSE latest_id END,
+        latest_date = CASE WHEN excluded.latest_date > latest_date THEN excluded.latest_date ELSE latest_date END;
+END;
+
+-- Removing the latest run of a day looks the next one up through the (product, date) index, removing the latest run
+-- of a product takes it from the product's last remaining day.
+CREATE TRIGGER IF NOT EXISTS {source_name}_aggregates_delete AFTER DELETE ON {source_name}
+BEGIN
+    UPDATE {table_name}_daily_counts SET count = count - 1
+    WHERE product = COALESCE(OLD.product, '') AND day = substr(OLD.date, 1, 10);
+    UPDATE {table_name}_daily_counts SET (latest_id, latest_date) = (
+        SELECT id, date FROM {source_name}
+        WHERE (product = COALESCE(OLD.product, '') OR (COALESCE(OLD.product, '') = '' AND product IS NULL))
+            AND date >= substr(OLD.date, 1, 10) AND substr(date, 1, 10) = substr(OLD.date, 1, 10)
+        ORDER BY date DESC, id DESC LIMIT 1
+    )
+    WHERE product = COALESCE(OLD.product, '') AND day = substr(OLD.date, 1, 10) AND latest_id = OLD.id;
+    DELETE FROM {table_name}_daily_counts WHERE product = COALESCE(OLD.product, '') AND day = substr(OLD.date, 1, 10) AND count <= 0;
+    UPDATE {table_name}_product_counts SET count = count - 1 WHERE product = COALESCE(OLD.product, '');
+    UPDATE {table_name}_product_counts SET (latest_id, latest_date) = (
+        SELECT latest_id, latest_date FROM {table_name}_daily_counts WHERE product = COALESCE(OLD.product, '') ORDER BY day DESC LIMIT 1
+    )
+    WHERE product = COALESCE(OLD.product, '') AND latest_id = OLD.id;
+    DELETE FROM {table_name}_product_counts WHERE product = COALESCE(OLD.product, '') AND count <= 0;
+END;
+
+-- An update is counted as the removal of the old row followed by the insertion of the new one
+CREATE TRIGGER IF NOT EXISTS {source_name}_aggregates_update AFTER UPDATE OF id, product, date ON {source_name}
+BEGIN
+    UPDATE {table_name}_daily_counts SET count = count - 1
+    WHERE product = COALESCE(OLD.product, '') AND day = substr(OLD.date, 1, 10);
+    UPDATE {table_name}_daily_counts SET (latest_id, latest_date) = (
+        SELECT id, date FROM {source_name}
+        WHERE (product = COALESCE(OLD.product, '') OR (COALESCE(OLD.product, '') = '' AND product IS NULL))
+            AND date >= substr(OLD.date, 1, 10) AND substr(date, 1, 10) = substr(OLD.date, 1, 10)
+        ORDER BY date DESC, id DESC LIMIT 1
+    )
+    WHERE product = COALESCE(OLD.product, '') AND day = substr(OLD.date, 1, 10) AND latest_id = OLD.id;
+    DELETE FROM {table_name}_daily_counts WHERE product = COALESCE(OLD.product, '') AND day = substr(OLD.date, 1, 10) AND count <= 0;
+    UPDATE {table_name}_product_counts SET count = count - 1 WHERE product = COALESCE(OLD.product, '');
+    UPDATE {table_name}_product_counts SET (latest_id, latest_date) = (
+        SELECT latest_id, latest_date FROM {table_name}_daily_counts WHERE product = COALESCE(OLD.product, '') ORDER BY day DESC LIMIT 1
+    )
+    WHERE product = COALESCE(OLD.product, '') AND latest_id = OLD.id;
+    DELETE FROM {table_name}_product_counts WHERE product = COALESCE(OLD.product, '') AND count <= 0;
+
+    INSERT INTO {table_name}_daily_counts (product, day, count, latest_id, latest_date)
+    VALUES (COALESCE(NEW.product, ''), substr(NEW.date, 1, 10), 1, NEW.id, NEW.date)
+    ON CONFLICT (product, day) DO UPDATE SET
+        count = count + 1,
+        latest_id = CASE WHEN excluded.latest_date > latest_date OR (excluded.latest_date = latest_date AND excluded.latest_id > latest_id) THEN excluded.latest_id ELSE latest_id END,
+        latest_date = CASE WHEN excluded.latest_date > latest_date THEN excluded.latest_date ELSE latest_date END;
+    INSERT INTO {table_name}_product_counts (product, count, latest_id, latest_date)
+    VALUES (COALESCE(NEW.product, ''), 1, NEW.id, NEW.date)
+    ON CONFLICT (product) DO UPDATE SET
+        count = count + 1,
+        latest_id = CASE WHEN excluded.latest_date > latest_date OR (excluded.latest_date = latest_date AND excluded.latest_id > latest_id) THEN excluded.latest_id ELSE latest_id END,
+        latest_date = CASE WHEN excluded.latest_date > latest_date THEN excluded.latest_date ELSE latest_date END;
+END;
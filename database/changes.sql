@@ -0,0 +1,33 @@
+-- One entry per row holding the change version of its latest insert, update or delete.
+-- created_version is 0 for rows that existed before change tracking was installed.
+CREATE TABLE IF NOT EXISTS {table_name}_changes (
+    row_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    created_version INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS {table_name}_changes_version ON {table_name}_changes (version);
+
+CREATE TRIGGER IF NOT EXISTS {table_name}_changes_insert AFTER INSERT ON {table_name}
+BEGIN
+    INSERT INTO {table_name}_changes (row_id, version, created_version, deleted)
+    VALUES (NEW.id, (SELECT COALESCE(MAX(version), 0) + 1 FROM {table_name}_changes), (SELECT COALESCE(MAX(version), 0) + 1 FROM {table_name}_changes), 0)
+    ON CONFLICT (row_id) DO UPDATE SET version = excluded.version, created_version = excluded.created_version, deleted = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS {table_name}_changes_update AFTER UPDATE ON {table_name}
+BEGIN
+    UPDATE {table_name}_changes SET version = (SELECT MAX(version) + 1 FROM {table_name}_changes), deleted = 1
+    WHERE row_id = OLD.id AND OLD.id != NEW.id;
+    INSERT INTO {table_name}_changes (row_id, version, created_version, deleted)
+    VALUES (NEW.id, (SELECT COALESCE(MAX(version), 0) + 1 FROM {table_name}_changes), 0, 0)
+    ON CONFLICT (row_id) DO UPDATE SET version = excluded.version, deleted = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS {table_name}_changes_delete AFTER DELETE ON {table_name}
+BEGIN
+    INSERT INTO {table_name}_changes (row_id, version, created_version, deleted)
+    VALUES (OLD.id, (SELECT COALESCE(MAX(version), 0) + 1 FROM {table_name}_changes), 0, 1)
+    ON CONFLICT (row_id) DO UPDATE SET version = excluded.version, deleted = 1;
+END;
@@ -1,12 +1,60 @@
 import os
 import sqlite3
-import pandas as pd
+import threading
+from contextlib import contextmanager
 import re
+import itertools
+
+from utils import lazy
+from cache import redis_cache
+from database import partitions, aggregates
+
+pd = lazy.lazy_import("pandas")
+pa = lazy.lazy_import("pyarrow")
+pc = lazy.lazy_import("pyarrow.compute")
 
 default_database_file:str = None
 default_database_table_name:str = None
 
 SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "schema.sql")
+CHANGES_SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "changes.sql")
+STATISTICS_SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "statistics.sql")
+INDEXES_SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "indexes.sql")
+
+# Arrow reads dictionary-encode these low-cardinality text columns and parse these date columns
+ARROW_DICTIONARY_COLUMNS = ["product", "name"]
+ARROW_DATE_COLUMNS = ["date"]
+
+# Values bound per "IN (...)" statement, well below SQLite's limit on host parameters
+IN_BATCH_SIZE = 500
+
+STATISTICS_COLUMNS = ["count", "min", "max", "mean", "std", "q05", "q25", "q50", "q75", "q95", "histogram"]
+
+# Applied to every pooled connection when it is opened. WAL lets readers run
+# concurrently with a single writer instead of serializing behind it.
+CONNECTION_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+}
+CONNECTION_TIMEOUT = 30.0
+
+connection_pool = threading.local()
+
+# sqlite3.Connection subclass used for new connections, e.g. to instrument the executed SQL
+connection_factory = sqlite3.Connection
+
+# Called as callback(db_file, table_name, deleted_rows) once rows have been deleted, e.g. to remove data files
+# that no row references anymore
+delete_callbacks = []
+
+schema_cache = {}
+schema_cache_lock = threading.Lock()
+
+result_cache_enabled = False
+
 
 def set_default_database_file(file_path):
     global default_database_file
@@ -18,402 +66,1288 @@ def set_default_database_table_name(table_name):
     default_database_table_name = table_name
 
 
-def sql_string_validator(input_string):
-    if not re.match(r"^[a-zA-Z0-9_,\s]*$", input_string):
-        raise ValueError("String must only contain letters, numbers, commas, and spaces.")
-
+def set_result_cache_enabled(enabled):
+    global result_cache_enabled
+    result_cache_enabled = enabled
 
-def get_dummy_df(rows=1, columns=1, header_text="Empty", cell_text="No data"):
-    return pd.DataFrame({f"{header_text} {i}": [cell_text]*rows for i in range(columns)})
 
+def set_connection_factory(factory):
+    global connection_factory
+    connection_factory = factory
 
-def get_db_connection(db_file=None):
-    """Returns a connection to the SQLite database."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
 
-    return sqlite3.connect(db_file)
+def register_delete_callback(callback):
+    if callback not in delete_callbacks:
+        delete_callbacks.append(callback)
 
 
-def initialize_database(db_file=None, table_name=None):
-    """ call database schema creation function to initialize the database and table """
+def resolve_database_file(db_file=None):
+    """Returns db_file, falling back to the default database file."""
     if db_file is None:
         if default_database_file is None:
             raise ValueError("Database file is not set.")
         db_file = default_database_file
+    return db_file
+
+
+def resolve_database_table_name(table_name=None):
+    """Returns the validated table_name, falling back to the default table name."""
     if table_name is None:
         if default_database_table_name is None:
             raise ValueError("Database table name is not set.")
         table_name = default_database_table_name
-    if table_exists(db_file, table_name):
+    sql_string_validator(table_name)
+    return table_name
+
+
+def sql_string_validator(input_string):
+    if not re.match(r"^[a-zA-Z0-9_,\s]*$", input_string):
+        raise ValueError("String must only contain letters, numbers, commas, and spaces.")
+
+
+def get_dummy_df(rows=1, columns=1, header_text="Empty", cell_text="No data"):
+    return pd.DataFrame({f"{header_text} {i}": [cell_text]*rows for i in range(columns)})
+
+
+def database_key(db_file):
+    """Returns a stable key identifying the database file across relative and absolute paths."""
+    return db_file if db_file == ":memory:" else os.path.abspath(db_file)
+
+
+def open_db_connection(db_file=None):
+    """Opens a new, unpooled connection to the SQLite database with the connection pragmas applied."""
+    db_file = resolve_database_file(db_file)
+
+    # isolation_level=None hands transaction control to transaction()
+    conn = sqlite3.connect(db_file, timeout=CONNECTION_TIMEOUT, isolation_level=None, factory=connection_factory)
+    for pragma, value in CONNECTION_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+
+def get_db_connection(db_file=None):
+    """Returns this thread's pooled connection to the SQLite database, opening it on first use."""
+    db_file = resolve_database_file(db_file)
+
+    # Connections must not cross a fork, so the pool is discarded in child processes
+    if getattr(connection_pool, "pid", None) != os.getpid():
+        connection_pool.pid = os.getpid()
+        connection_pool.connections = {}
+        connection_pool.pending_invalidations = {}
+
+    key = database_key(db_file)
+    conn = connection_pool.connections.get(key)
+    if conn is None:
+        conn = open_db_connection(db_file)
+        connection_pool.connections[key] = conn
+    return conn
+
+
+def close_db_connections():
+    """Closes all pooled connections owned by the calling thread."""
+    if getattr(connection_pool, "pid", None) != os.getpid():
+        return
+    for conn in connection_pool.connections.values():
+        conn.close()
+    connection_pool.connections = {}
+
+
+@contextmanager
+def transaction(db_file=None, write=True):
+    """Yields the pooled connection inside a transaction that is committed on success and rolled back on error.
+    Write transactions take the write lock up front. Nested calls join the outer transaction."""
+    conn = get_db_connection(db_file)
+    if conn.in_transaction:
+        yield conn
         return
-    execute_sql_script(SCHEMA_FILE, {"table_name": table_name}, db_file=db_file)
+
+    conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        get_pending_invalidations(db_file).clear()
+        raise
+    conn.commit()
+    # Results are invalidated once the writes are visible to other connections, see invalidate_table_results
+    pending_invalidations = get_pending_invalidations(db_file)
+    while pending_invalidations:
+        redis_cache.bump_table_version(pending_invalidations.pop())
+
+
+def get_pending_invalidations(db_file=None):
+    """Returns the result cache namespaces to invalidate once the calling thread's open transaction commits."""
+    get_db_connection(db_file)
+    return connection_pool.pending_invalidations.setdefault(database_key(resolve_database_file(db_file)), set())
+
+
+def initialize_database(db_file=None, table_name=None):
+    """ call database schema creation function to initialize the database and table """
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+    if not table_exists(db_file, table_name):
+        execute_sql_script(SCHEMA_FILE, {"table_name": table_name}, db_file=db_file)
+    # Change tracking is idempotent so it is also installed on databases created before it existed
+    execute_sql_script(CHANGES_SCHEMA_FILE, {"table_name": table_name}, db_file=db_file)
+    execute_sql_script(STATISTICS_SCHEMA_FILE, {"table_name": table_name}, db_file=db_file)
+    full_text_index_exists = table_exists(db_file, f"{table_name}_fts")
+    execute_sql_script(INDEXES_SCHEMA_FILE, {"table_name": table_name}, db_file=db_file)
+    if not full_text_index_exists:
+        with transaction(db_file) as conn:
+            conn.execute(f"INSERT INTO {table_name}_fts ({table_name}_fts) VALUES ('rebuild')")
+    aggregates_exist = table_exists(db_file, f"{table_name}_product_counts")
+    with transaction(db_file) as conn:
+        aggregates.install_aggregates(conn, table_name)
+    partitions.initialize_partitions(db_file, table_name)
+    if not aggregates_exist:
+        aggregates.rebuild_aggregates(db_file, table_name)
+    invalidate_table_schema(db_file, table_name)
+    invalidate_table_results(db_file, table_name)
 
 
 def execute_sql_script(script, args=None, db_file=None):
     """Executes a SQL script from a file."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
+    db_file = resolve_database_file(db_file)
 
-    conn = get_db_connection(db_file)
-    cursor = conn.cursor()
+    with open(script, "r") as fin:
+        sql_script = fin.read()
+
+    if args:
+        sql_script = sql_script.format(**args)
 
+    conn = get_db_connection(db_file)
+    if conn.in_transaction:
+        raise RuntimeError("SQL scripts cannot run inside an open transaction.")
+    try:
+        conn.executescript(f"BEGIN IMMEDIATE;\n{sql_script}\nCOMMIT;")
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+
+def run_sql_script(conn, script, args=None):
+    """Runs the statements of a SQL script file one by one on conn, inside its current transaction
+    (executescript would commit it first)."""
     with open(script, "r") as fin:
         sql_script = fin.read()
 
     if args:
         sql_script = sql_script.format(**args)
-    
-    cursor.executescript(sql_script)
-    conn.commit()
-    conn.close()
+
+    statement = ""
+    for part in sql_script.split(";"):
+        statement += part + ";"
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
 
 
 def table_exists(db_file=None, table_name=None):
     """Checks if the specified table exists in the database."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
 
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
-
-    conn = get_db_connection(db_file)
-    cursor = conn.cursor()
-    cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-    exists = cursor.fetchone() is not None
-    conn.close()
+    with transaction(db_file, write=False) as conn:
+        cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+        exists = cursor.fetchone() is not None
     return exists
 
 
 def add_row(row_data, db_file=None, table_name=None):
     """Adds a single row to the specified table."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
-
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
 
-    conn = get_db_connection(db_file)
-    cursor = conn.cursor()
     columns = ", ".join(row_data.keys())
     placeholders = ", ".join(["?"] * len(row_data))
     query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-    cursor.execute(query, tuple(row_data.values()))
-    conn.commit()
-    conn.close()
-    
-    
+    with transaction(db_file) as conn:
+        if partitions.is_partitioned(db_file, table_name):
+            partitions.insert_rows(conn, db_file, table_name, list(row_data), [tuple(row_data.values())])
+        else:
+            conn.execute(query, tuple(row_data.values()))
+    invalidate_table_results(db_file, table_name)
+
+
+def iter_row_chunks(rows, chunk_size):
+    """Yields (columns, list of value tuples) chunks from a DataFrame or an iterable of dictionaries. Dictionaries
+    are yielded in order, split into runs of rows with the same keys."""
+    if isinstance(rows, pd.DataFrame):
+        columns = [str(column) for column in rows.columns]
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows.iloc[start:start + chunk_size].copy()
+            for column in chunk.columns:
+                if pd.api.types.is_datetime64_any_dtype(chunk[column]):
+                    date_format = "%Y-%m-%d" if (chunk[column].dropna() == chunk[column].dropna().dt.normalize()).all() else "%Y-%m-%d %H:%M:%S"
+                    chunk[column] = chunk[column].dt.strftime(date_format)
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            yield columns, list(chunk.itertuples(index=False, name=None))
+        return
+
+    iterator = iter(rows)
+    while True:
+        chunk = []
+        for row in iterator:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                break
+        if not chunk:
+            return
+        # Runs of rows with the same keys are yielded separately, so columns a row leaves out get their DEFAULT
+        # rather than an explicit NULL
+        for _, group in itertools.groupby(chunk, key=frozenset):
+            group = list(group)
+            columns = list(group[0])
+            yield columns, [tuple(row[column] for column in columns) for row in group]
+
+
+def add_rows(rows, chunk_size=10000, db_file=None, table_name=None):
+    """Adds many rows to the specified table in a single transaction and returns their ids.
+    rows can be a DataFrame, a list of dictionaries or any iterable of dictionaries. Columns that don't exist yet are added first."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    if isinstance(rows, (list, tuple)):
+        columns = list(dict.fromkeys(column for row in rows for column in row))
+    elif isinstance(rows, pd.DataFrame):
+        columns = [str(column) for column in rows.columns]
+    else:
+        columns = []
+
+    ids = []
+    with transaction(db_file) as conn:
+        partitioned = partitions.is_partitioned(db_file, table_name)
+        existing_columns = set(get_column_names(db_file, table_name))
+        for column in columns:
+            sql_string_validator(column)
+            if column not in existing_columns:
+                add_column(column, db_file=db_file, table_name=table_name)
+                existing_columns.add(column)
+
+        for chunk_columns, values in iter_row_chunks(rows, chunk_size):
+            for column in chunk_columns:
+                sql_string_validator(column)
+                if column not in existing_columns:
+                    add_column(column, db_file=db_file, table_name=table_name)
+                    existing_columns.add(column)
+
+            query = f"INSERT INTO {table_name} ({', '.join(chunk_columns)}) VALUES ({', '.join(['?'] * len(chunk_columns))})"
+            if partitioned:
+                ids.extend(partitions.insert_rows(conn, db_file, table_name, chunk_columns, values))
+            elif "id" in chunk_columns:
+                # Explicit ids may be mixed with auto-assigned ones, so read each one back
+                cursor = conn.cursor()
+                for value in values:
+                    cursor.execute(query, value)
+                    ids.append(cursor.lastrowid)
+            else:
+                # Inserts inside one write transaction get consecutive ids ending at last_insert_rowid()
+                conn.executemany(query, values)
+                last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                ids.extend(range(last_id - len(values) + 1, last_id + 1))
+    invalidate_table_results(db_file, table_name)
+    return ids
+
+
 def delete_row(row_id, db_file=None, table_name=None):
     """Deletes a single row from the specified table. WARNING: Don't use this function unless you know what you're doing."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
-
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
-        
     if row_id is None:
         return
-    
-    if row_id not in get_table_as_df(db_file, table_name)["id"].values:
-        return
+    apply_mutations([{"op": "delete", "ids": [row_id]}], db_file=db_file, table_name=table_name)
 
-    conn = get_db_connection(db_file)
-    cursor = conn.cursor()
-    query = f"DELETE FROM {table_name} WHERE id = ?"
-    cursor.execute(query, (row_id,))
-    conn.commit()
-    conn.close()
+
+def count_datapath_references(datapaths, db_file=None, table_name=None):
+    """Returns {datapath: number of rows referencing it} for the given datapaths, counted through the datapath index."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    datapaths = list(dict.fromkeys(datapaths))
+    references = dict.fromkeys(datapaths, 0)
+    with transaction(db_file, write=False) as conn:
+        for table in partitions.get_read_tables(None, db_file, table_name):
+            for start in range(0, len(datapaths), IN_BATCH_SIZE):
+                batch = datapaths[start:start + IN_BATCH_SIZE]
+                query = f"SELECT datapath, COUNT(*) FROM {table} WHERE datapath IN ({', '.join(['?'] * len(batch))}) GROUP BY datapath"
+                for datapath, count in conn.execute(query, batch):
+                    references[datapath] += count
+    return references
 
 
 def add_column(column_name, db_file=None, table_name=None):
     """Adds a single column to the specified table."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
 
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
-        
     if column_name in get_column_names(db_file, table_name):
         return
-    
+
     sql_string_validator(column_name)
 
-    conn = get_db_connection(db_file)
-    cursor = conn.cursor()
-    query = f"ALTER TABLE {table_name} ADD COLUMN {column_name}"
-    cursor.execute(query)
-    conn.commit()
-    conn.close()
-    
-    
+    with transaction(db_file) as conn:
+        # Partitions share the columns of their partitioned table
+        for table in [table_name] + partitions.get_partition_names(db_file, table_name):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column_name}")
+    invalidate_table_schema(db_file, table_name)
+    invalidate_table_results(db_file, table_name)
+
+
 def delete_column(column_name, db_file=None, table_name=None):
-    """Deletes a single column from the specified table. WARNING: Don't use this function unless you know what you're doing."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
+    """Deletes a single column from the specified table. WARNING: Don't use this function unless you know what you're doing.
+    Raises a ValueError when the column is used by an index or trigger (see check_columns_droppable)."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
 
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
-        
     if column_name not in get_column_names(db_file, table_name):
         return
-    
+
     if is_primary_key(column_name, db_file, table_name):
         return
-    
-    sql_string_validator(column_name)
 
-    conn = get_db_connection(db_file)
-    cursor = conn.cursor()
-    query = f"ALTER TABLE {table_name} DROP COLUMN {column_name}"
-    cursor.execute(query)
-    conn.commit()
-    conn.close()
-    
-    
-def refactor_columns(columns, db_file=None, table_name=None):
-    """Refactors the columns of the table. WARNING: Don't use this function unless you know what you're doing."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
-
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
+    sql_string_validator(column_name)
 
-    sql_string_validator(table_name)
+    with transaction(db_file) as conn:
+        check_columns_droppable(conn, table_name, [column_name])
+        partition_names = partitions.get_partition_names(db_file, table_name)
+        if partition_names:
+            # DROP COLUMN re-parses the whole schema, which grows with the partitions, so they are rebuilt instead
+            kept_columns = [column for column in get_column_names(db_file, table_name) if column != column_name]
+            for table in [table_name] + partition_names:
+                rebuild_table(conn, table, kept_columns, [], rename=False)
+        else:
+            conn.execute(f"ALTER TABLE {table_name} DROP COLUMN {column_name}")
+    invalidate_table_schema(db_file, table_name)
+    invalidate_table_results(db_file, table_name)
+
+
+def find_column_dependents(conn, table_name, columns):
+    """Returns {column: [names of the indexes and triggers of table_name using it]} for the given columns that are
+    used by any. Triggers use the columns they read through NEW/OLD or watch with UPDATE OF."""
+    dependents = {}
+    for name, object_type, sql in conn.execute("SELECT name, type, sql FROM sqlite_master WHERE tbl_name=? AND type IN ('index', 'trigger') AND sql IS NOT NULL", (table_name,)).fetchall():
+        if object_type == "index":
+            used = {column[2] for column in conn.execute(f"PRAGMA index_info({name})").fetchall()}
+        else:
+            used = set(re.findall(r"\b(?:NEW|OLD)\.(\w+)", sql, re.IGNORECASE))
+            for update_of in re.findall(r"\bUPDATE\s+OF\s+(.+?)\s+ON\b", sql, re.IGNORECASE | re.DOTALL):
+                used.update(column.strip() for column in update_of.split(","))
+        for column in columns:
+            if column in used:
+                dependents.setdefault(column, []).append(name)
+    return dependents
+
+
+def check_columns_droppable(conn, table_name, columns):
+    """Raises a ValueError when an index or trigger of table_name uses one of the columns. Dropping such a column
+    (e.g. product or date, which the aggregates are maintained from, or name, which the full-text index is synced
+    from) would leave triggers that make every later write fail."""
+    dependents = find_column_dependents(conn, table_name, columns)
+    if dependents:
+        raise ValueError("Columns used by indexes or triggers can't be dropped: " + "; ".join(f"{column} ({', '.join(names)})" for column, names in dependents.items()))
+
+
+def refactor_columns(columns, db_file=None, table_name=None, progress_callback=None, batch_size=100000):
+    """Refactors the columns of the table. WARNING: Don't use this function unless you know what you're doing.
+    Columns are only added when nothing is dropped. Otherwise the table is rebuilt once with the final set of
+    columns, calling progress_callback(copied_rows, total_rows) after every batch of copied rows. Raises a ValueError,
+    before changing anything, when a dropped column is used by an index or trigger (see check_columns_droppable)."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
 
     for column in columns:
         sql_string_validator(column)
-        if column not in get_column_names():
-            add_column(column, db_file=db_file, table_name=table_name)
-            
-    for column in get_column_names():
-        sql_string_validator(column)
-        if is_primary_key(column, db_file=db_file, table_name=table_name):
-            continue
-        if column not in columns:
-            delete_column(column, db_file=db_file, table_name=table_name)
+
+    schema = get_table_schema(db_file, table_name)
+    added_columns = [column for column in dict.fromkeys(columns) if column not in schema["columns"]]
+    kept_columns = [column for column in schema["columns"] if column == schema["primary_key"] or column in columns]
+    if not added_columns and len(kept_columns) == len(schema["columns"]):
+        return [column.replace(" ", "") for column in columns]
+
+    with transaction(db_file) as conn:
+        check_columns_droppable(conn, table_name, [column for column in schema["columns"] if column not in kept_columns])
+        partition_names = partitions.get_partition_names(db_file, table_name)
+        for table in [table_name] + partition_names:
+            if len(kept_columns) == len(schema["columns"]):
+                # ADD COLUMN only touches the schema, no rewrite needed
+                for column in added_columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+            else:
+                rebuild_table(conn, table, kept_columns, added_columns, progress_callback, batch_size, rename=not partition_names)
+    invalidate_table_schema(db_file, table_name)
+    invalidate_table_results(db_file, table_name)
 
     return [column.replace(" ", "") for column in columns]
 
 
-def edit_cell(row_id, column_name, new_value, db_file=None, table_name=None):
-    """Edits a single cell in the specified table."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
+def rebuild_table(conn, table_name, kept_columns, added_columns, progress_callback=None, batch_size=100000, rename=True):
+    """Rewrites table_name with only kept_columns plus added_columns: create a new table, copy the kept columns over
+    in rowid batches, drop the old table and rename the new one into place. Indexes and triggers are recreated,
+    except indexes on dropped columns. Must run inside a write transaction.
+    ALTER TABLE re-parses the whole schema, so without rename the rows are instead copied a second time into a table
+    created under the old name, which is faster for the small tables of a schema with many partitions."""
+    rebuilt_table_name = f"{table_name}_rebuild"
+    create_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone()[0]
+    autoincrement = "AUTOINCREMENT" in create_sql.upper()
 
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
+    definitions = get_column_definitions(conn, table_name, kept_columns, autoincrement) + added_columns
+
+    dependents = []
+    for name, object_type, sql in conn.execute("SELECT name, type, sql FROM sqlite_master WHERE tbl_name=? AND type IN ('index', 'trigger') AND sql IS NOT NULL", (table_name,)).fetchall():
+        if object_type == "index" and any(column[2] not in kept_columns for column in conn.execute(f"PRAGMA index_info({name})").fetchall()):
+            continue
+        dependents.append(sql)
+
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table_name,)).fetchone() if autoincrement else None
+
+    conn.execute(f"DROP TABLE IF EXISTS {rebuilt_table_name}")
+    conn.execute(f"CREATE TABLE {rebuilt_table_name} ({', '.join(definitions)})")
+
+    column_list = ", ".join(kept_columns)
+    total_rows = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    copied_rows, last_rowid = 0, None
+    while copied_rows < total_rows:
+        where = "" if last_rowid is None else "WHERE rowid > ?"
+        params = ([] if last_rowid is None else [last_rowid]) + [batch_size]
+        cursor = conn.execute(f"INSERT INTO {rebuilt_table_name} (rowid, {column_list}) SELECT rowid, {column_list} FROM {table_name} {where} ORDER BY rowid LIMIT ?", params)
+        if cursor.rowcount <= 0:
+            break
+        copied_rows += cursor.rowcount
+        last_rowid = conn.execute(f"SELECT MAX(rowid) FROM {rebuilt_table_name}").fetchone()[0]
+        if progress_callback is not None:
+            progress_callback(copied_rows, total_rows)
+
+    conn.execute(f"DROP TABLE {table_name}")
+    if rename:
+        conn.execute(f"ALTER TABLE {rebuilt_table_name} RENAME TO {table_name}")
+    else:
+        column_list = ", ".join(kept_columns + added_columns)
+        conn.execute(f"CREATE TABLE {table_name} ({', '.join(definitions)})")
+        conn.execute(f"INSERT INTO {table_name} (rowid, {column_list}) SELECT rowid, {column_list} FROM {rebuilt_table_name}")
+        conn.execute(f"DROP TABLE {rebuilt_table_name}")
+    for sql in dependents:
+        conn.execute(sql)
+    if sequence is not None:
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name=?", (sequence[0], table_name))
+        if conn.execute("SELECT changes()").fetchone()[0] == 0:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table_name, sequence[0]))
+
+
+def get_column_definitions(conn, table_name, columns=None, autoincrement=False):
+    """Returns the column definitions of a table (optionally only some columns) for a CREATE TABLE statement."""
+    definitions = []
+    for _, name, column_type, not_null, default, primary_key in conn.execute(f"PRAGMA table_info({table_name})").fetchall():
+        if columns is not None and name not in columns:
+            continue
+        definition = f"{name} {column_type}".strip()
+        if primary_key:
+            definition += " PRIMARY KEY AUTOINCREMENT" if autoincrement else " PRIMARY KEY"
+        if not_null:
+            definition += " NOT NULL"
+        if default is not None:
+            definition += f" DEFAULT {default}"
+        definitions.append(definition)
+    return definitions
 
+
+def edit_cell(row_id, column_name, new_value, db_file=None, table_name=None):
+    """Edits a single cell in the specified table."""
     if column_name not in get_column_names(db_file, table_name):
         return
-    
-    sql_string_validator(column_name)
+    apply_mutations([{"op": "edit_cell", "id": row_id, "column": column_name, "value": new_value}], db_file=db_file, table_name=table_name)
+
 
-    conn = get_db_connection(db_file)
-    cursor = conn.cursor()
-    query = f"UPDATE {table_name} SET {column_name} = ? WHERE id = ?"
-    cursor.execute(query, (new_value, row_id))
-    conn.commit()
-    conn.close()
-    
-    
 def edit_row(row_id, new_row_data, db_file=None, table_name=None):
     """Edits a single row in the specified table."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
+    apply_mutations([{"op": "edit_row", "id": row_id, "values": dict(new_row_data)}], db_file=db_file, table_name=table_name)
+
+
+class ConflictError(Exception):
+    """Raised by apply_mutations when rows it would write changed after the change version the caller expected."""
+
+    def __init__(self, row_ids, version):
+        super().__init__(f"{len(row_ids)} rows changed after version {version}")
+        self.row_ids = row_ids
+        self.version = version
+
+
+def find_conflicts(conn, table_name, row_ids, version):
+    """Returns the rows among row_ids that were updated or deleted after the given change version."""
+    row_ids = list(dict.fromkeys(row_ids))
+    conflicts = []
+    for start in range(0, len(row_ids), IN_BATCH_SIZE):
+        batch = row_ids[start:start + IN_BATCH_SIZE]
+        query = f"SELECT row_id FROM {table_name}_changes WHERE version > ? AND row_id IN ({', '.join(['?'] * len(batch))})"
+        conflicts.extend(row_id for row_id, in conn.execute(query, [version] + batch))
+    return conflicts
+
+
+def parse_mutation(mutation, column_names):
+    """Returns (values, row_ids) of a mutation, values being None for deletes."""
+    op = mutation.get("op")
+    if op == "edit_cell":
+        values, row_ids = {mutation["column"]: mutation["value"]}, [mutation["id"]]
+    elif op == "edit_row":
+        values, row_ids = dict(mutation["values"]), [mutation["id"]]
+    elif op == "delete":
+        values, row_ids = None, list(dict.fromkeys(mutation["ids"]))
+    else:
+        raise ValueError(f"Unknown mutation: {op}")
+    for column in values or ():
+        if column not in column_names:
+            raise ValueError(f"Unknown column: {column}")
+        sql_string_validator(column)
+    return values, row_ids
+
+
+def apply_mutations(mutations, expected_version=None, db_file=None, table_name=None):
+    """Applies a batch of cell edits, row edits and deletes in order, in a single transaction, and returns
+    {"affected": [rows affected by each mutation], "version": change version after the batch}. Mutations are
+    {"op": "edit_cell", "id", "column", "value"}, {"op": "edit_row", "id", "values": {column: value}} or
+    {"op": "delete", "ids": [...]}. Consecutive mutations running the same statement are sent with executemany.
+    With expected_version, the change version the caller read the rows at, the whole batch is rejected with a
+    ConflictError when any row it touches has been updated or deleted since."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    column_names = set(get_column_names(db_file, table_name))
+    steps = [parse_mutation(mutation, column_names) for mutation in mutations]
+    touched = [row_id for _, row_ids in steps for row_id in row_ids]
+
+    affected, deleted_rows = [], []
+    with transaction(db_file) as conn:
+        if expected_version is not None:
+            conflicts = find_conflicts(conn, table_name, touched, expected_version)
+            if conflicts:
+                raise ConflictError(conflicts, expected_version)
+
+        # Where every existing row lives, so edits and deletes of missing rows are counted as no-ops up front
+        partitioned = partitions.is_partitioned(db_file, table_name)
+        if partitioned:
+            row_tables = partitions.find_row_tables(conn, db_file, table_name, touched)
+        else:
+            row_tables = {}
+            unique_ids = list(dict.fromkeys(touched))
+            for start in range(0, len(unique_ids), IN_BATCH_SIZE):
+                batch = unique_ids[start:start + IN_BATCH_SIZE]
+                query = f"SELECT id FROM {table_name} WHERE id IN ({', '.join(['?'] * len(batch))})"
+                row_tables.update((row_id, table_name) for row_id, in conn.execute(query, batch))
+
+        def statement(values):
+            # Date edits of a partitioned table may move the row, so they don't share a statement
+            if values is None:
+                return ("delete",)
+            if partitioned and "date" in values:
+                return None
+            return ("edit",) + tuple(values)
+
+        for key, group in itertools.groupby(steps, key=lambda step: statement(step[0])):
+            group = list(group)
+            if key is None:
+                for values, (row_id,) in group:
+                    moved = partitions.update_row(conn, db_file, table_name, row_id, values)
+                    affected.append(int(moved))
+                    if moved:
+                        row_tables.pop(row_id, None)
+                        row_tables[values.get("id", row_id)] = partitions.find_row_table(conn, db_file, table_name, values.get("id", row_id))
+            elif key[0] == "edit":
+                updates = {}
+                for values, (row_id,) in group:
+                    table = row_tables.get(row_id)
+                    affected.append(int(table is not None))
+                    if table is not None:
+                        updates.setdefault(table, []).append(tuple(values.values()) + (row_id,))
+                        if values.get("id", row_id) != row_id:
+                            row_tables[values["id"]] = row_tables.pop(row_id)
+                assignments = ", ".join(f"{column} = ?" for column in key[1:])
+                for table, parameters in updates.items() if assignments else ():
+                    conn.executemany(f"UPDATE {table} SET {assignments} WHERE id = ?", parameters)
+            else:
+                deletes = {}
+                for _, row_ids in group:
+                    existing = [row_id for row_id in row_ids if row_id in row_tables]
+                    affected.append(len(existing))
+                    for row_id in existing:
+                        deletes.setdefault(row_tables.pop(row_id), []).append(row_id)
+                for table, row_ids in deletes.items():
+                    for start in range(0, len(row_ids), IN_BATCH_SIZE):
+                        batch = row_ids[start:start + IN_BATCH_SIZE]
+                        placeholders = ", ".join(["?"] * len(batch))
+                        if delete_callbacks:
+                            cursor = conn.execute(f"SELECT * FROM {table} WHERE id IN ({placeholders})", batch)
+                            columns = [description[0] for description in cursor.description]
+                            deleted_rows.extend(dict(zip(columns, row)) for row in cursor.fetchall())
+                        conn.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", batch)
+        version = conn.execute(f"SELECT COALESCE(MAX(version), 0) FROM {table_name}_changes").fetchone()[0]
+    invalidate_table_results(db_file, table_name)
+    if deleted_rows:
+        for callback in delete_callbacks:
+            callback(db_file, table_name, deleted_rows)
+    return {"affected": affected, "version": version}
 
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
 
-    conn = get_db_connection(db_file)
-    cursor = conn.cursor()
-    columns = new_row_data.keys()
-    query = f"UPDATE {table_name} SET {', '.join([f'{column} = ?' for column in columns])} WHERE id = ?"
-    cursor.execute(query, tuple(new_row_data.values()) + (row_id,))
-    conn.commit()
-    conn.close()
-    
-    
 def get_row(row_id, db_file=None, table_name=None):
     """Returns a single row as a dictionary."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
-
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
-
-    conn = get_db_connection(db_file)
-    query = f"SELECT * FROM {table_name} WHERE id = ?"
-    row = pd.read_sql_query(query, conn, params=(row_id,)).to_dict("records")[0]
-    conn.close()
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    with transaction(db_file, write=False) as conn:
+        if partitions.is_partitioned(db_file, table_name):
+            table_name = partitions.find_row_table(conn, db_file, table_name, row_id) or table_name
+        query = f"SELECT * FROM {table_name} WHERE id = ?"
+        row = pd.read_sql_query(query, conn, params=(row_id,)).to_dict("records")[0]
     return row
 
 
 def get_column(column_name, db_file=None, table_name=None):
     """Returns a single column as a pandas Series with the id as the index."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
 
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
-        
     if column_name not in get_column_names(db_file, table_name):
         return pd.Series()
-    
+
     sql_string_validator(column_name)
 
-    conn = get_db_connection(db_file)
-    query = f"SELECT id, {column_name} FROM {table_name}"
-    series = pd.read_sql_query(query, conn, index_col="id")[column_name]
-    conn.close()
-    return series
+    def read(table):
+        with transaction(db_file, write=False) as conn:
+            return pd.read_sql_query(f"SELECT id, {column_name} FROM {table}", conn, index_col="id")[column_name]
+
+    def load():
+        columns = partitions.map_tables(read, partitions.get_read_tables(None, db_file, table_name), db_file, table_name)
+        return columns[0] if len(columns) == 1 else pd.concat(columns).sort_index()
+
+    return cached_read("get_column", [column_name], load, db_file, table_name)
 
 
 def get_table_as_df(db_file=None, table_name=None):
     """Returns the specified table as a pandas DataFrame."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
 
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
+    def read(table):
+        with transaction(db_file, write=False) as conn:
+            return pd.read_sql_query(f"SELECT * FROM {table}", conn)
 
-    conn = get_db_connection(db_file)
-    query = f"SELECT * FROM {table_name}"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+    def load():
+        # Partitions are read in parallel and put back in id order, the order of an unpartitioned table
+        frames = partitions.map_tables(read, partitions.get_read_tables(None, db_file, table_name), db_file, table_name)
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True).sort_values("id", ignore_index=True)
+
+    return cached_read("get_table_as_df", [], load, db_file, table_name)
 
 
 def get_table_as_list(db_file=None, table_name=None):
     """Returns the specified table as a list of dictionaries."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    def read(table):
+        with transaction(db_file, write=False) as conn:
+            cursor = conn.execute(f"SELECT * FROM {table}")
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    tables = partitions.map_tables(read, partitions.get_read_tables(None, db_file, table_name), db_file, table_name)
+    return tables[0] if len(tables) == 1 else sorted((row for table in tables for row in table), key=lambda row: row["id"])
+
+
+FILTER_OPERATORS = {
+    "=": "{column} = ?",
+    "!=": "{column} != ?",
+    "<": "{column} < ?",
+    "<=": "{column} <= ?",
+    ">": "{column} > ?",
+    ">=": "{column} >= ?",
+    "between": "{column} BETWEEN ? AND ?",
+    "in": "{column} IN ({placeholders})",
+    "prefix": "({column} >= ? AND {column} < ?)",
+    "match": "id IN (SELECT rowid FROM {table_name}_fts WHERE {table_name}_fts MATCH ?)",
+    "contains": "{column} LIKE ? ESCAPE '\\'",
+    "not_contains": "{column} NOT LIKE ? ESCAPE '\\'",
+    "starts_with": "{column} LIKE ? ESCAPE '\\'",
+    "ends_with": "{column} LIKE ? ESCAPE '\\'",
+    "is_null": "({column} IS NULL OR {column} = '')",
+    "not_null": "({column} IS NOT NULL AND {column} != '')",
+}
+
+
+def escape_like(value):
+    return str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+FULL_TEXT_COLUMNS = ["name"]
+
+
+def full_text_query(text):
+    """Turns free text into an FTS5 query matching rows that contain every word, each word as a prefix."""
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in str(text).split())
+
+
+def build_where_clause(filters, column_names, table_name=None):
+    """Builds a parametrized WHERE clause from a list of filters.
+    A filter is either {"column": ..., "op": ..., "value": ...} or {"any": [filters]} / {"all": [filters]}.
+    "prefix" is an index-friendly, case-sensitive starts-with and "match" a full-text search of the table's FTS index,
+    which needs table_name. Returns the clause (empty when there are no filters) and its parameters."""
+    def build(node):
+        if "any" in node or "all" in node:
+            parts = [build(child) for child in node.get("any", node.get("all"))]
+            parts = [part for part in parts if part[0]]
+            if not parts:
+                return "", []
+            joiner = " OR " if "any" in node else " AND "
+            return "(" + joiner.join(sql for sql, _ in parts) + ")", [param for _, params in parts for param in params]
+
+        column, op, value = node["column"], node["op"], node.get("value")
+        if column not in column_names:
+            raise ValueError(f"Unknown column: {column}")
+        if op not in FILTER_OPERATORS:
+            raise ValueError(f"Unknown filter operator: {op}")
+        if op == "in" and not value:
+            return "0", []
+        if op == "match" and (table_name is None or column not in FULL_TEXT_COLUMNS):
+            raise ValueError(f"Column {column} has no full-text index")
+        sql = FILTER_OPERATORS[op].format(column=column, table_name=table_name, placeholders=", ".join(["?"] * len(value or [])) if op == "in" else "")
+        if op in ("between", "in"):
+            params = list(value)
+        elif op == "prefix":
+            value = str(value)
+            params = [value, value[:-1] + chr(ord(value[-1]) + 1)] if value else ["", "\U0010ffff"]
+        elif op == "match":
+            params = [full_text_query(value)]
+        elif op in ("contains", "not_contains"):
+            params = [f"%{escape_like(value)}%"]
+        elif op == "starts_with":
+            params = [f"{escape_like(value)}%"]
+        elif op == "ends_with":
+            params = [f"%{escape_like(value)}"]
+        elif op in ("is_null", "not_null"):
+            params = []
+        else:
+            params = [value]
+        return sql, params
+
+    sql, params = build({"all": filters or []})
+    return (f" WHERE {sql}" if sql else ""), params
+
+
+def build_order_clause(sort_model, column_names, stable=True):
+    """Builds an ORDER BY clause from [(column, "asc" | "desc"), ...]. With stable set it always ends on id so
+    paging is stable, otherwise an empty sort model leaves the order to the query planner."""
+    terms = []
+    for column, direction in sort_model or []:
+        if column not in column_names:
+            raise ValueError(f"Unknown column: {column}")
+        if direction.lower() not in ("asc", "desc"):
+            raise ValueError(f"Unknown sort direction: {direction}")
+        terms.append(f"{column} {direction.upper()}")
+    if not stable and not terms:
+        return ""
+    if "id" not in [column for column, _ in sort_model or []]:
+        terms.append("id ASC")
+    return " ORDER BY " + ", ".join(terms)
+
+
+def get_table_page(start_row=0, end_row=None, sort_model=None, filters=None, db_file=None, table_name=None):
+    """Returns one page of the filtered and sorted table as a list of dictionaries, along with the filtered row count."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    column_names = get_column_names(db_file, table_name)
+    order = build_order_clause(sort_model, column_names)
+    limit = -1 if end_row is None else max(end_row - start_row, 0)
+    tables = partitions.get_read_tables(filters, db_file, table_name)
+
+    def read(table, limit, offset):
+        where, params = build_where_clause(filters, column_names, table)
+        with transaction(db_file, write=False) as conn:
+            row_count = conn.execute(f"SELECT COUNT(*) FROM {table}{where}", params).fetchone()[0]
+            cursor = conn.execute(f"SELECT * FROM {table}{where}{order} LIMIT ? OFFSET ?", params + [limit, offset])
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()], row_count
+
+    def load():
+        if len(tables) == 1:
+            return read(tables[0], limit, start_row)
+        # Every partition returns its first end_row rows, which the merge cuts down to the page
+        pages = partitions.map_tables(lambda table: read(table, -1 if end_row is None else end_row, 0), tables, db_file, table_name)
+        merged = partitions.merge_sorted([rows for rows, _ in pages], partitions.sort_terms(sort_model))
+        rows = list(itertools.islice(merged, start_row, end_row))
+        return rows, sum(row_count for _, row_count in pages)
+
+    rows, row_count = cached_read("get_table_page", [start_row, end_row, sort_model, filters], load, db_file, table_name)
+    return rows, row_count
+
+
+def build_select_query(columns=None, filters=None, order_by=None, limit=None, offset=0, db_file=None, table_name=None):
+    """Returns the parametrized SELECT statement and parameters used by query_rows on a single (unpartitioned) table."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    column_names = get_column_names(db_file, table_name)
+    for column in columns or []:
+        if column not in column_names:
+            raise ValueError(f"Unknown column: {column}")
+    where, params = build_where_clause(filters, column_names, table_name)
+    order = build_order_clause(order_by, column_names, stable=False)
+    query = f"SELECT {', '.join(columns) if columns else '*'} FROM {table_name}{where}{order}"
+    if limit is not None or offset:
+        query += " LIMIT ? OFFSET ?"
+        params = params + [-1 if limit is None else limit, offset]
+    return query, params
+
+
+def query_rows(columns=None, filters=None, order_by=None, limit=None, offset=0, db_file=None, table_name=None):
+    """Returns the rows matching the filters as a list of dictionaries.
+    Filters support equality, ranges, prefix and full-text search (see build_where_clause) and are answered from the
+    product/date/name indexes and the name full-text index where possible. order_by is [(column, "asc" | "desc"), ...]."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    tables = partitions.get_read_tables(filters, db_file, table_name)
+    if len(tables) == 1:
+        query, params = build_select_query(columns, filters, order_by, limit, offset, db_file, tables[0])
+
+        def load():
+            with transaction(db_file, write=False) as conn:
+                cursor = conn.execute(query, params)
+                column_names = [description[0] for description in cursor.description]
+                return [dict(zip(column_names, row)) for row in cursor.fetchall()]
+
+        return cached_read("query_rows", [query, params], load, db_file, table_name)
+
+    # Partitions are queried in parallel for their first offset + limit rows, including the sort columns needed to merge them
+    terms = partitions.sort_terms(order_by, stable=False)
+    merge_columns = columns and columns + [column for column, _ in terms if column not in columns]
+
+    def read(table):
+        query, params = build_select_query(merge_columns, filters, order_by, None if limit is None else offset + limit, 0, db_file, table)
+        with transaction(db_file, write=False) as conn:
+            cursor = conn.execute(query, params)
+            column_names = [description[0] for description in cursor.description]
+            return [dict(zip(column_names, row)) for row in cursor.fetchall()]
+
+    def load():
+        merged = partitions.merge_sorted(partitions.map_tables(read, tables, db_file, table_name), terms)
+        rows = list(itertools.islice(merged, offset, None if limit is None else offset + limit))
+        if merge_columns != columns:
+            rows = [{column: row[column] for column in columns} for row in rows]
+        return rows
+
+    return cached_read("query_rows", [tables, columns, filters, order_by, limit, offset], load, db_file, table_name)
+
+
+def explain_query_rows(columns=None, filters=None, order_by=None, limit=None, offset=0, db_file=None, table_name=None):
+    """Returns the EXPLAIN QUERY PLAN details of the query that query_rows would run, one string per plan step."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    plan = []
+    with transaction(db_file, write=False) as conn:
+        for table in partitions.get_read_tables(filters, db_file, table_name):
+            query, params = build_select_query(columns, filters, order_by, limit, offset, db_file, table)
+            steps = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()]
+            # Steps of partitions are prefixed with the partition they run on
+            plan += steps if table == table_name else [f"{table}: {step}" for step in steps]
+    return plan
+
+
+def plan_uses_index(plan, index_name):
+    """Returns whether a query plan from explain_query_rows uses the given index (or full-text table)."""
+    return any(re.search(rf"\b(INDEX {index_name}|SCAN {index_name} VIRTUAL TABLE)\b", step) for step in plan)
+
+
+def iter_table_rows(chunk_size=10000, columns=None, filters=None, sort_model=None, db_file=None, table_name=None):
+    """Yields (column_names, list of row tuples) chunks of at most chunk_size rows.
+    Rows are fetched incrementally from a dedicated connection inside one read transaction, so memory stays
+    constant regardless of table size and every chunk comes from the same snapshot. The partitions of a
+    partitioned table are streamed side by side and merged in sort order."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    column_names = get_column_names(db_file, table_name)
+    for column in columns or []:
+        if column not in column_names:
+            raise ValueError(f"Unknown column: {column}")
+    order = build_order_clause(sort_model, column_names)
+    tables = partitions.get_read_tables(filters, db_file, table_name)
+    terms = partitions.sort_terms(sort_model)
+    # Merging partitions needs the sort columns, which are dropped again from the yielded rows
+    query_columns = columns and columns + [column for column, _ in terms if column not in columns and len(tables) > 1]
+
+    conn = open_db_connection(db_file)
+    try:
+        conn.execute("BEGIN")
+        cursors = []
+        for table in tables:
+            where, params = build_where_clause(filters, column_names, table)
+            cursors.append(conn.execute(f"SELECT {', '.join(query_columns) if query_columns else '*'} FROM {table}{where}{order}", params))
+        cursor_columns = [description[0] for description in cursors[0].description]
+        if len(cursors) == 1:
+            chunks = iter(lambda: cursors[0].fetchmany(chunk_size), [])
+        else:
+            merged = partitions.merge_sorted(cursors, terms, cursor_columns)
+            width = len(columns) if columns else len(cursor_columns)
+            chunks = iter(lambda: [row[:width] for row in itertools.islice(merged, chunk_size)], [])
+            cursor_columns = cursor_columns[:width]
+        for rows in chunks:
+            yield cursor_columns, rows
+    finally:
+        conn.close()
+
+
+def iter_table_records(chunk_size=10000, columns=None, filters=None, sort_model=None, db_file=None, table_name=None):
+    """Yields the table as lists of at most chunk_size dictionaries."""
+    for column_names, rows in iter_table_rows(chunk_size, columns, filters, sort_model, db_file, table_name):
+        yield [dict(zip(column_names, row)) for row in rows]
+
+
+def iter_table_chunks(chunk_size=10000, columns=None, filters=None, sort_model=None, db_file=None, table_name=None):
+    """Yields the table as pandas DataFrames of at most chunk_size rows."""
+    for column_names, rows in iter_table_rows(chunk_size, columns, filters, sort_model, db_file, table_name):
+        yield pd.DataFrame.from_records(rows, columns=column_names)
+
+
+def sqlite_type_to_arrow(declared_type):
+    """Maps a declared SQLite column type to an Arrow type following SQLite's type affinity rules.
+    Untyped and NUMERIC affinity columns map to the null type, meaning the type is inferred from the data."""
+    declared_type = (declared_type or "").upper()
+    if "INT" in declared_type:
+        return pa.int64()
+    if any(name in declared_type for name in ("CHAR", "CLOB", "TEXT")):
+        return pa.string()
+    if any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        return pa.float64()
+    return pa.null()
+
+
+def get_arrow_schema(columns=None, db_file=None, table_name=None):
+    """Returns the Arrow schema of the specified table, optionally projected to the given columns.
+    Fields of untyped columns have the null type until resolved with infer_arrow_schema."""
+    types = get_table_schema(db_file, table_name)["types"]
+    return pa.schema([(column, sqlite_type_to_arrow(types[column])) for column in columns or types])
+
+
+def infer_arrow_schema(schema, rows):
+    """Replaces the null typed fields of a schema with the type of the values in rows, falling back to strings."""
+    fields = []
+    for index, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            try:
+                arrow_type = pa.array([row[index] for row in rows]).type
+            except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, OverflowError):
+                arrow_type = pa.string()
+            field = field.with_type(pa.string() if pa.types.is_null(arrow_type) else arrow_type)
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def rows_to_arrow(column_names, rows, schema):
+    """Converts row tuples into an Arrow table with the given schema.
+    SQLite doesn't enforce column types, so values that don't fit the schema type are coerced or become null."""
+    arrays = []
+    for index, field in enumerate(schema):
+        values = [row[index] for row in rows]
+        try:
+            arrays.append(pa.array(values, type=field.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, OverflowError):
+            arrays.append(pa.array([coerce_value(value, field.type) for value in values], type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def coerce_value(value, arrow_type):
+    if value is None:
+        return None
+    if pa.types.is_string(arrow_type):
+        return value.decode(errors="replace") if isinstance(value, bytes) else str(value)
+    try:
+        return int(value) if pa.types.is_integer(arrow_type) else float(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def parse_date_column(array):
+    """Parses an ISO formatted text column into date32, or timestamps when it holds times. Unparsable columns are returned unchanged."""
+    for arrow_type in (pa.date32(), pa.timestamp("s")):
+        try:
+            return pc.cast(array, arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            continue
+    return array
 
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
 
-    conn = get_db_connection(db_file)
-    query = f"SELECT * FROM {table_name}"
-    table = pd.read_sql_query(query, conn).to_dict("records")
-    conn.close()
-    return table
+def get_table_as_arrow(columns=None, filters=None, order_by=None, chunk_size=50000, db_file=None, table_name=None):
+    """Returns the specified table as a pyarrow Table holding only the requested columns.
+    Columns are typed from the declared SQLite types, dates are parsed and product/name are dictionary encoded."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
 
+    schema = get_arrow_schema(columns, db_file, table_name)
 
-def is_primary_key(column_name, db_file=None, table_name=None):
-    """Returns whether the specified column is a primary key."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
+    def load():
+        batches = []
+        resolved_schema = schema
+        for column_names, rows in iter_table_rows(chunk_size, schema.names, filters, order_by, db_file, table_name):
+            if not batches:
+                resolved_schema = infer_arrow_schema(schema, rows)
+            batches.append(rows_to_arrow(column_names, rows, resolved_schema))
+        table = (pa.concat_tables(batches) if batches else infer_arrow_schema(schema, []).empty_table()).combine_chunks()
+        for index, name in enumerate(table.column_names):
+            if name in ARROW_DATE_COLUMNS:
+                table = table.set_column(index, name, parse_date_column(table.column(name)))
+            elif name in ARROW_DICTIONARY_COLUMNS:
+                table = table.set_column(index, name, pc.dictionary_encode(table.column(name)))
+        return table
 
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
+    return cached_read("get_table_as_arrow", [columns, filters, order_by], load, db_file, table_name)
 
-    conn = get_db_connection(db_file)
-    cursor = conn.cursor()
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = cursor.fetchall()
-    conn.close()
-    return column_name == columns[0][1]
 
+def get_table_as_arrow_df(columns=None, filters=None, order_by=None, db_file=None, table_name=None):
+    """Returns the specified table as an Arrow-backed pandas DataFrame holding only the requested columns."""
+    return get_table_as_arrow(columns, filters, order_by, db_file=db_file, table_name=table_name).to_pandas(types_mapper=pd.ArrowDtype)
 
-def get_column_names(db_file=None, table_name=None):
-    """Returns the columns of the specified table."""
-    if db_file is None:
-        if default_database_file is None:
-            raise ValueError("Database file is not set.")
-        db_file = default_database_file
 
-    if table_name is None:
-        if default_database_table_name is None:
-            raise ValueError("Database table name is not set.")
-        table_name = default_database_table_name
-        
-    sql_string_validator(table_name)
+def get_table_schema(db_file=None, table_name=None):
+    """Returns the column names, column types and primary key of the specified table.
+    The result is cached per (db_file, table_name) and re-read whenever PRAGMA schema_version moves, so schema
+    changes made by other connections or processes are picked up."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
 
+    key = (database_key(db_file), table_name)
     conn = get_db_connection(db_file)
-    cursor = conn.cursor()
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = [column[1] for column in cursor.fetchall()]
-    conn.close()
-    return columns
+    schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    schema = schema_cache.get(key)
+    if schema is not None and schema["schema_version"] == schema_version:
+        return schema
+
+    with transaction(db_file, write=False) as conn:
+        table_info = conn.execute(f"PRAGMA table_info({table_name})").fetchall()
+    schema = {
+        "columns": [column[1] for column in table_info],
+        "types": {column[1]: column[2] for column in table_info},
+        "primary_key": next((column[1] for column in table_info if column[5]), None),
+        "schema_version": schema_version,
+    }
+    with schema_cache_lock:
+        schema_cache[key] = schema
+    return schema
+
+
+def invalidate_table_schema(db_file=None, table_name=None):
+    """Drops the cached schema of the specified table."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    with schema_cache_lock:
+        schema_cache.pop((database_key(db_file), table_name), None)
+
+
+def get_change_version(db_file=None, table_name=None):
+    """Returns the latest change version of the specified table. Every insert, update and delete increases it."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    with transaction(db_file, write=False) as conn:
+        return conn.execute(f"SELECT COALESCE(MAX(version), 0) FROM {table_name}_changes").fetchone()[0]
+
+
+def get_changes_since(version, max_changes=1000, db_file=None, table_name=None):
+    """Returns the rows added, updated and deleted after the given change version as
+    {"version", "added", "updated", "deleted", "truncated"}. When more than max_changes rows changed, only the
+    version is returned with truncated set, and the caller should reload instead."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    with transaction(db_file, write=False) as conn:
+        latest_version = conn.execute(f"SELECT COALESCE(MAX(version), 0) FROM {table_name}_changes").fetchone()[0]
+        changes = {"version": latest_version, "added": [], "updated": [], "deleted": [], "truncated": False}
+        if latest_version <= version:
+            return changes
+
+        change_count = conn.execute(f"SELECT COUNT(*) FROM {table_name}_changes WHERE version > ?", (version,)).fetchone()[0]
+        if change_count > max_changes:
+            changes["truncated"] = True
+            return changes
+
+        tables = partitions.get_read_tables(None, db_file, table_name)
+        if tables == [table_name]:
+            cursor = conn.execute(
+                f"SELECT c.row_id, c.created_version, c.deleted, t.* FROM {table_name}_changes c "
+                f"LEFT JOIN {table_name} t ON t.id = c.row_id WHERE c.version > ? ORDER BY c.version",
+                (version,),
+            )
+            columns = [description[0] for description in cursor.description][3:]
+            changed = [(row_id, created_version, deleted, dict(zip(columns, values))) for row_id, created_version, deleted, *values in cursor.fetchall()]
+        else:
+            # Partitions are looked up one by one, joining against their union would materialize it
+            rows = {}
+            for table in tables:
+                cursor = conn.execute(f"SELECT * FROM {table} WHERE id IN (SELECT row_id FROM {table_name}_changes WHERE version > ?)", (version,))
+                columns = [description[0] for description in cursor.description]
+                rows.update((row["id"], row) for row in (dict(zip(columns, values)) for values in cursor.fetchall()))
+            changed = [
+                (row_id, created_version, deleted, rows.get(row_id))
+                for row_id, created_version, deleted in conn.execute(f"SELECT row_id, created_version, deleted FROM {table_name}_changes WHERE version > ? ORDER BY version", (version,))
+            ]
+        for row_id, created_version, deleted, row in changed:
+            if deleted:
+                if created_version <= version:
+                    changes["deleted"].append(row_id)
+            elif created_version > version:
+                changes["added"].append(row)
+            else:
+                changes["updated"].append(row)
+    return changes
+
+
+def add_statistics(statistics, db_file=None, table_name=None):
+    """Stores per-channel statistics rows ({"id", "channel", "count", "min", ...}), replacing existing ones."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    columns = ["id", "channel"] + STATISTICS_COLUMNS
+    query = f"INSERT OR REPLACE INTO {table_name}_statistics ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+    with transaction(db_file) as conn:
+        conn.executemany(query, [tuple(row.get(column) for column in columns) for row in statistics])
+        conn.execute(f"UPDATE {table_name}_statistics_version SET version = version + 1")
+    invalidate_table_results(db_file, table_name)
+
+
+def delete_statistics(row_ids, db_file=None, table_name=None):
+    """Deletes the stored statistics of the given experiments, e.g. before their data is replaced."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    row_ids = list(row_ids)
+    with transaction(db_file) as conn:
+        for start in range(0, len(row_ids), IN_BATCH_SIZE):
+            batch = row_ids[start:start + IN_BATCH_SIZE]
+            conn.execute(f"DELETE FROM {table_name}_statistics WHERE id IN ({', '.join(['?'] * len(batch))})", batch)
+        conn.execute(f"UPDATE {table_name}_statistics_version SET version = version + 1")
+    invalidate_table_results(db_file, table_name)
+
+
+def get_statistics(row_ids=None, channels=None, db_file=None, table_name=None):
+    """Returns the stored statistics as a DataFrame with one row per (id, channel), optionally restricted to some
+    experiments and channels."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    filters = []
+    if row_ids is not None:
+        filters.append({"column": "id", "op": "in", "value": list(row_ids)})
+    if channels is not None:
+        filters.append({"column": "channel", "op": "in", "value": list(channels)})
+    where, params = build_where_clause(filters, ["id", "channel"] + STATISTICS_COLUMNS)
+
+    def load():
+        query = f"SELECT * FROM {table_name}_statistics{where} ORDER BY id, channel"
+        with transaction(db_file, write=False) as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    return cached_read("get_statistics", [row_ids, channels], load, db_file, table_name)
+
+
+def get_product_counts(products=None, db_file=None, table_name=None):
+    """Returns the experiment count and latest run (latest_id, latest_date) of every product, or of the given ones,
+    as a DataFrame. Reads the trigger-maintained aggregates, so the cost doesn't grow with the table.
+    Experiments without a product are counted under ''."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    filters = [] if products is None else [{"column": "product", "op": "in", "value": list(products)}]
+    where, params = build_where_clause(filters, ["product"])
+
+    def load():
+        query = f"SELECT product, count, latest_id, latest_date FROM {table_name}_product_counts{where} ORDER BY product"
+        with transaction(db_file, write=False) as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    return cached_read("get_product_counts", [products], load, db_file, table_name)
+
+
+def get_daily_counts(products=None, start_day=None, end_day=None, db_file=None, table_name=None):
+    """Returns the experiment count and latest run of every (product, day) as a DataFrame, optionally restricted to
+    some products and to days between start_day and end_day (both inclusive, "YYYY-MM-DD")."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    filters = []
+    if products is not None:
+        filters.append({"column": "product", "op": "in", "value": list(products)})
+    if start_day is not None:
+        filters.append({"column": "day", "op": ">=", "value": start_day})
+    if end_day is not None:
+        filters.append({"column": "day", "op": "<=", "value": end_day})
+    where, params = build_where_clause(filters, ["product", "day"])
+
+    def load():
+        query = f"SELECT product, day, count, latest_id, latest_date FROM {table_name}_daily_counts{where} ORDER BY product, day"
+        with transaction(db_file, write=False) as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    return cached_read("get_daily_counts", [products, start_day, end_day], load, db_file, table_name)
+
+
+def get_latest_runs(products=None, db_file=None, table_name=None):
+    """Returns the full rows of the latest run of every product, or of the given ones, newest first."""
+    latest_ids = get_product_counts(products, db_file=db_file, table_name=table_name)["latest_id"].tolist()
+    if not latest_ids:
+        return []
+    return query_rows(filters=[{"column": "id", "op": "in", "value": latest_ids}], order_by=[("date", "desc")], db_file=db_file, table_name=table_name)
+
+
+def table_cache_namespace(db_file, table_name):
+    return f"{database_key(db_file)}:{table_name}"
+
+
+def invalidate_table_results(db_file=None, table_name=None):
+    """Bumps the table's version in the result cache so reads cached before the write are never served again.
+    Inside a transaction the bump waits for the outermost transaction to commit: bumped earlier, a reader could
+    still cache the data from before the commit under the new version."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    namespace = table_cache_namespace(db_file, table_name)
+    if get_db_connection(db_file).in_transaction:
+        get_pending_invalidations(db_file).add(namespace)
+    else:
+        redis_cache.bump_table_version(namespace)
+
+
+def get_data_version(db_file=None, table_name=None):
+    """Returns the version of the table's data as recorded in the database: its schema version, change version and
+    statistics version. Unlike the result cache version, it also moves on writes by processes that don't share the
+    cache, e.g. MINER when SPEED falls back to its in-process cache."""
+    db_file = resolve_database_file(db_file)
+    table_name = resolve_database_table_name(table_name)
+
+    with transaction(db_file, write=False) as conn:
+        schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        change_version, statistics_version = conn.execute(
+            f"SELECT (SELECT COALESCE(MAX(version), 0) FROM {table_name}_changes), (SELECT MAX(version) FROM {table_name}_statistics_version)"
+        ).fetchone()
+    return f"{schema_version}.{change_version}.{statistics_version}"
+
+
+def cached_read(function_name, args, loader, db_file, table_name):
+    """Returns loader() through the shared result cache when it is enabled. Reads inside an open transaction bypass
+    the cache, as they may see writes that aren't committed yet."""
+    if not result_cache_enabled or get_db_connection(db_file).in_transaction:
+        return loader()
+    # The data version is read before loading, so a result is never older than the version it is cached under
+    data_version = get_data_version(db_file, table_name)
+    return redis_cache.cached_result(table_cache_namespace(db_file, table_name), function_name, args, loader, data_version=data_version)
+
+
+def is_primary_key(column_name, db_file=None, table_name=None):
+    """Returns whether the specified column is a primary key."""
+    return column_name == get_table_schema(db_file, table_name)["primary_key"]
+
+
+def get_column_names(db_file=None, table_name=None):
+    """Returns the columns of the specified table."""
+    return list(get_table_schema(db_file, table_name)["columns"])
 
 
 if __name__ == "__main__":
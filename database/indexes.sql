@@ -0,0 +1,26 @@
+-- Secondary indexes backing the filter API. (product, date) serves product equality, product + date ranges and
+-- latest-per-product lookups; date and name serve date ranges and name equality/prefix searches on their own.
+-- datapath counts the rows referencing a data file when deduplicated files are garbage collected.
+CREATE INDEX IF NOT EXISTS {table_name}_product_date ON {table_name} (product, date);
+CREATE INDEX IF NOT EXISTS {table_name}_date ON {table_name} (date);
+CREATE INDEX IF NOT EXISTS {table_name}_name ON {table_name} (name);
+CREATE INDEX IF NOT EXISTS {table_name}_datapath ON {table_name} (datapath);
+
+-- Full-text index over name, stored as an external content table kept in sync by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS {table_name}_fts USING fts5(name, content='{table_name}', content_rowid='id');
+
+CREATE TRIGGER IF NOT EXISTS {table_name}_fts_insert AFTER INSERT ON {table_name}
+BEGIN
+    INSERT INTO {table_name}_fts (rowid, name) VALUES (NEW.id, NEW.name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS {table_name}_fts_delete AFTER DELETE ON {table_name}
+BEGIN
+    INSERT INTO {table_name}_fts ({table_name}_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS {table_name}_fts_update AFTER UPDATE OF id, name ON {table_name}
+BEGIN
+    INSERT INTO {table_name}_fts ({table_name}_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+    INSERT INTO {table_name}_fts (rowid, name) VALUES (NEW.id, NEW.name);
+END;
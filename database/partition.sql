@@ -0,0 +1,29 @@
+-- Change tracking and statistics cleanup of one partition. Changes are recorded in the change log of the
+-- partitioned table, so versions stay global across partitions.
+CREATE TRIGGER IF NOT EXISTS {partition_name}_changes_insert AFTER INSERT ON {partition_name}
+BEGIN
+    INSERT INTO {table_name}_changes (row_id, version, created_version, deleted)
+    VALUES (NEW.id, (SELECT COALESCE(MAX(version), 0) + 1 FROM {table_name}_changes), (SELECT COALESCE(MAX(version), 0) + 1 FROM {table_name}_changes), 0)
+    ON CONFLICT (row_id) DO UPDATE SET version = excluded.version, created_version = excluded.created_version, deleted = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS {partition_name}_changes_update AFTER UPDATE ON {partition_name}
+BEGIN
+    UPDATE {table_name}_changes SET version = (SELECT MAX(version) + 1 FROM {table_name}_changes), deleted = 1
+    WHERE row_id = OLD.id AND OLD.id != NEW.id;
+    INSERT INTO {table_name}_changes (row_id, version, created_version, deleted)
+    VALUES (NEW.id, (SELECT COALESCE(MAX(version), 0) + 1 FROM {table_name}_changes), 0, 0)
+    ON CONFLICT (row_id) DO UPDATE SET version = excluded.version, deleted = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS {partition_name}_changes_delete AFTER DELETE ON {partition_name}
+BEGIN
+    INSERT INTO {table_name}_changes (row_id, version, created_version, deleted)
+    VALUES (OLD.id, (SELECT COALESCE(MAX(version), 0) + 1 FROM {table_name}_changes), 0, 1)
+    ON CONFLICT (row_id) DO UPDATE SET version = excluded.version, deleted = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS {partition_name}_statistics_delete AFTER DELETE ON {partition_name}
+BEGIN
+    DELETE FROM {table_name}_statistics WHERE id = OLD.id;
+END;
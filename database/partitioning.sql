@@ -0,0 +1,12 @@
+-- Catalog of a date-partitioned table. Its rows live in one table per date range (see partition.sql) while the
+-- table itself stays empty and keeps the schema, the id sequence, the change log and the statistics.
+CREATE TABLE IF NOT EXISTS {table_name}_partitioning (
+    granularity TEXT NOT NULL
+);
+
+-- start_date is inclusive and end_date exclusive. Both are NULL for the partition of dates that aren't ISO formatted.
+CREATE TABLE IF NOT EXISTS {table_name}_partitions (
+    partition_name TEXT PRIMARY KEY,
+    start_date TEXT,
+    end_date TEXT
+);
@@ -0,0 +1,380 @@
+import os
+import re
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from database import db, aggregates
+
+PARTITIONING_SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "partitioning.sql")
+PARTITION_SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "partition.sql")
+
+# Length of the ISO date prefix ("2024-03" or "2024") that selects the partition of a row
+PARTITION_GRANULARITIES = {"month": 7, "year": 4}
+PARTITION_DATE_PATTERNS = {"month": re.compile(r"^\d{4}-\d{2}$"), "year": re.compile(r"^\d{4}$")}
+OTHER_PARTITION = "other"
+PARTITION_READ_WORKERS = 8
+
+partition_cache = {}
+partition_cache_lock = threading.Lock()
+
+partition_executor = None
+partition_executor_pid = None
+partition_executor_lock = threading.Lock()
+
+
+def get_partitioning(db_file=None, table_name=None):
+    """Returns (granularity, [(partition_name, start_date, end_date), ...]) of a partitioned table, ordered by date,
+    or (None, []) when the table isn't partitioned. Cached until PRAGMA schema_version moves, which creating a
+    partition always does."""
+    db_file = db.resolve_database_file(db_file)
+    table_name = db.resolve_database_table_name(table_name)
+
+    key = (db.database_key(db_file), table_name)
+    conn = db.get_db_connection(db_file)
+    schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    cached = partition_cache.get(key)
+    if cached is not None and cached[0] == schema_version:
+        return cached[1]
+
+    with db.transaction(db_file, write=False) as conn:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (f"{table_name}_partitioning",)).fetchone() is None:
+            partitioning = (None, [])
+        else:
+            granularity = conn.execute(f"SELECT granularity FROM {table_name}_partitioning").fetchone()
+            partition_rows = conn.execute(f"SELECT partition_name, start_date, end_date FROM {table_name}_partitions ORDER BY start_date IS NULL, start_date").fetchall()
+            partitioning = (granularity[0] if granularity else None, partition_rows)
+    with partition_cache_lock:
+        partition_cache[key] = (schema_version, partitioning)
+    return partitioning
+
+
+def is_partitioned(db_file=None, table_name=None):
+    return get_partitioning(db_file, table_name)[0] is not None
+
+
+def get_partition_names(db_file=None, table_name=None):
+    return [name for name, _, _ in get_partitioning(db_file, table_name)[1]]
+
+
+def partition_range(date, granularity):
+    """Returns (partition suffix, start_date, end_date) of the partition holding a date."""
+    prefix = str(date)[:PARTITION_GRANULARITIES[granularity]] if date is not None else ""
+    if not PARTITION_DATE_PATTERNS[granularity].match(prefix):
+        return OTHER_PARTITION, None, None
+    year = int(prefix[:4])
+    if granularity == "year":
+        return prefix, prefix, f"{year + 1:04d}"
+    month = int(prefix[5:7])
+    end = f"{year + month // 12:04d}-{month % 12 + 1:02d}"
+    return prefix.replace("-", ""), prefix, end
+
+
+def filter_date_bounds(filters):
+    """Returns the (low, high) date bounds implied by the filters, either of which may be None for unbounded.
+    Only conjunctive terms narrow the bounds, so rows outside them can't match the filters."""
+    low, high = None, None
+    for node in filters or []:
+        if "all" in node:
+            node_low, node_high = filter_date_bounds(node["all"])
+        elif "any" in node or node.get("column") != "date":
+            continue
+        else:
+            op, value = node["op"], node.get("value")
+            values = list(value) if op in ("between", "in") and value else [value]
+            if not all(isinstance(_, str) for _ in values):
+                continue
+            if op == "=":
+                node_low, node_high = value, value
+            elif op in (">", ">="):
+                node_low, node_high = value, None
+            elif op in ("<", "<="):
+                node_low, node_high = None, value
+            elif op in ("between", "in") and value:
+                node_low, node_high = min(values), max(values)
+            elif op in ("prefix", "starts_with"):
+                node_low, node_high = value, value + "\U0010ffff"
+            else:
+                continue
+        low = node_low if low is None or (node_low is not None and node_low > low) else low
+        high = node_high if high is None or (node_high is not None and node_high < high) else high
+    return low, high
+
+
+def get_read_tables(filters=None, db_file=None, table_name=None):
+    """Returns the tables a read of table_name has to visit: the table itself when it isn't partitioned, otherwise
+    the partitions whose date range can hold rows matching the filters."""
+    db_file = db.resolve_database_file(db_file)
+    table_name = db.resolve_database_table_name(table_name)
+
+    granularity, partitions = get_partitioning(db_file, table_name)
+    if granularity is None:
+        return [table_name]
+    low, high = filter_date_bounds(filters)
+    tables = [
+        name for name, start_date, end_date in partitions
+        if start_date is None or ((high is None or start_date <= high) and (low is None or end_date > low))
+    ]
+    # The partitioned table itself is empty and has the same columns, so it stands in when nothing can match
+    return tables or [table_name]
+
+
+def get_partition_executor():
+    global partition_executor, partition_executor_pid
+    with partition_executor_lock:
+        # Pool threads don't survive a fork, so child processes start their own pool
+        if partition_executor is None or partition_executor_pid != os.getpid():
+            partition_executor = ThreadPoolExecutor(max_workers=PARTITION_READ_WORKERS, thread_name_prefix="partition-read")
+            partition_executor_pid = os.getpid()
+        return partition_executor
+
+
+def map_tables(function, tables, db_file=None, table_name=None):
+    """Returns [function(table) for table in tables], running the calls in parallel on their own pooled
+    connections. Calls made inside an open transaction run on the caller's connection so they see its writes.
+    The results come from one snapshot: every parallel call reads inside a read transaction that starts by reading
+    the change version of table_name, and when a write committed between them the calls are repeated serially in
+    one read transaction."""
+    if len(tables) == 1 or db.get_db_connection(db_file).in_transaction:
+        return [function(table) for table in tables]
+    table_name = db.resolve_database_table_name(table_name)
+
+    def read(table):
+        # function's own transaction joins this one, whose snapshot starts at the version read
+        with db.transaction(db_file, write=False) as conn:
+            version = conn.execute(f"SELECT COALESCE(MAX(version), 0) FROM {table_name}_changes").fetchone()[0]
+            return version, function(table)
+
+    results = list(get_partition_executor().map(read, tables))
+    if len({version for version, _ in results}) == 1:
+        return [result for _, result in results]
+    with db.transaction(db_file, write=False):
+        return [function(table) for table in tables]
+
+
+class SortValue:
+    """Orders values like SQLite does (NULL, then numbers, then text, then blobs), reversed for descending terms."""
+
+    __slots__ = ("key", "descending")
+
+    def __init__(self, value, descending=False):
+        if value is None:
+            self.key = (0, 0)
+        elif isinstance(value, (int, float)):
+            self.key = (1, value)
+        elif isinstance(value, str):
+            self.key = (2, value)
+        else:
+            self.key = (3, bytes(value))
+        self.descending = descending
+
+    def __lt__(self, other):
+        return other.key < self.key if self.descending else self.key < other.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def sort_terms(sort_model, stable=True):
+    """Returns the [(column, descending)] terms of a sort model, ending on id when stable like build_order_clause."""
+    terms = [(column, direction.lower() == "desc") for column, direction in sort_model or []]
+    if (stable or terms) and "id" not in [column for column, _ in terms]:
+        terms.append(("id", False))
+    return terms
+
+
+def row_sort_key(terms, columns=None):
+    """Returns a sort key for rows ordered by the terms. Rows are dictionaries, or tuples when columns is given."""
+    if columns is None:
+        return lambda row: tuple(SortValue(row[column], descending) for column, descending in terms)
+    indexes = [(columns.index(column), descending) for column, descending in terms]
+    return lambda row: tuple(SortValue(row[index], descending) for index, descending in indexes)
+
+
+def merge_sorted(row_lists, terms, columns=None):
+    """Merges row lists (or iterators) that are each sorted by the terms into one sorted iterator."""
+    if not terms:
+        return (row for rows in row_lists for row in rows)
+    return heapq.merge(*row_lists, key=row_sort_key(terms, columns))
+
+
+def find_row_table(conn, db_file, table_name, row_id):
+    """Returns the partition holding a row, or None when no partition does."""
+    partitions = get_partition_names(db_file, table_name)
+    if not partitions:
+        return None
+    query = " UNION ALL ".join(f"SELECT '{name}' FROM {name} WHERE id = ?" for name in partitions)
+    row = conn.execute(f"{query} LIMIT 1", [row_id] * len(partitions)).fetchone()
+    return row[0] if row else None
+
+
+def find_row_tables(conn, db_file, table_name, row_ids):
+    """Returns {row_id: partition} for the given rows, leaving out rows that no partition holds."""
+    row_ids = list(dict.fromkeys(row_ids))
+    tables = {}
+    for partition_name in get_partition_names(db_file, table_name):
+        for start in range(0, len(row_ids), db.IN_BATCH_SIZE):
+            batch = row_ids[start:start + db.IN_BATCH_SIZE]
+            query = f"SELECT id FROM {partition_name} WHERE id IN ({', '.join(['?'] * len(batch))})"
+            tables.update((row_id, partition_name) for row_id, in conn.execute(query, batch))
+    return tables
+
+
+def create_partition(conn, table_name, suffix, start_date, end_date, initialize=True):
+    """Creates a partition with the columns, indexes, full-text index and triggers of the partitioned table.
+    Without initialize only the bare table is created, for bulk loads that call initialize_partition afterwards.
+    Must run inside a write transaction."""
+    partition_name = f"{table_name}_p{suffix}"
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (partition_name,)).fetchone() is not None:
+        return partition_name
+    # Ids are allocated from the sequence of the partitioned table, so partitions don't need AUTOINCREMENT
+    definitions = db.get_column_definitions(conn, table_name, autoincrement=False)
+    conn.execute(f"CREATE TABLE {partition_name} ({', '.join(definitions)})")
+    if initialize:
+        initialize_partition(conn, table_name, partition_name)
+    conn.execute(f"INSERT INTO {table_name}_partitions (partition_name, start_date, end_date) VALUES (?, ?, ?)", (partition_name, start_date, end_date))
+    return partition_name
+
+
+def initialize_partition(conn, table_name, partition_name):
+    full_text_index_exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name=?", (f"{partition_name}_fts",)).fetchone() is not None
+    db.run_sql_script(conn, db.INDEXES_SCHEMA_FILE, {"table_name": partition_name})
+    if not full_text_index_exists:
+        conn.execute(f"INSERT INTO {partition_name}_fts ({partition_name}_fts) VALUES ('rebuild')")
+    db.run_sql_script(conn, PARTITION_SCHEMA_FILE, {"table_name": table_name, "partition_name": partition_name})
+    aggregates.install_aggregates(conn, table_name, partition_name)
+
+
+def initialize_partitions(db_file=None, table_name=None):
+    """Installs the indexes and triggers of every partition that is missing them, e.g. after an upgrade."""
+    partitions = get_partition_names(db_file, table_name)
+    if not partitions:
+        return
+    with db.transaction(db_file) as conn:
+        for partition_name in partitions:
+            initialize_partition(conn, db.resolve_database_table_name(table_name), partition_name)
+
+
+def allocate_ids(conn, table_name, count, minimum=0):
+    """Reserves count consecutive ids from the AUTOINCREMENT sequence of the partitioned table and returns the first.
+    The sequence is first moved past minimum, the largest explicit id being inserted."""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table_name,)).fetchone()
+    first_id = max(row[0] if row else 0, minimum) + 1
+    if row is None:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table_name, first_id + count - 1))
+    else:
+        conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name=?", (first_id + count - 1, table_name))
+    return first_id
+
+
+def insert_rows(conn, db_file, table_name, columns, values):
+    """Inserts row tuples into the partitions of their dates, creating partitions as needed, and returns their ids.
+    Rows without an id get one from the sequence of the partitioned table. Must run inside a write transaction."""
+    granularity = get_partitioning(db_file, table_name)[0]
+    if "date" not in columns:
+        raise ValueError("Rows of a partitioned table need a date")
+    if "id" not in columns:
+        columns, values = ["id"] + list(columns), [(None,) + tuple(value) for value in values]
+    id_index, date_index = columns.index("id"), columns.index("date")
+
+    explicit_ids = [value[id_index] for value in values if value[id_index] is not None]
+    missing = len(values) - len(explicit_ids)
+    next_id = allocate_ids(conn, table_name, missing, max(explicit_ids, default=0)) if missing else None
+    if not missing and explicit_ids:
+        allocate_ids(conn, table_name, 0, max(explicit_ids))
+
+    ids, routed = [], {}
+    for value in values:
+        if value[id_index] is None:
+            value = value[:id_index] + (next_id,) + value[id_index + 1:]
+            next_id += 1
+        ids.append(value[id_index])
+        routed.setdefault(partition_range(value[date_index], granularity), []).append(value)
+
+    for (suffix, start_date, end_date), partition_values in routed.items():
+        partition_name = create_partition(conn, table_name, suffix, start_date, end_date)
+        conn.executemany(f"INSERT INTO {partition_name} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})", partition_values)
+    return ids
+
+
+def update_row(conn, db_file, table_name, row_id, new_values):
+    """Updates a row of a partitioned table, moving it to another partition when its date changes partition.
+    Returns False when the row doesn't exist. Must run inside a write transaction."""
+    source = find_row_table(conn, db_file, table_name, row_id)
+    if source is None:
+        return False
+
+    granularity = get_partitioning(db_file, table_name)[0]
+    target = f"{table_name}_p{partition_range(new_values['date'], granularity)[0]}" if "date" in new_values else source
+    if target == source:
+        assignments = ", ".join(f"{column} = ?" for column in new_values)
+        conn.execute(f"UPDATE {source} SET {assignments} WHERE id = ?", tuple(new_values.values()) + (row_id,))
+        return True
+
+    # Deleting from the old partition drops the statistics of the row, so they are carried over
+    cursor = conn.execute(f"SELECT * FROM {source} WHERE id = ?", (row_id,))
+    row = dict(zip([description[0] for description in cursor.description], cursor.fetchone()))
+    cursor = conn.execute(f"SELECT * FROM {table_name}_statistics WHERE id = ?", (row_id,))
+    statistics_columns = [description[0] for description in cursor.description]
+    statistics = cursor.fetchall()
+    created_version = conn.execute(f"SELECT created_version FROM {table_name}_changes WHERE row_id = ?", (row_id,)).fetchone()
+
+    conn.execute(f"DELETE FROM {source} WHERE id = ?", (row_id,))
+    row.update(new_values)
+    insert_rows(conn, db_file, table_name, list(row), [tuple(row.values())])
+    # The move is logged as an update of the row rather than a new row
+    conn.execute(f"UPDATE {table_name}_changes SET created_version = ? WHERE row_id = ?", (created_version[0] if created_version else 0, row_id))
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {table_name}_statistics ({', '.join(statistics_columns)}) VALUES ({', '.join(['?'] * len(statistics_columns))})",
+        statistics,
+    )
+    return True
+
+
+def enable_partitioning(granularity="month", db_file=None, table_name=None, progress_callback=None):
+    """Partitions a table by date, moving its rows into one table per month or year. Afterwards the db API routes
+    writes to the partition of each row's date and fans reads out over the partitions that a date filter leaves,
+    so partitions of past dates are no longer written to. progress_callback(moved_partitions, total_partitions)
+    is called after every moved partition.
+    Every partition has its own indexes, full-text index and triggers, about 20 schema objects. Column changes cost
+    more with every partition: adding a column runs ALTER TABLE on each partition, which re-parses the whole schema
+    every time, so it grows with the square of the partition count (about 2 s for 60 monthly partitions). Dropping
+    columns rebuilds the partitions without ALTER TABLE and only grows with their rows."""
+    db_file = db.resolve_database_file(db_file)
+    table_name = db.resolve_database_table_name(table_name)
+
+    if granularity not in PARTITION_GRANULARITIES:
+        raise ValueError(f"Unknown partition granularity: {granularity}")
+    if is_partitioned(db_file, table_name):
+        return
+
+    with db.transaction(db_file) as conn:
+        db.run_sql_script(conn, PARTITIONING_SCHEMA_FILE, {"table_name": table_name})
+        conn.execute(f"INSERT INTO {table_name}_partitioning (granularity) VALUES (?)", (granularity,))
+
+        # Rows are moved without the table's own triggers, which would log them as deleted and drop their statistics
+        triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type='trigger' AND tbl_name=?", (table_name,)).fetchall()
+        for name, _ in triggers:
+            conn.execute(f"DROP TRIGGER {name}")
+
+        columns = ", ".join(db.get_table_schema(db_file, table_name)["columns"])
+        prefixes = [row[0] for row in conn.execute(f"SELECT DISTINCT substr(date, 1, ?) FROM {table_name}", (PARTITION_GRANULARITIES[granularity],))]
+        ranges = sorted(set(partition_range(prefix, granularity) for prefix in prefixes), key=lambda _: (_[1] is None, _[1] or ""))
+        for index, (suffix, start_date, end_date) in enumerate(ranges):
+            # Partitions get their indexes and triggers once filled, so the moved rows aren't logged as new
+            partition_name = create_partition(conn, table_name, suffix, start_date, end_date, initialize=False)
+            if start_date is None:
+                pattern = "[0-9][0-9][0-9][0-9]-[0-9][0-9]*" if granularity == "month" else "[0-9][0-9][0-9][0-9]*"
+                conn.execute(f"INSERT INTO {partition_name} ({columns}) SELECT {columns} FROM {table_name} WHERE date IS NULL OR date NOT GLOB ?", (pattern,))
+            else:
+                conn.execute(f"INSERT INTO {partition_name} ({columns}) SELECT {columns} FROM {table_name} WHERE date >= ? AND date < ?", (start_date, end_date))
+            initialize_partition(conn, table_name, partition_name)
+            if progress_callback is not None:
+                progress_callback(index + 1, len(ranges))
+
+        conn.execute(f"DELETE FROM {table_name}")
+        conn.execute(f"INSERT INTO {table_name}_fts ({table_name}_fts) VALUES ('delete-all')")
+        for _, sql in triggers:
+            conn.execute(sql)
+    db.invalidate_table_schema(db_file, table_name)
+    db.invalidate_table_results(db_file, table_name)
@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from utils import lazy
+from database import db
+from storage import datafiles
+
+np = lazy.lazy_import("numpy")
+pd = lazy.lazy_import("pandas")
+
+QUANTILES = {"q05": 0.05, "q25": 0.25, "q50": 0.5, "q75": 0.75, "q95": 0.95}
+HISTOGRAM_BINS = 32
+RECOMPUTE_WORKERS = 8
+
+
+def summarize_channel(values):
+    """Returns count, min, max, mean, std, quantiles and a fixed-bin histogram of the finite values of a channel."""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    summary = {"count": int(values.size)}
+    if values.size == 0:
+        return summary
+
+    quantiles = np.quantile(values, list(QUANTILES.values()))
+    counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+    summary.update({
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "mean": float(values.mean()),
+        "std": float(values.std()),
+        **{name: float(value) for name, value in zip(QUANTILES, quantiles)},
+        "histogram": json.dumps({"edges": edges.tolist(), "counts": counts.tolist()}),
+    })
+    return summary
+
+
+def summarize_experiment(row_id, data):
+    """Returns the statistics rows of every numeric channel of an experiment's data."""
+    return [
+        {"id": row_id, "channel": channel, **summarize_channel(values)}
+        for channel, values in data.items()
+        if np.issubdtype(np.asarray(values).dtype, np.number)
+    ]
+
+
+def compute_statistics(row_ids=None, db_file=None, table_name=None):
+    """(Re)computes and stores the statistics of existing experiments, all of them when row_ids is None.
+    Returns the ids whose data could not be loaded."""
+    filters = None if row_ids is None else [{"column": "id", "op": "in", "value": list(row_ids)}]
+
+    def summarize(row):
+        try:
+            return summarize_experiment(row["id"], datafiles.load_experiment_data(row["datapath"])), None
+        except (OSError, ValueError):
+            return [], row["id"]
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=RECOMPUTE_WORKERS) as executor:
+        for rows in db.iter_table_records(RECOMPUTE_WORKERS * 4, columns=["id", "datapath"], filters=filters, db_file=db_file, table_name=table_name):
+            statistics = []
+            for summaries, failed_id in executor.map(summarize, rows):
+                statistics.extend(summaries)
+                if failed_id is not None:
+                    failed.append(failed_id)
+            db.add_statistics(statistics, db_file=db_file, table_name=table_name)
+    return failed
+
+
+def compare_statistics(row_ids, channels=None, statistic="mean", db_file=None, table_name=None):
+    """Returns one statistic across experiments as a DataFrame with experiment ids as rows and channels as columns."""
+    statistics = db.get_statistics(row_ids, channels, db_file=db_file, table_name=table_name)
+    if statistics.empty:
+        return pd.DataFrame()
+    return statistics.pivot(index="id", columns="channel", values=statistic)
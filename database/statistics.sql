@@ -0,0 +1,32 @@
+-- Per-experiment, per-channel summaries computed once so SPEED never has to open the raw data to answer them.
+CREATE TABLE IF NOT EXISTS {table_name}_statistics (
+    id INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    min REAL,
+    max REAL,
+    mean REAL,
+    std REAL,
+    q05 REAL,
+    q25 REAL,
+    q50 REAL,
+    q75 REAL,
+    q95 REAL,
+    histogram TEXT,
+    PRIMARY KEY (id, channel)
+);
+
+CREATE INDEX IF NOT EXISTS {table_name}_statistics_channel ON {table_name}_statistics (channel);
+
+CREATE TRIGGER IF NOT EXISTS {table_name}_statistics_delete AFTER DELETE ON {table_name}
+BEGIN
+    DELETE FROM {table_name}_statistics WHERE id = OLD.id;
+END;
+
+-- Moved by every statistics write, so cached statistics are recognized as stale even when another process wrote them.
+-- Deleting rows removes their statistics through the trigger above and moves the change version instead.
+CREATE TABLE IF NOT EXISTS {table_name}_statistics_version (
+    version INTEGER NOT NULL
+);
+
+INSERT INTO {table_name}_statistics_version (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM {table_name}_statistics_version);
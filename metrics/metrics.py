@@ -0,0 +1,395 @@
+import time
+import inspect
+import logging
+import sqlite3
+import threading
+import functools
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+BYTES_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+CONNECTIONS_BUCKETS = (0, 1, 2, 4, 8, 16)
+
+# Statements slower than this are written to the slow-query log with their query plan. None disables the log.
+SLOW_QUERY_SECONDS = 0.1
+SLOW_QUERY_PARAMETERS_LENGTH = 200
+
+# Functions of the db module that take db_file but are plumbing rather than API calls
+DATABASE_UNINSTRUMENTED = {
+    "resolve_database_file",
+    "database_key",
+    "open_db_connection",
+    "get_db_connection",
+    "transaction",
+    "table_cache_namespace",
+    "cached_read",
+}
+
+slow_query_logger = logging.getLogger("speed.slow_queries")
+
+# Distinct connections used by the request being handled on this thread
+request_state = threading.local()
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self, metric_type="counter"):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {metric_type}"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self, metric_type="gauge"):
+        return super().render(metric_type)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts, total = self.values.get(labels) or ([0] * (len(self.buckets) + 1), 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.values[labels] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+                    cumulative += count
+                    bucket_labels = format_labels(self.label_names + ("le",), labels + (str(bound),))
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+db_call_seconds = Histogram("speed_db_call_seconds", "Latency of database API calls.", ("function",))
+db_call_rows = Histogram("speed_db_call_rows", "Rows returned by database API calls.", ("function",), ROWS_BUCKETS)
+db_call_errors = Counter("speed_db_call_errors_total", "Database API calls that raised.", ("function",))
+sql_seconds = Histogram("speed_sql_seconds", "Latency of SQL statements, including fetching their rows.", ("statement",))
+slow_queries = Counter("speed_slow_queries_total", "SQL statements slower than the slow-query threshold.", ("statement",))
+connections_opened = Counter("speed_db_connections_opened_total", "SQLite connections opened.")
+connections_open = Gauge("speed_db_connections_open", "SQLite connections currently open.")
+callback_seconds = Histogram("speed_callback_seconds", "Latency of Dash callbacks, including serializing their outputs.", ("callback",))
+callback_payload_bytes = Histogram("speed_callback_payload_bytes", "Serialized size of Dash callback responses.", ("callback",), BYTES_BUCKETS)
+callback_errors = Counter("speed_callback_errors_total", "Dash callbacks that raised.", ("callback",))
+request_seconds = Histogram("speed_http_request_seconds", "Latency of HTTP requests.", ("endpoint",))
+request_connections = Histogram("speed_http_request_db_connections", "Distinct database connections used per HTTP request.", ("endpoint",), CONNECTIONS_BUCKETS)
+response_bytes = Histogram("speed_http_response_bytes", "Size of buffered HTTP responses.", ("endpoint",), BYTES_BUCKETS)
+
+METRICS = [
+    db_call_seconds, db_call_rows, db_call_errors, sql_seconds, slow_queries, connections_opened, connections_open,
+    callback_seconds, callback_payload_bytes, callback_errors, request_seconds, request_connections, response_bytes,
+]
+
+
+def format_labels(label_names, labels):
+    if not label_names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(label_names, escaped)) + "}"
+
+
+def render_metrics():
+    """Returns every metric in the Prometheus text exposition format."""
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+def set_slow_query_threshold(seconds):
+    global SLOW_QUERY_SECONDS
+    SLOW_QUERY_SECONDS = seconds
+
+
+def set_slow_query_log_file(file_path):
+    """Also writes the slow-query log to file_path."""
+    handler = logging.FileHandler(file_path)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_query_logger.addHandler(handler)
+
+
+def statement_type(sql):
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ""
+
+
+def count_rows(value):
+    """Returns the number of rows in a database API result, or None when it isn't row-shaped."""
+    if isinstance(value, tuple):
+        # (rows, row_count) pages and (column_names, rows) chunks
+        value = next((item for item in reversed(value) if isinstance(item, list)), None)
+    if isinstance(value, list):
+        return len(value)
+    if hasattr(value, "num_rows"):
+        return value.num_rows
+    if hasattr(value, "shape"):
+        return value.shape[0]
+    return None
+
+
+def log_slow_query(conn, sql, parameters, seconds):
+    """Logs a slow statement together with its query plan."""
+    slow_queries.inc(statement_type(sql))
+    plan = []
+    if statement_type(sql) in ("SELECT", "WITH"):
+        try:
+            # A plain cursor, so explaining isn't itself instrumented
+            cursor = sqlite3.Cursor(conn)
+            plan = [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)]
+        except sqlite3.Error:
+            pass
+    slow_query_logger.warning(
+        "slow query %.3fs: %s | parameters: %s | plan: %s",
+        seconds, " ".join(sql.split()), str(parameters)[:SLOW_QUERY_PARAMETERS_LENGTH], "; ".join(plan),
+    )
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times each statement from execution until its rows are fetched (or the cursor is discarded)."""
+
+    sql = None
+
+    def start_statement(self, sql, parameters, seconds):
+        self.finish_statement()
+        self.sql, self.parameters, self.seconds = sql, parameters, seconds
+
+    def finish_statement(self):
+        if self.sql is None:
+            return
+        sql, self.sql = self.sql, None
+        sql_seconds.observe(self.seconds, statement_type(sql))
+        if SLOW_QUERY_SECONDS is not None and self.seconds >= SLOW_QUERY_SECONDS:
+            log_slow_query(self.connection, sql, self.parameters, self.seconds)
+
+    def timed_fetch(self, fetch, *args, **kwargs):
+        started = time.perf_counter()
+        rows = fetch(*args, **kwargs)
+        if self.sql is not None:
+            self.seconds += time.perf_counter() - started
+        return rows
+
+    def execute(self, sql, parameters=()):
+        self.finish_statement()
+        started = time.perf_counter()
+        cursor = super().execute(sql, parameters)
+        self.start_statement(sql, parameters, time.perf_counter() - started)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        self.finish_statement()
+        started = time.perf_counter()
+        cursor = super().executemany(sql, seq_of_parameters)
+        self.start_statement(sql, "(executemany)", time.perf_counter() - started)
+        self.finish_statement()
+        return cursor
+
+    def executescript(self, sql_script):
+        self.finish_statement()
+        started = time.perf_counter()
+        cursor = super().executescript(sql_script)
+        self.start_statement(sql_script, "(script)", time.perf_counter() - started)
+        self.finish_statement()
+        return cursor
+
+    def fetchone(self):
+        row = self.timed_fetch(super().fetchone)
+        if row is None:
+            self.finish_statement()
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        size = args[0] if args else kwargs.get("size", self.arraysize)
+        rows = self.timed_fetch(super().fetchmany, *args, **kwargs)
+        if len(rows) < size:
+            self.finish_statement()
+        return rows
+
+    def fetchall(self):
+        rows = self.timed_fetch(super().fetchall)
+        self.finish_statement()
+        return rows
+
+    def __next__(self):
+        try:
+            return self.timed_fetch(super().__next__)
+        except StopIteration:
+            self.finish_statement()
+            raise
+
+    def close(self):
+        self.finish_statement()
+        super().close()
+
+    def __del__(self):
+        try:
+            self.finish_statement()
+        except (sqlite3.Error, ReferenceError):
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose statements run on InstrumentedCursors and which counts open connections."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.open = True
+        connections_opened.inc()
+        connections_open.inc()
+
+    def cursor(self, factory=InstrumentedCursor):
+        connections = getattr(request_state, "connections", None)
+        if connections is not None:
+            connections.add(id(self))
+        return super().cursor(factory)
+
+    # The C shortcuts bypass Cursor.execute, so they are routed through an instrumented cursor
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def close(self):
+        if self.open:
+            self.open = False
+            connections_open.dec()
+        super().close()
+
+
+def instrument_function(function, name):
+    """Wraps a database API function to record its latency, rows returned and errors. Generator functions are
+    timed over their whole iteration, excluding the time the consumer spends between chunks."""
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def generator_wrapper(*args, **kwargs):
+            generator = function(*args, **kwargs)
+            seconds, rows, failed = 0.0, 0, False
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        seconds += time.perf_counter() - started
+                    rows += count_rows(item) or 0
+                    yield item
+            except Exception:
+                failed = True
+                raise
+            finally:
+                generator.close()
+                db_call_seconds.observe(seconds, name)
+                db_call_rows.observe(rows, name)
+                if failed:
+                    db_call_errors.inc(name)
+        return generator_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            db_call_errors.inc(name)
+            raise
+        finally:
+            db_call_seconds.observe(time.perf_counter() - started, name)
+        rows = count_rows(result)
+        if rows is not None:
+            db_call_rows.observe(rows, name)
+        return result
+    return wrapper
+
+
+def instrument_database(db):
+    """Instruments the db module: every API function (the ones taking db_file) and every SQL statement run on
+    connections opened from now on."""
+    db.set_connection_factory(InstrumentedConnection)
+    for name, function in list(vars(db).items()):
+        if (
+            inspect.isfunction(function) and function.__module__ == db.__name__
+            and name not in DATABASE_UNINSTRUMENTED and "db_file" in inspect.signature(function).parameters
+        ):
+            setattr(db, name, instrument_function(function, name))
+
+
+def instrument_callbacks(app):
+    """Wraps every registered server-side Dash callback to record its latency, response size and errors."""
+    from dash.exceptions import PreventUpdate
+
+    for callback in app.callback_map.values():
+        if "callback" not in callback:
+            continue
+        function = callback["callback"]
+        name = function.__name__
+
+        def wrapper(*args, function=function, name=name, **kwargs):
+            started = time.perf_counter()
+            try:
+                response = function(*args, **kwargs)
+            except PreventUpdate:
+                raise
+            except Exception:
+                callback_errors.inc(name)
+                raise
+            finally:
+                callback_seconds.observe(time.perf_counter() - started, name)
+            if isinstance(response, (str, bytes)):
+                callback_payload_bytes.observe(len(response), name)
+            return response
+
+        callback["callback"] = functools.update_wrapper(wrapper, function)
+
+
+def instrument_server(server):
+    """Records the latency, response size and database connections used of every request to a Flask server."""
+    from flask import request
+
+    @server.before_request
+    def start_request_metrics():
+        request_state.started = time.perf_counter()
+        request_state.connections = set()
+
+    @server.after_request
+    def record_request_metrics(response):
+        endpoint = request.endpoint or "unknown"
+        request_seconds.observe(time.perf_counter() - request_state.started, endpoint)
+        request_connections.observe(len(request_state.connections), endpoint)
+        if not response.is_streamed and response.content_length is not None:
+            response_bytes.observe(response.content_length, endpoint)
+        request_state.connections = None
+        return response
@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import uuid
+import argparse
+import threading
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from flask import Flask, abort, jsonify, request
+from werkzeug.utils import secure_filename
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from database import db
+from miner import ingest
+from storage import blobstore
+
+UPLOAD_DIRECTORY = os.path.join(AMAIAS_DIRECTORY, "uploads")
+# Processed experiments are stored content-addressed by the hash of the uploaded file
+DATA_DIRECTORY = blobstore.BLOB_ROOT
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+INGEST_WORKERS = os.cpu_count() or 2
+
+app = Flask("MINER")
+
+ingest_executor = None
+ingest_executor_lock = threading.Lock()
+
+
+def get_ingest_executor():
+    global ingest_executor
+    with ingest_executor_lock:
+        if ingest_executor is None:
+            ingest_executor = ProcessPoolExecutor(max_workers=INGEST_WORKERS)
+        return ingest_executor
+
+
+def list_uploads():
+    """Returns the staged files by upload id. Staged files are named {upload_id}.{digest}{extension}."""
+    return {
+        file_name.split(".")[0]: os.path.join(UPLOAD_DIRECTORY, file_name)
+        for file_name in os.listdir(UPLOAD_DIRECTORY) if not file_name.endswith(".part")
+    }
+
+
+def find_upload(upload_id, uploads=None):
+    """Returns the staged file of an upload id, or None. uploads is a list_uploads result to look it up in, so a
+    batch lists the staging directory once."""
+    if not upload_id or secure_filename(upload_id) != upload_id:
+        return None
+    return (list_uploads() if uploads is None else uploads).get(upload_id)
+
+
+def upload_digest(upload_path):
+    """Returns the content hash of a staged upload, which is part of its file name."""
+    return os.path.basename(upload_path).split(".")[1]
+
+
+@app.route("/uploads/<file_name>", methods=["PUT", "POST"])
+def upload(file_name):
+    """Streams a request body (plain or chunked transfer encoding) to the staging directory without buffering it in
+    memory. The content is hashed while it streams in, and the file extension of file_name selects the reader used
+    when the upload is ingested."""
+    extension = os.path.splitext(secure_filename(file_name))[1].lower()
+    upload_id = uuid.uuid4().hex
+    partial_path = os.path.join(UPLOAD_DIRECTORY, upload_id + ".part")
+
+    size = 0
+    digest = blobstore.new_hash()
+    with open(partial_path, "wb") as fout:
+        while True:
+            chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            fout.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+    os.replace(partial_path, os.path.join(UPLOAD_DIRECTORY, f"{upload_id}.{digest.hexdigest()}{extension}"))
+
+    return jsonify({"upload_id": upload_id, "bytes": size, "digest": digest.hexdigest()}), 201
+
+
+@app.route("/ingest", methods=["POST"])
+def ingest_batch():
+    """Processes a batch of staged uploads in parallel and registers them with one bulk insert.
+    Uploads whose content is already stored, or repeated within the batch, skip processing and reference the stored
+    blob. Expects {"experiments": [{"upload_id", "name", "date", "product"}, ...]} and reports the batch throughput."""
+    experiments = (request.get_json(silent=True) or {}).get("experiments") or []
+    staged = list_uploads()
+    uploads = [find_upload(experiment.get("upload_id"), staged) for experiment in experiments]
+    if not experiments or None in uploads or any(not experiment.get("name") or not experiment.get("date") for experiment in experiments):
+        abort(400)
+
+    started = time.perf_counter()
+    registered, failed = ingest.ingest_files(
+        [{**experiment, "path": upload_path, "digest": upload_digest(upload_path), "row_id": None} for experiment, upload_path in zip(experiments, uploads)],
+        get_ingest_executor(),
+    )
+    ids = [row_id for _, row_id, _ in registered]
+    failed = [{"upload_id": experiment["upload_id"], "error": error} for experiment, error in failed]
+
+    results = [result for _, _, result in registered]
+    elapsed = time.perf_counter() - started
+    raw_bytes = sum(result["raw_bytes"] for result in results)
+    stored_bytes = sum(result["stored_bytes"] for result in results)
+    encodings = collections.Counter(
+        entry["encoding"] for result in results if not result.get("deduplicated") for entry in (result.get("compression") or {}).values()
+    )
+    return jsonify({
+        "ids": ids,
+        "failed": failed,
+        "files": len(results),
+        "deduplicated": sum(1 for result in results if result.get("deduplicated")),
+        "raw_bytes": raw_bytes,
+        "stored_bytes": stored_bytes,
+        "encodings": dict(encodings),
+        "seconds": elapsed,
+        "files_per_second": len(results) / elapsed,
+        "megabytes_per_second": raw_bytes / elapsed / 1e6,
+    })
+
+
+if __name__ == "__main__":
+    from miner import watch
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--watch", action="append", default=[], help="drop directory to ingest new files from, repeatable")
+    parser.add_argument("--poll", action="store_true", help="poll the drop directories instead of using inotify")
+    args = parser.parse_args()
+
+    os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
+    os.makedirs(DATA_DIRECTORY, exist_ok=True)
+    db.set_default_database_file("data.db")
+    db.set_default_database_table_name("data")
+    db.initialize_database()
+    blobstore.enable_garbage_collection()
+    if args.watch:
+        watch.Watcher(args.watch, get_ingest_executor(), poll=args.poll).start()
+    # The reloader would run a second watcher in its child process
+    app.run(debug=True, port=5001, use_reloader=not args.watch)
@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from database import db, statistics
+from storage import datafiles, chunked, blobstore
+
+PARQUET_COMPRESSION = "zstd"
+PARQUET_COMPRESSION_LEVEL = 3
+# Chunked outputs get an encoding and codec per column, picked from a sample of it (see storage/codecs.py)
+CHUNKED_COMPRESSION = "auto"
+
+
+def write_output(output_path, data):
+    """Writes experiment data in the format of the output path's extension: the memory-mapped chunked format
+    (storage/chunked.py) for .chunks files and compressed Parquet otherwise."""
+    if chunked.is_chunked(output_path):
+        chunked.write_chunked(output_path, data, compression=CHUNKED_COMPRESSION)
+    else:
+        table = pa.table({channel: values for channel, values in data.items()})
+        pq.write_table(table, output_path, compression=PARQUET_COMPRESSION, compression_level=PARQUET_COMPRESSION_LEVEL)
+
+
+def process_upload(upload_path, output_path, remove_upload=True):
+    """Formats an uploaded experiment file for storage (see write_output) and summarizes its channels.
+    Runs inside a pool worker. The output appears atomically, so a stored blob is always complete, and the upload is
+    removed once it has been processed unless remove_upload is False."""
+    started = time.perf_counter()
+    raw_bytes = os.path.getsize(upload_path)
+
+    data = datafiles.load_experiment_data(upload_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    partial_path = f"{output_path}.{os.getpid()}.part{os.path.splitext(output_path)[1]}"
+    write_output(partial_path, data)
+    os.replace(partial_path, output_path)
+
+    # The experiment id is only known once the batch is registered, so it is filled in by the caller
+    summaries = statistics.summarize_experiment(None, data)
+    if remove_upload:
+        os.remove(upload_path)
+
+    return {
+        "datapath": output_path,
+        "raw_bytes": raw_bytes,
+        "stored_bytes": os.path.getsize(output_path),
+        "rows": len(next(iter(data.values()))) if data else 0,
+        "statistics": summaries,
+        "compression": chunked.ChunkedReader(output_path).compression_report() if chunked.is_chunked(output_path) else None,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def deduplicated_upload(upload_path, datapath):
+    """Returns the ingest result of an upload whose content is already stored at datapath, without processing it.
+    The statistics are copied from an experiment referencing the same data, or summarized from the stored data
+    when none does anymore."""
+    started = time.perf_counter()
+    referencing = db.query_rows(columns=["id"], filters=[{"column": "datapath", "op": "=", "value": datapath}], limit=1)
+    if referencing:
+        summaries = db.get_statistics([referencing[0]["id"]]).to_dict("records")
+    else:
+        summaries = statistics.summarize_experiment(None, datafiles.load_experiment_data(datapath))
+    rows = chunked.ChunkedReader(datapath).num_rows if chunked.is_chunked(datapath) else pq.read_metadata(datapath).num_rows
+
+    return {
+        "datapath": datapath,
+        "raw_bytes": os.path.getsize(upload_path),
+        "stored_bytes": 0,
+        "rows": rows,
+        "statistics": [{key: value for key, value in summary.items() if key != "id"} for summary in summaries],
+        "seconds": time.perf_counter() - started,
+        "deduplicated": True,
+    }
+
+
+def ingest_files(experiments, executor, remove_files=True, on_registered=None):
+    """Processes a batch of experiment files in parallel on executor and registers them with one bulk insert.
+    experiments are {"path", "digest", "name", "date", "product"} dictionaries, digest being the content hash of the
+    file. An experiment with a "row_id" replaces the data of that row instead of adding one. Files whose content is
+    already stored, or repeated within the batch, skip processing and reference the stored blob. Processed files are
+    removed unless remove_files is False. on_registered(registered) runs inside the registration transaction.
+    Returns the registered [(experiment, row id, result)] and the failed [(experiment, error)]."""
+    processing = {}
+    for experiment in experiments:
+        digest = experiment["digest"]
+        if digest not in processing and blobstore.find_blob(digest) is None:
+            processing[digest] = (experiment["path"], executor.submit(process_upload, experiment["path"], blobstore.blob_path(digest), remove_files))
+
+    results, failed = [], []
+    for experiment in experiments:
+        path, digest = experiment["path"], experiment["digest"]
+        try:
+            if digest not in processing:
+                result = deduplicated_upload(path, blobstore.blob_path(digest))
+            elif processing[digest][0] != path:
+                result = {**processing[digest][1].result(), "raw_bytes": os.path.getsize(path), "stored_bytes": 0, "deduplicated": True}
+            else:
+                result = processing[digest][1].result()
+        except Exception as error:
+            # Unreadable files (bad archives, parse errors) and a broken worker pool fail this file, not the batch
+            failed.append((experiment, str(error) or type(error).__name__))
+            continue
+        results.append((experiment, result))
+
+    # Rows are registered under the write lock, which the blob garbage collector also takes before removing anything
+    with db.transaction():
+        stored = []
+        for experiment, result in results:
+            if os.path.exists(result["datapath"]):
+                stored.append((experiment, result))
+            else:
+                failed.append((experiment, "Stored content was removed concurrently, ingest again"))
+
+        replaced_ids = [experiment["row_id"] for experiment, _ in stored if experiment.get("row_id") is not None]
+        replaced = {
+            row["id"]: row["datapath"]
+            for row in db.query_rows(columns=["id", "datapath"], filters=[{"column": "id", "op": "in", "value": replaced_ids}])
+        } if replaced_ids else {}
+        added = [(experiment, result) for experiment, result in stored if experiment.get("row_id") not in replaced]
+        rows = [
+            {"name": experiment["name"], "date": experiment["date"], "product": experiment.get("product"), "datapath": result["datapath"]}
+            for experiment, result in added
+        ]
+        ids = db.add_rows(rows) if rows else []
+        registered = [(experiment, row_id, result) for (experiment, result), row_id in zip(added, ids)]
+        for experiment, result in stored:
+            if experiment.get("row_id") in replaced:
+                db.edit_row(experiment["row_id"], {"datapath": result["datapath"]})
+                registered.append((experiment, experiment["row_id"], result))
+        db.delete_statistics(replaced)
+        db.add_statistics([{**summary, "id": row_id} for _, row_id, result in registered for summary in result["statistics"]])
+        if on_registered is not None:
+            on_registered(registered)
+
+    if remove_files:
+        for experiment, _, _ in registered:
+            if os.path.exists(experiment["path"]):
+                os.remove(experiment["path"])
+    blobstore.collect_garbage(replaced.values())
+    return registered, failed
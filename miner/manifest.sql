@@ -0,0 +1,13 @@
+-- Files of the watched drop directories that MINER has ingested (or failed to ingest), written in the transaction
+-- that registers them. A file is only ingested again when its size or modification time changes, so a restarted
+-- watcher resumes where it left off. row_id is the experiment the file's data was last registered as.
+CREATE TABLE IF NOT EXISTS {table_name}_watch_manifest (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT,
+    state TEXT NOT NULL,
+    row_id INTEGER,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
@@ -0,0 +1,326 @@
+import os
+import sys
+import time
+import queue
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import argparse
+import threading
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from database import db
+from miner import ingest
+from storage import blobstore, chunked
+
+MANIFEST_SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "manifest.sql")
+
+# Formats load_experiment_data can read
+WATCHED_EXTENSIONS = {".csv", ".parquet", ".feather", ".arrow", ".npy", ".npz", chunked.CHUNKED_EXTENSION}
+WATCH_WORKERS = os.cpu_count() or 2
+WATCH_QUEUE_SIZE = 256
+WATCH_BATCH_SIZE = 16
+# A file nobody has been notified to have closed is only picked up once it hasn't been modified for SETTLE_SECONDS
+SETTLE_SECONDS = 5.0
+POLL_INTERVAL = 10.0
+# Full rescans behind inotify, which catch events lost to a queue overflow or an unwatched mount
+RESCAN_INTERVAL = 600.0
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+logger = logging.getLogger("miner.watch")
+
+
+class Inotify:
+    """Recursive inotify watches through libc, reporting closed and moved-in files as they appear."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+
+    def add_watch(self, directory):
+        """Watches a directory and its subdirectories. Returns the directories that are watched from now on."""
+        added = []
+        for root, _, _ in os.walk(directory):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), INOTIFY_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {root}")
+            self.directories[wd] = root
+            added.append(root)
+        return added
+
+    def read_events(self, timeout):
+        """Returns the (path, mask) events that arrive within timeout seconds. A (None, IN_Q_OVERFLOW) event means
+        events were lost."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset < len(buffer):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+            name = buffer[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0")
+            offset += INOTIFY_EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+            elif wd in self.directories:
+                events.append((os.path.join(self.directories[wd], os.fsdecode(name)), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def file_metadata(path, directory):
+    """Returns the name, date and product of a dropped file: its path below the drop directory without extension,
+    the day it was last modified and the first subdirectory it lies in, if any."""
+    relative = os.path.relpath(path, directory)
+    parts = relative.split(os.sep)
+    return {
+        "name": os.path.splitext(relative)[0],
+        "date": time.strftime("%Y-%m-%d", time.localtime(os.path.getmtime(path))),
+        "product": parts[0] if len(parts) > 1 else None,
+    }
+
+
+class Watcher:
+    """Ingests the experiment files that appear or change in drop directories. A producer thread detects them with
+    inotify, or by polling when inotify isn't available or poll is set, and feeds a bounded queue that blocks it
+    while the workers are behind. Workers hash and ingest files in batches and record them in the manifest."""
+
+    def __init__(self, directories, executor, poll=False, workers=WATCH_WORKERS, queue_size=WATCH_QUEUE_SIZE):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.executor = executor
+        self.poll = poll
+        self.workers = workers
+        self.table_name = db.resolve_database_table_name()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.queued = set()
+        self.queued_lock = threading.Lock()
+        # Files that changed again while queued, handed back to the producer once their worker is done
+        self.changed = set()
+        self.recheck = queue.SimpleQueue()
+        self.settling = {}
+        self.manifest = {}
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def start(self):
+        db.execute_sql_script(MANIFEST_SCHEMA_FILE, {"table_name": self.table_name})
+        with db.transaction(write=False) as conn:
+            for path, size, mtime_ns, digest, row_id in conn.execute(f"SELECT path, size, mtime_ns, digest, row_id FROM {self.table_name}_watch_manifest"):
+                self.manifest[path] = (size, mtime_ns, digest, row_id)
+
+        self.threads = [threading.Thread(target=self.work, name=f"miner-watch-worker-{index}", daemon=True) for index in range(self.workers)]
+        self.threads.append(threading.Thread(target=self.produce, name="miner-watch", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+
+    def directory_of(self, path):
+        return next(directory for directory in self.directories if os.path.commonpath([directory, path]) == directory)
+
+    def scan(self, directory):
+        for root, _, file_names in os.walk(directory):
+            for file_name in file_names:
+                self.consider(os.path.join(root, file_name))
+
+    def consider(self, path, closed=False):
+        """Queues a file unless the manifest holds its current version. Files nobody reported closed wait until they
+        have settled."""
+        if os.path.splitext(path)[1].lower() not in WATCHED_EXTENSIONS:
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.settling.pop(path, None)
+            return
+        entry = self.manifest.get(path)
+        if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+            self.settling.pop(path, None)
+            return
+        if not closed and time.time() - stat.st_mtime < SETTLE_SECONDS:
+            self.settling[path] = stat.st_mtime
+            return
+        self.settling.pop(path, None)
+        with self.queued_lock:
+            if path in self.queued:
+                self.changed.add(path)
+                return
+            self.queued.add(path)
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(path, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+    def check_settling(self):
+        for path in list(self.settling):
+            self.consider(path)
+        while not self.recheck.empty():
+            self.consider(self.recheck.get(), closed=True)
+
+    def produce(self):
+        inotify = None
+        if not self.poll:
+            try:
+                inotify = Inotify()
+                for directory in self.directories:
+                    inotify.add_watch(directory)
+            except (OSError, AttributeError) as error:
+                logger.warning("inotify unavailable (%s), polling the drop directories every %ss instead", error, POLL_INTERVAL)
+                if inotify is not None:
+                    inotify.close()
+                inotify = None
+
+        try:
+            last_scan = time.monotonic()
+            for directory in self.directories:
+                self.scan(directory)
+            while not self.stopping.is_set():
+                interval = POLL_INTERVAL if inotify is None else RESCAN_INTERVAL
+                if time.monotonic() - last_scan >= interval:
+                    last_scan = time.monotonic()
+                    for directory in self.directories:
+                        self.scan(directory)
+                if inotify is None:
+                    self.stopping.wait(min(POLL_INTERVAL, SETTLE_SECONDS))
+                else:
+                    self.handle_events(inotify, inotify.read_events(1.0))
+                self.check_settling()
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def handle_events(self, inotify, events):
+        for path, mask in events:
+            if path is None:
+                logger.warning("inotify queue overflowed, rescanning the drop directories")
+                for directory in self.directories:
+                    self.scan(directory)
+            elif mask & IN_ISDIR:
+                # Files may have landed in a new directory before its watch was added
+                for directory in inotify.add_watch(path):
+                    self.scan(directory)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.consider(path, closed=True)
+            else:
+                self.consider(path)
+
+    def work(self):
+        while not self.stopping.is_set():
+            try:
+                paths = [self.queue.get(timeout=1.0)]
+            except queue.Empty:
+                continue
+            while len(paths) < WATCH_BATCH_SIZE:
+                try:
+                    paths.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.ingest(paths)
+            except Exception:
+                logger.exception("Ingesting %d dropped files failed", len(paths))
+            finally:
+                with self.queued_lock:
+                    self.queued.difference_update(paths)
+                    for path in self.changed.intersection(paths):
+                        self.changed.discard(path)
+                        self.recheck.put(path)
+
+    def ingest(self, paths):
+        """Ingests a batch of dropped files and records them in the manifest together with their rows. Files whose
+        content didn't change since their manifest entry (ingested or failed) only get its size and time updated."""
+        experiments, unchanged = [], []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                digest = blobstore.hash_file(path)
+            except FileNotFoundError:
+                continue
+            entry = self.manifest.get(path)
+            experiment = {"path": path, "digest": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "row_id": entry[3] if entry else None}
+            if entry is not None and entry[2] == digest:
+                unchanged.append(experiment)
+            else:
+                experiments.append({**experiment, **file_metadata(path, self.directory_of(path))})
+
+        def record(registered, failed=()):
+            entries = [(experiment, "ingested", row_id, None) for experiment, row_id, _ in registered]
+            entries += [(experiment, "failed", experiment["row_id"], error) for experiment, error in failed]
+            with db.transaction() as conn:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {self.table_name}_watch_manifest (path, size, mtime_ns, digest, state, row_id, error, updated_at) "
+                    f"VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(experiment["path"], experiment["size"], experiment["mtime_ns"], experiment["digest"], state, row_id, error, time.time()) for experiment, state, row_id, error in entries],
+                )
+            for experiment, _, row_id, _ in entries:
+                self.manifest[experiment["path"]] = (experiment["size"], experiment["mtime_ns"], experiment["digest"], row_id)
+
+        if unchanged:
+            with db.transaction() as conn:
+                conn.executemany(
+                    f"UPDATE {self.table_name}_watch_manifest SET size = ?, mtime_ns = ?, updated_at = ? WHERE path = ?",
+                    [(experiment["size"], experiment["mtime_ns"], time.time(), experiment["path"]) for experiment in unchanged],
+                )
+            for experiment in unchanged:
+                self.manifest[experiment["path"]] = (experiment["size"], experiment["mtime_ns"], experiment["digest"], experiment["row_id"])
+        if experiments:
+            registered, failed = ingest.ingest_files(experiments, self.executor, remove_files=False, on_registered=record)
+            if failed:
+                record([], failed)
+                for experiment, error in failed:
+                    logger.warning("Could not ingest %s: %s", experiment["path"], error)
+
+
+if __name__ == "__main__":
+    from miner import app as miner_app
+
+    parser = argparse.ArgumentParser(description="Ingests the experiment files dropped into directories as they appear.")
+    parser.add_argument("directories", nargs="+")
+    parser.add_argument("--db-file", default="data.db")
+    parser.add_argument("--table-name", default="data")
+    parser.add_argument("--poll", action="store_true", help="poll instead of using inotify, e.g. for network shares")
+    parser.add_argument("--workers", type=int, default=WATCH_WORKERS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(miner_app.DATA_DIRECTORY, exist_ok=True)
+    db.set_default_database_file(args.db_file)
+    db.set_default_database_table_name(args.table_name)
+    db.initialize_database()
+    blobstore.enable_garbage_collection()
+
+    watcher = Watcher(args.directories, miner_app.get_ingest_executor(), poll=args.poll, workers=args.workers)
+    watcher.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
@@ -0,0 +1,250 @@
+import os
+import sys
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from utils import lazy
+from database import db
+from storage import datafiles
+
+np = lazy.lazy_import("numpy")
+
+LOAD_WORKERS = 8
+# Analyses run inside the job worker, which already has a CPU of its own (see jobs.JOB_WORKERS). Large batches are
+# analysed in channel blocks of about this size, so progress is reported and cancellation checked between them.
+ANALYSIS_BLOCK_BYTES = 64 * 1024 * 1024
+# Upper bound on the samples per experiment once series are aligned onto a common x grid
+ALIGN_MAX_SAMPLES = 100000
+ENVELOPE_POINTS = 200
+
+ANALYSES = {}
+
+
+class ExperimentBatch:
+    """Experiments aligned onto a common x grid. values[e, c, s] is channel c of experiment e at x[s],
+    NaN where the experiment has no data there or doesn't have the channel at all."""
+
+    def __init__(self, ids, names, channels, x, values):
+        self.ids = ids
+        self.names = names
+        self.channels = channels
+        self.x = x
+        self.values = values
+
+    def channel(self, name):
+        """Returns one channel as an (experiments, samples) array."""
+        return self.values[:, self.channels.index(name), :]
+
+
+def register_analysis(name):
+    """Registers an analysis under a name. Analyses are called as function(batch) with an ExperimentBatch and
+    return a JSON serializable {channel: result} dictionary. Channels must be analysed independently of each
+    other, since large batches are split into channel blocks that are analysed one after the other."""
+    def decorator(function):
+        ANALYSES[name] = function
+        return function
+    return decorator
+
+
+def to_list(array):
+    """Converts an array to a list with NaN and infinite values as None."""
+    array = np.asarray(array, dtype=np.float64)
+    return np.where(np.isfinite(array), array, None).tolist()
+
+
+def load_experiments(row_ids, progress=None, db_file=None, table_name=None):
+    """Loads the data of the given experiments in parallel. Returns the loaded rows, their (x, {channel: y}) series
+    and the ids whose data couldn't be loaded."""
+    rows = db.query_rows(
+        columns=["id", "name", "datapath"],
+        filters=[{"column": "id", "op": "in", "value": list(row_ids)}],
+        order_by=[("id", "asc")],
+        db_file=db_file,
+        table_name=table_name,
+    )
+
+    def load(row):
+        return datafiles.split_time_column(datafiles.load_experiment_data(row["datapath"]))
+
+    loaded_rows, series, failed = [], [], []
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        futures = [executor.submit(load, row) for row in rows]
+        for index, (row, future) in enumerate(zip(rows, futures)):
+            try:
+                series.append(future.result())
+                loaded_rows.append(row)
+            except (OSError, ValueError, KeyError):
+                failed.append(row["id"])
+            if progress is not None:
+                progress(0.5 * (index + 1) / len(rows), f"Loaded {index + 1} of {len(rows)} experiments")
+    return loaded_rows, series, failed
+
+
+def align_grid(series):
+    """Returns the common x grid of the series: their shared x when they all have the same one, otherwise an even
+    grid over the union of their ranges."""
+    first_x = series[0][0]
+    if len(first_x) <= ALIGN_MAX_SAMPLES and all(len(x) == len(first_x) and np.array_equal(x, first_x) for x, _ in series):
+        return first_x
+    start = min(np.nanmin(x) for x, _ in series if len(x))
+    stop = max(np.nanmax(x) for x, _ in series if len(x))
+    samples = min(max(len(x) for x, _ in series), ALIGN_MAX_SAMPLES)
+    return np.linspace(start, stop, samples)
+
+
+def align_series(series, channels, grid, values):
+    """Fills values (experiments, channels, samples) with every series interpolated onto the grid."""
+    for index, (x, data) in enumerate(series):
+        if len(x) > 1 and not np.all(x[1:] >= x[:-1]):
+            order = np.argsort(x, kind="stable")
+            x, data = x[order], {channel: y[order] for channel, y in data.items()}
+        same_grid = len(x) == len(grid) and np.array_equal(x, grid)
+        for channel_index, channel in enumerate(channels):
+            y = data.get(channel)
+            if y is None or len(x) == 0:
+                values[index, channel_index] = np.nan
+            elif same_grid:
+                values[index, channel_index] = y
+            else:
+                values[index, channel_index] = np.interp(grid, x, y, left=np.nan, right=np.nan)
+
+
+def run_analysis(name, row_ids, progress, db_file=None, table_name=None):
+    """Loads the selected experiments with a thread pool, aligns them into one (experiments, channels, samples)
+    array and runs a registered analysis on all of them at once, in channel blocks of about ANALYSIS_BLOCK_BYTES.
+    Can be used as a job function."""
+    if name not in ANALYSES:
+        raise ValueError(f"Unknown analysis: {name}")
+    rows, series, failed = load_experiments(row_ids, progress, db_file, table_name)
+    result = {"analysis": name, "experiments": [{"id": row["id"], "name": row["name"]} for row in rows], "failed": failed, "channels": {}}
+    if not rows:
+        return result
+
+    channels = list(dict.fromkeys(channel for _, data in series for channel in data))
+    grid = align_grid(series)
+    shape = (len(rows), len(channels), len(grid))
+    ids, names = [row["id"] for row in rows], [row["name"] for row in rows]
+    result.update({"x_range": to_list([grid[0], grid[-1]]) if len(grid) else None, "samples": len(grid)})
+    progress(0.5, "Aligning experiments")
+
+    values = np.empty(shape, dtype=np.float64)
+    align_series(series, channels, grid, values)
+    series = None
+
+    nbytes = values.nbytes
+    block_count = min(max(-(-nbytes // ANALYSIS_BLOCK_BYTES), 1), len(channels))
+    boundaries = np.linspace(0, len(channels), block_count + 1).astype(int)
+    for index, (start, stop) in enumerate(zip(boundaries[:-1], boundaries[1:])):
+        batch = ExperimentBatch(ids, names, channels[start:stop], grid, values[:, start:stop, :])
+        with warnings.catch_warnings():
+            # All-NaN slices are expected where experiments don't overlap, and come out as None
+            warnings.simplefilter("ignore", RuntimeWarning)
+            result["channels"].update(ANALYSES[name](batch))
+        if block_count > 1:
+            progress(0.5 + 0.5 * (index + 1) / block_count, f"Analysed {index + 1} of {block_count} channel blocks")
+    return result
+
+
+@register_analysis("summary")
+def summarize(batch):
+    """Mean, standard deviation, minimum, maximum and RMS of every channel of every experiment."""
+    values = batch.values
+    statistics = {
+        "mean": np.nanmean(values, axis=2),
+        "std": np.nanstd(values, axis=2),
+        "min": np.nanmin(values, axis=2),
+        "max": np.nanmax(values, axis=2),
+        "rms": np.sqrt(np.nanmean(values ** 2, axis=2)),
+    }
+    return {
+        channel: {statistic: to_list(array[:, index]) for statistic, array in statistics.items()}
+        for index, channel in enumerate(batch.channels)
+    }
+
+
+@register_analysis("deviation")
+def deviation(batch):
+    """RMS and maximum absolute deviation of every experiment from the mean of all experiments, and the experiment
+    that deviates the most."""
+    difference = batch.values - np.nanmean(batch.values, axis=0, keepdims=True)
+    rms = np.sqrt(np.nanmean(difference ** 2, axis=2))
+    max_abs = np.nanmax(np.abs(difference), axis=2)
+    ranking = np.where(np.isfinite(rms), rms, -np.inf)
+    results = {}
+    for index, channel in enumerate(batch.channels):
+        most_deviating = int(np.argmax(ranking[:, index]))
+        results[channel] = {
+            "rms": to_list(rms[:, index]),
+            "max_abs": to_list(max_abs[:, index]),
+            "most_deviating": batch.ids[most_deviating] if np.isfinite(rms[most_deviating, index]) else None,
+        }
+    return results
+
+
+@register_analysis("correlation")
+def correlation(batch):
+    """Pearson correlation matrix between experiments, over the samples where every experiment has data."""
+    results = {}
+    for index, channel in enumerate(batch.channels):
+        values = batch.values[:, index, :]
+        values = values[:, np.all(np.isfinite(values), axis=0)]
+        if values.shape[1] < 2:
+            results[channel] = {"matrix": None, "samples": int(values.shape[1])}
+            continue
+        centered = values - values.mean(axis=1, keepdims=True)
+        norms = np.sqrt((centered ** 2).sum(axis=1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            matrix = (centered @ centered.T) / np.outer(norms, norms)
+        results[channel] = {"matrix": to_list(matrix), "samples": int(values.shape[1])}
+    return results
+
+
+@register_analysis("peaks")
+def peaks(batch):
+    """Largest absolute value of every channel of every experiment and where it occurs."""
+    magnitudes = np.abs(batch.values)
+    missing = np.all(np.isnan(magnitudes), axis=2)
+    positions = np.argmax(np.where(np.isnan(magnitudes), -np.inf, magnitudes), axis=2)
+    peak_values = np.take_along_axis(batch.values, positions[..., np.newaxis], axis=2)[..., 0]
+    peak_x = np.where(missing, np.nan, batch.x[positions])
+    peak_values = np.where(missing, np.nan, peak_values)
+    return {
+        channel: {"value": to_list(peak_values[:, index]), "x": to_list(peak_x[:, index])}
+        for index, channel in enumerate(batch.channels)
+    }
+
+
+@register_analysis("trend")
+def trend(batch):
+    """Least-squares linear trend (slope and intercept against x) of every channel of every experiment."""
+    valid = np.isfinite(batch.values)
+    x = np.where(valid, batch.x, 0.0)
+    y = np.where(valid, batch.values, 0.0)
+    count = valid.sum(axis=2)
+    sum_x, sum_y = x.sum(axis=2), y.sum(axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (count * (x * y).sum(axis=2) - sum_x * sum_y) / (count * (x ** 2).sum(axis=2) - sum_x ** 2)
+        intercept = (sum_y - slope * sum_x) / count
+    return {
+        channel: {"slope": to_list(slope[:, index]), "intercept": to_list(intercept[:, index])}
+        for index, channel in enumerate(batch.channels)
+    }
+
+
+@register_analysis("envelope")
+def envelope(batch):
+    """Minimum, mean and maximum across experiments along x, reduced to ENVELOPE_POINTS buckets."""
+    samples = batch.values.shape[2]
+    starts = np.unique(np.linspace(0, samples, min(ENVELOPE_POINTS, samples), endpoint=False).astype(int))
+    valid = np.isfinite(batch.values)
+    lower = np.fmin.reduceat(np.nanmin(batch.values, axis=0), starts, axis=1)
+    upper = np.fmax.reduceat(np.nanmax(batch.values, axis=0), starts, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.add.reduceat(np.where(valid, batch.values, 0.0).sum(axis=0), starts, axis=1) / np.add.reduceat(valid.sum(axis=0), starts, axis=1)
+    return {
+        channel: {"x": to_list(batch.x[starts]), "min": to_list(lower[index]), "mean": to_list(mean[index]), "max": to_list(upper[index])}
+        for index, channel in enumerate(batch.channels)
+    }
@@ -1,10 +1,16 @@
 import os
 import sys
+import argparse
 from dash import Dash
 
 from layout import layout
 from callbacks import callbacks
+from routes import routes
+from jobs import jobs
 from database import db
+from metrics import metrics
+from utils import lazy
+from storage import blobstore
 
 AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(__file__))
 ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
@@ -12,11 +18,34 @@ ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'assets')
 sys.path.append(AMAIAS_DIRECTORY)
 
 app = Dash("SPEED", assets_folder=ASSETS_PATH)
-app.layout = layout.serve_layout()
+# Served per page load, so each session gets the current columns
+app.layout = layout.serve_layout
 callbacks.register_callbacks(app)
+routes.register_routes(app)
+
+metrics.instrument_database(db)
+metrics.instrument_callbacks(app)
+metrics.instrument_server(app.server)
 
 if __name__ == '__main__':
-    db.set_default_database_file("data.db")
-    db.set_default_database_table_name("data")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-file", default="data.db")
+    parser.add_argument("--table-name", default="data")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--no-debug", action="store_true", help="run without the Dash dev tools and reloader")
+    parser.add_argument("--blob-root", default=blobstore.BLOB_ROOT, help="directory MINER stores experiments in")
+    parser.add_argument("--fast-start", action="store_true", help="serve right away and import pandas, pyarrow and plotly on first use")
+    args = parser.parse_args()
+
+    db.set_default_database_file(args.db_file)
+    db.set_default_database_table_name(args.table_name)
+    db.set_result_cache_enabled(True)
     db.initialize_database()
-    app.run(debug=True)
\ No newline at end of file
+    jobs.initialize_job_store()
+    # Rows deleted from the grid or through /mutations release the stored experiments nothing references anymore
+    blobstore.set_blob_root(args.blob_root)
+    blobstore.enable_garbage_collection()
+    # Without --fast-start the lazily imported modules are loaded before serving, so no request waits for them
+    if not args.fast_start:
+        lazy.preload()
+    app.run(debug=not args.no_debug, port=args.port)
\ No newline at end of file
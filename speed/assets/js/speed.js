@@ -0,0 +1,22 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    speed: {
+        // Applies a row delta from refresh_database_table to the infinite row model of the database grid.
+        // Loaded rows are updated in place; inserts, deletes and resets re-request the cached blocks.
+        apply_database_delta: async function (delta) {
+            if (!delta) {
+                return window.dash_clientside.no_update;
+            }
+            const api = await dash_ag_grid.getApiAsync("database-table");
+            (delta.update || []).forEach(function (row) {
+                const node = api.getRowNode(String(row.id));
+                if (node) {
+                    node.setData(row);
+                }
+            });
+            if (delta.reset || (delta.add || []).length || (delta.remove || []).length) {
+                api.refreshInfiniteCache();
+            }
+            return window.dash_clientside.no_update;
+        },
+    },
+});
@@ -1,100 +1,257 @@
 import os
 import sys
-from dash import html, dcc, Input, Output, State, no_update
+import json
+from dash import html, dcc, ctx, Input, Output, State, ClientsideFunction, no_update
 import dash_bootstrap_components as dbc
-import pandas as pd
 
 AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 sys.path.append(AMAIAS_DIRECTORY)
 
+from utils import lazy
 from database import db
 from layout import layout
+from plotting import plotting
+from jobs import jobs
+
+pd = lazy.lazy_import("pandas")
+
+GRID_FILTER_OPERATORS = {
+    "equals": "=",
+    "notEqual": "!=",
+    "lessThan": "<",
+    "lessThanOrEqual": "<=",
+    "greaterThan": ">",
+    "greaterThanOrEqual": ">=",
+    "inRange": "between",
+    "contains": "contains",
+    "notContains": "not_contains",
+    "startsWith": "starts_with",
+    "endsWith": "ends_with",
+    "blank": "is_null",
+    "notBlank": "not_null",
+}
+
+
+def grid_filter_to_filters(filter_model):
+    """Translates an AgGrid filterModel into db.build_where_clause filters."""
+    def translate(column, condition):
+        if "conditions" in condition or "condition1" in condition:
+            conditions = condition.get("conditions") or [condition.get("condition1"), condition.get("condition2")]
+            key = "any" if condition.get("operator", "AND").upper() == "OR" else "all"
+            return {key: [translate(column, _) for _ in conditions if _]}
+
+        op = GRID_FILTER_OPERATORS[condition["type"]]
+        if condition.get("filterType") == "date":
+            value, value_to = condition.get("dateFrom"), condition.get("dateTo")
+            value, value_to = value and value[:10], value_to and value_to[:10]
+        else:
+            value, value_to = condition.get("filter"), condition.get("filterTo")
+        return {"column": column, "op": op, "value": (value, value_to) if op == "between" else value}
+
+    return [translate(column, condition) for column, condition in (filter_model or {}).items()]
+
+
+def grid_sort_to_sort(sort_model):
+    """Translates an AgGrid sortModel into db.build_order_clause sort terms."""
+    return [(_["colId"], _["sort"]) for _ in sort_model or []]
+
 
 def register_callbacks(app):
     @app.callback(
-        Output(component_id="database-table", component_property="rowData", allow_duplicate=True),
         Output(component_id="database-table", component_property="columnDefs", allow_duplicate=True),
         Output(component_id="database-store", component_property="data", allow_duplicate=True),
-        Input(component_id="database-store", component_property="data"),
+        Output(component_id="database-delta", component_property="data"),
+        Input(component_id="database-refresh-interval", component_property="n_intervals"),
+        State(component_id="database-store", component_property="data"),
+        State(component_id="database-served", component_property="data"),
         prevent_initial_call="initial_call_duplicate"
     )
-    def refresh_database_table(database_store):
-        database_store = db.get_table_as_df().to_dict("records")
-        row_data = [_ for _ in database_store]
-        column_defs = layout.serve_column_defs(db.get_column_names())
-        
-        return row_data, column_defs, database_store
+    def refresh_database_table(n_intervals, database_store, served=None):
+        schema = db.get_table_schema()
+        database_store = database_store or {}
 
-    @app.callback(
+        # A fresh page served with the current schema already has its columns and its grid is fetching rows, so it
+        # continues from the change version it was served at instead of reloading
+        if not ctx.triggered_id and served and served["schema_version"] == schema["schema_version"]:
+            return no_update, served, no_update
+
+        # A fresh page or a schema change reloads the grid, otherwise only the rows changed since the last sync are sent
+        if not ctx.triggered_id or database_store.get("schema_version") != schema["schema_version"]:
+            database_store = {"version": db.get_change_version(), "schema_version": schema["schema_version"]}
+            return layout.serve_column_defs(schema["columns"]), database_store, {"reset": True}
+
+        changes = db.get_changes_since(database_store.get("version", 0), max_changes=layout.DATABASE_MAX_DELTA_ROWS)
+        if changes["version"] == database_store.get("version"):
+            return no_update, no_update, no_update
+
+        database_store = {"version": changes["version"], "schema_version": schema["schema_version"]}
+        if changes["truncated"]:
+            return no_update, database_store, {"reset": True}
+        delta = {"add": changes["added"], "update": changes["updated"], "remove": changes["deleted"]}
+
+        return no_update, database_store, delta
+
+    app.clientside_callback(
+        ClientsideFunction(namespace="speed", function_name="apply_database_delta"),
         Output(component_id="dummy-div", component_property="children", allow_duplicate=True),
+        Input(component_id="database-delta", component_property="data"),
+        prevent_initial_call=True
+    )
+
+    @app.callback(
+        Output(component_id="database-table", component_property="getRowsResponse"),
+        Input(component_id="database-table", component_property="getRowsRequest"),
+        prevent_initial_call=True
+    )
+    def get_database_rows(request):
+        if request is None:
+            return no_update
+
+        row_data, row_count = db.get_table_page(
+            request["startRow"],
+            request["endRow"],
+            sort_model=grid_sort_to_sort(request.get("sortModel")),
+            filters=grid_filter_to_filters(request.get("filterModel")),
+        )
+
+        return {"rowData": row_data, "rowCount": row_count}
+
+    @app.callback(
+        Output(component_id="statistics-table", component_property="rowData"),
+        Input(component_id="statistics-button", component_property="n_clicks"),
+        State(component_id="database-table", component_property="selectedRows"),
+        prevent_initial_call=True
+    )
+    def show_statistics(n_clicks, selected_rows):
+        statistics = db.get_statistics([row["id"] for row in selected_rows or []])
+
+        return statistics.drop(columns=["histogram"]).to_dict("records")
+
+    @app.callback(
+        Output(component_id="plot-graph", component_property="figure"),
+        Output(component_id="plot-store", component_property="data"),
+        Input(component_id="plot-button", component_property="n_clicks"),
+        Input(component_id="plot-graph", component_property="relayoutData"),
+        State(component_id="database-table", component_property="selectedRows"),
+        State(component_id="plot-store", component_property="data"),
+        prevent_initial_call=True
+    )
+    def plot_experiments(n_clicks, relayout_data, selected_rows, plot_store):
+        if ctx.triggered_id == "plot-button":
+            experiments = [(f"{row['id']} {row['name']}", row["datapath"]) for row in selected_rows or []]
+            return plotting.build_figure(experiments), {"experiments": experiments}
+
+        # Zooming re-decimates the visible window at full resolution instead of stretching the overview
+        x_range = plotting.relayout_x_range(relayout_data)
+        if not plot_store or x_range is None:
+            return no_update, no_update
+        figure = plotting.build_figure(plot_store["experiments"], x_range=None if x_range == "auto" else x_range)
+
+        return figure, no_update
+
+    @app.callback(
+        Output(component_id="job-store", component_property="data", allow_duplicate=True),
+        Output(component_id="job-interval", component_property="disabled", allow_duplicate=True),
         Input(component_id="function-1-button", component_property="n_clicks"),
         State(component_id="database-table", component_property="selectedRows"),
         prevent_initial_call=True
     )
     def function_1(n_clicks, selected_rows):
-        print("Function 1")
-        print(selected_rows)
-        
-        return no_update
+        job_id = jobs.submit_job(layout.FUNCTION_ANALYSES["function-1-button"], [row["id"] for row in selected_rows or []])
+
+        return job_id, False
 
     @app.callback(
-        Output(component_id="dummy-div", component_property="children", allow_duplicate=True),
+        Output(component_id="job-store", component_property="data", allow_duplicate=True),
+        Output(component_id="job-interval", component_property="disabled", allow_duplicate=True),
         Input(component_id="function-2-button", component_property="n_clicks"),
         State(component_id="database-table", component_property="selectedRows"),
         prevent_initial_call=True
     )
     def function_2(n_clicks, selected_rows):
-        print("Function 2")
-        print(selected_rows)
-        
-        return no_update
+        job_id = jobs.submit_job(layout.FUNCTION_ANALYSES["function-2-button"], [row["id"] for row in selected_rows or []])
+
+        return job_id, False
 
     @app.callback(
-        Output(component_id="dummy-div", component_property="children", allow_duplicate=True),
+        Output(component_id="job-store", component_property="data", allow_duplicate=True),
+        Output(component_id="job-interval", component_property="disabled", allow_duplicate=True),
         Input(component_id="function-3-button", component_property="n_clicks"),
         State(component_id="database-table", component_property="selectedRows"),
         prevent_initial_call=True
     )
     def function_3(n_clicks, selected_rows):
-        print("Function 3")
-        print(selected_rows)
-        
-        return no_update
-    
+        job_id = jobs.submit_job(layout.FUNCTION_ANALYSES["function-3-button"], [row["id"] for row in selected_rows or []])
+
+        return job_id, False
+
     @app.callback(
-        Output(component_id="dummy-div", component_property="children", allow_duplicate=True),
+        Output(component_id="job-store", component_property="data", allow_duplicate=True),
+        Output(component_id="job-interval", component_property="disabled", allow_duplicate=True),
         Input(component_id="function-4-1-button", component_property="n_clicks"),
         State(component_id="database-table", component_property="selectedRows"),
         prevent_initial_call=True
     )
     def function_4_1(n_clicks, selected_rows):
-        print("Function 4.1")
-        print(selected_rows)
-        
-        return no_update
+        job_id = jobs.submit_job(layout.FUNCTION_ANALYSES["function-4-1-button"], [row["id"] for row in selected_rows or []])
+
+        return job_id, False
 
     @app.callback(
-        Output(component_id="dummy-div", component_property="children", allow_duplicate=True),
+        Output(component_id="job-store", component_property="data", allow_duplicate=True),
+        Output(component_id="job-interval", component_property="disabled", allow_duplicate=True),
         Input(component_id="function-4-2-button", component_property="n_clicks"),
         State(component_id="database-table", component_property="selectedRows"),
         prevent_initial_call=True
     )
     def function_4_2(n_clicks, selected_rows):
-        print("Function 4.2")
-        print(selected_rows)
-        
-        return no_update
+        job_id = jobs.submit_job(layout.FUNCTION_ANALYSES["function-4-2-button"], [row["id"] for row in selected_rows or []])
+
+        return job_id, False
 
     @app.callback(
-        Output(component_id="dummy-div", component_property="children", allow_duplicate=True),
+        Output(component_id="job-store", component_property="data", allow_duplicate=True),
+        Output(component_id="job-interval", component_property="disabled", allow_duplicate=True),
         Input(component_id="function-4-3-button", component_property="n_clicks"),
         State(component_id="database-table", component_property="selectedRows"),
         prevent_initial_call=True
     )
     def function_4_3(n_clicks, selected_rows):
-        print("Function 4.3")
-        print(selected_rows)
-        
+        job_id = jobs.submit_job(layout.FUNCTION_ANALYSES["function-4-3-button"], [row["id"] for row in selected_rows or []])
+
+        return job_id, False
+
+    @app.callback(
+        Output(component_id="job-progress", component_property="value"),
+        Output(component_id="job-progress", component_property="label"),
+        Output(component_id="job-status", component_property="children"),
+        Output(component_id="job-result", component_property="children"),
+        Output(component_id="job-interval", component_property="disabled", allow_duplicate=True),
+        Input(component_id="job-interval", component_property="n_intervals"),
+        Input(component_id="job-store", component_property="data"),
+        prevent_initial_call=True
+    )
+    def show_job_progress(n_intervals, job_id):
+        job = jobs.get_job(job_id) if job_id else None
+        if job is None:
+            return 0, "", "", "", True
+
+        finished = job["status"] in ("done", "failed", "cancelled")
+        status = f"{job['function']}: {job['status']}" + (f" - {job['message']}" if job["message"] else "") + (f" - {job['error']}" if job["error"] else "")
+        result = json.dumps(job["result"], indent=2) if job["result"] is not None else ""
+
+        return round(job["progress"] * 100), f"{round(job['progress'] * 100)}%", status, result, finished
+
+    @app.callback(
+        Output(component_id="dummy-div", component_property="children", allow_duplicate=True),
+        Input(component_id="job-cancel-button", component_property="n_clicks"),
+        State(component_id="job-store", component_property="data"),
+        prevent_initial_call=True
+    )
+    def cancel_job(n_clicks, job_id):
+        if job_id:
+            jobs.cancel_job(job_id)
+
         return no_update
 
 
@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import functools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from database import db
+from analysis import analysis
+
+default_job_store_file:str = "jobs.db"
+JOB_WORKERS = max((os.cpu_count() or 2) - 1, 1)
+
+JOB_FUNCTIONS = {}
+
+job_executor = None
+job_futures = {}
+job_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def set_default_job_store_file(file_path):
+    global default_job_store_file
+    default_job_store_file = file_path
+
+
+def register_job_function(name):
+    """Registers a job function under a name. Job functions are called as function(row_ids, progress, db_file, table_name)
+    and must return a JSON serializable result. progress(fraction, message) reports progress and raises JobCancelled
+    once the job has been cancelled."""
+    def decorator(function):
+        JOB_FUNCTIONS[name] = function
+        return function
+    return decorator
+
+
+def initialize_job_store(job_store_file=None):
+    """Creates the job table. Jobs left queued or running by a previous server process are marked as interrupted."""
+    job_store_file = job_store_file or default_job_store_file
+    with db.transaction(job_store_file) as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, function TEXT NOT NULL, row_ids TEXT NOT NULL, status TEXT NOT NULL, "
+            "progress REAL NOT NULL DEFAULT 0, message TEXT, result TEXT, error TEXT, "
+            "cancel_requested INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("UPDATE jobs SET status = 'failed', error = 'Interrupted by a server restart' WHERE status IN ('queued', 'running')")
+
+
+def get_job_executor():
+    global job_executor
+    with job_lock:
+        if job_executor is None:
+            job_executor = ProcessPoolExecutor(max_workers=JOB_WORKERS)
+        return job_executor
+
+
+def get_job_id(function_name, row_ids, data_version):
+    """Identical submissions (same function, same rows, unchanged table) map to the same job."""
+    key = json.dumps([function_name, sorted(row_ids), data_version])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def update_job(job_id, job_store_file, **fields):
+    fields["updated_at"] = time.time()
+    assignments = ", ".join(f"{field} = ?" for field in fields)
+    with db.transaction(job_store_file) as conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", tuple(fields.values()) + (job_id,))
+
+
+def get_job(job_id, job_store_file=None):
+    """Returns the job as a dictionary with its status, progress and decoded result, or None if it doesn't exist."""
+    job_store_file = job_store_file or default_job_store_file
+    with db.transaction(job_store_file, write=False) as conn:
+        cursor = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([description[0] for description in cursor.description], row))
+    job["row_ids"] = json.loads(job["row_ids"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    return job
+
+
+def submit_job(function_name, row_ids, job_store_file=None, db_file=None, table_name=None):
+    """Runs a registered job function on the process pool and returns its job id.
+    Resubmitting a queued, running or finished job returns the existing job instead of starting a new one."""
+    if function_name not in JOB_FUNCTIONS:
+        raise ValueError(f"Unknown job function: {function_name}")
+    job_store_file = job_store_file or default_job_store_file
+    db_file = db.resolve_database_file(db_file)
+    table_name = db.resolve_database_table_name(table_name)
+
+    row_ids = sorted(row_ids)
+    job_id = get_job_id(function_name, row_ids, [db.database_key(db_file), table_name, db.get_change_version(db_file, table_name)])
+    now = time.time()
+    with db.transaction(job_store_file) as conn:
+        row = conn.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is not None and row[0] in ("queued", "running", "done"):
+            return job_id
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, function, row_ids, status, progress, created_at, updated_at) VALUES (?, ?, ?, 'queued', 0, ?, ?)",
+            (job_id, function_name, json.dumps(row_ids), now, now),
+        )
+
+    future = get_job_executor().submit(run_job, job_id, function_name, row_ids, job_store_file, db_file, table_name)
+    with job_lock:
+        job_futures[job_id] = future
+    future.add_done_callback(lambda _: job_futures.pop(job_id, None))
+    return job_id
+
+
+def cancel_job(job_id, job_store_file=None):
+    """Cancels a job. Queued jobs never start; running jobs stop at their next progress report."""
+    job_store_file = job_store_file or default_job_store_file
+    future = job_futures.get(job_id)
+    if future is not None and future.cancel():
+        update_job(job_id, job_store_file, status="cancelled", cancel_requested=1)
+        return
+    with db.transaction(job_store_file) as conn:
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status IN ('queued', 'running')", (job_id,))
+
+
+def run_job(job_id, function_name, row_ids, job_store_file, db_file, table_name):
+    """Executes a job inside a pool worker process and records its outcome in the job store."""
+    def progress(fraction, message=None):
+        with db.transaction(job_store_file, write=False) as conn:
+            cancel_requested = conn.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+        if cancel_requested:
+            raise JobCancelled()
+        update_job(job_id, job_store_file, progress=min(max(fraction, 0.0), 1.0), message=message)
+
+    try:
+        progress(0.0, "Started")
+        update_job(job_id, job_store_file, status="running")
+        result = JOB_FUNCTIONS[function_name](row_ids, progress, db_file, table_name)
+        update_job(job_id, job_store_file, status="done", progress=1.0, message="Finished", result=json.dumps(result, default=str))
+    except JobCancelled:
+        update_job(job_id, job_store_file, status="cancelled", message="Cancelled")
+    except Exception as error:
+        update_job(job_id, job_store_file, status="failed", error=f"{type(error).__name__}: {error}")
+
+
+# Every analysis can be run as a job, under its own name
+for analysis_name in analysis.ANALYSES:
+    register_job_function(analysis_name)(functools.partial(analysis.run_analysis, analysis_name))
@@ -1,7 +1,28 @@
+import os
+import sys
 from dash import html, dcc
 import dash_bootstrap_components as dbc
 import dash_ag_grid as dag
 
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from database import db
+
+DATABASE_REFRESH_INTERVAL_MS = 5000
+DATABASE_MAX_DELTA_ROWS = 1000
+JOB_POLL_INTERVAL_MS = 1000
+
+# Analysis (see analysis.register_analysis) that each Function button runs on the selected rows
+FUNCTION_ANALYSES = {
+    "function-1-button": "summary",
+    "function-2-button": "deviation",
+    "function-3-button": "correlation",
+    "function-4-1-button": "peaks",
+    "function-4-2-button": "trend",
+    "function-4-3-button": "envelope",
+}
+
 
 def serve_column_defs(columns):
     column_sizes = {
@@ -27,13 +48,18 @@ def serve_column_defs(columns):
             "minWidth": column_sizes.get(column, {}).get("minWidth", 100),
             "maxWidth": column_sizes.get(column, {}).get("maxWidth", 500),
             "filter": True,
-            "sortable": False,
+            "sortable": True,
         }
         for idx, column in enumerate(columns)
     ]
     return column_defs
 
 
+def serve_statistics_column_defs():
+    columns = ["id", "channel", "count", "min", "max", "mean", "std", "q05", "q25", "q50", "q75", "q95"]
+    return [{"field": column, "headerTooltip": column, "filter": True, "sortable": True, "minWidth": 80} for column in columns]
+
+
 def serve_dash_grid_options():
     grid_options = {
         "enableSorting": False,
@@ -41,6 +67,8 @@ def serve_dash_grid_options():
         "animateRows": True,
         "pagination": True,
         "paginationPageSize": 50,
+        "cacheBlockSize": 50,
+        "maxBlocksInCache": 20,
         "paginationPageSizeSelector": True,
         "tooltipShowDelay": 100,
         "rowSelection": "multiple",
@@ -49,16 +77,34 @@ def serve_dash_grid_options():
     return grid_options
 
 
+def serve_table_schema():
+    """Returns the schema metadata the page is served with, without reading any rows, or None when no database is
+    configured yet."""
+    try:
+        return db.get_table_schema()
+    except ValueError:
+        return None
+
+
 def serve_layout():
+    """Builds the page for each new session. The grid shell is served with the columns of the current schema, and its
+    rows are fetched by the grid afterwards."""
+    schema = serve_table_schema()
+    columns = schema["columns"] if schema else []
+    # Versions the page was served at, so the first refresh only sends what changed while the grid was loading
+    served = {"schema_version": schema["schema_version"], "version": db.get_change_version()} if schema else None
     layout = [
         dbc.Container([
             dbc.Row([
                 html.H2("Database"),
             ]),
             dbc.Row([
-                dag.AgGrid(id="database-table", rowData=None, columnDefs=serve_column_defs([]), dashGridOptions=serve_dash_grid_options()),
+                dag.AgGrid(id="database-table", rowModelType="infinite", getRowId="params.data.id", columnDefs=serve_column_defs(columns), dashGridOptions=serve_dash_grid_options()),
             ]),
-            dcc.Store(id="database-store", data=[], storage_type="session"),
+            dcc.Store(id="database-store", data={}, storage_type="session"),
+            dcc.Store(id="database-served", data=served),
+            dcc.Store(id="database-delta", data=None),
+            dcc.Interval(id="database-refresh-interval", interval=DATABASE_REFRESH_INTERVAL_MS),
             dbc.Row([
                 html.Div(id="dummy-div", style={"display":"none"}), # Dummy div to create callbacks with no outputs
                 dbc.Button("Function 1", id="function-1-button", color="primary", n_clicks=0),
@@ -72,7 +118,26 @@ def serve_layout():
                         dbc.DropdownMenuItem("Function 4.3", id="function-4-3-button", n_clicks=0),
                     ],
                 ),
-            ])
+            ]),
+            dbc.Row([
+                dbc.Progress(id="job-progress", value=0, label=""),
+                html.Div(id="job-status"),
+                dbc.Button("Cancel", id="job-cancel-button", color="secondary", n_clicks=0),
+                html.Pre(id="job-result"),
+                dcc.Store(id="job-store", data=None),
+                dcc.Interval(id="job-interval", interval=JOB_POLL_INTERVAL_MS, disabled=True),
+            ]),
+            dbc.Row([
+                html.H2("Statistics"),
+                dbc.Button("Statistics of selected", id="statistics-button", color="primary", n_clicks=0),
+                dag.AgGrid(id="statistics-table", rowData=[], columnDefs=serve_statistics_column_defs(), dashGridOptions={"pagination": True, "paginationPageSize": 20}),
+            ]),
+            dbc.Row([
+                html.H2("Plot"),
+                dbc.Button("Plot selected", id="plot-button", color="primary", n_clicks=0),
+                dcc.Graph(id="plot-graph"),
+                dcc.Store(id="plot-store", data=None),
+            ]),
         ]),
     ]
     return layout
\ No newline at end of file
@@ -0,0 +1,157 @@
+import os
+import sys
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from utils import lazy
+from storage import datafiles, chunked
+
+np = lazy.lazy_import("numpy")
+go = lazy.lazy_import("plotly.graph_objects")
+
+# Upper bound on the points sent to the browser per trace, roughly two points per horizontal pixel
+MAX_POINTS_PER_TRACE = 4000
+MAX_PLOTTED_EXPERIMENTS = 10
+# Full resolution experiments kept in memory for zooming, bounded by the size of their arrays
+DATA_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+class DataCache:
+    """LRU cache of loaded experiments bounded by the bytes of their arrays. Experiments larger than the bound are
+    not cached."""
+
+    def __init__(self, max_bytes=DATA_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, data):
+        size = sum(getattr(values, "nbytes", 0) for values in data.values())
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (data, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+data_cache = DataCache()
+
+
+def load_cached_data(path, modified_time):
+    key = (path, modified_time)
+    data = data_cache.get(key)
+    if data is None:
+        data = datafiles.load_experiment_data(path)
+        data_cache.set(key, data)
+    return data
+
+
+@lru_cache(maxsize=64)
+def open_chunked(path, modified_time):
+    return chunked.ChunkedReader(path)
+
+
+def load_series(datapath, x_range=None):
+    """Returns (x, {channel: y}) for an experiment, using its time column as x when it has one.
+    With x_range, chunked files with a sorted time column only map the rows in x_range plus one beyond each edge."""
+    path = datafiles.resolve_datapath(datapath)
+    if x_range is not None and chunked.is_chunked(path):
+        reader = open_chunked(path, os.path.getmtime(path))
+        x_name = datafiles.find_time_column(reader.columns)
+        if x_name is not None and reader.is_sorted(x_name):
+            start, stop = reader.row_slice(x_name, *x_range)
+            return datafiles.split_time_column(reader.read(rows=slice(max(start - 1, 0), stop + 1)))
+    return datafiles.split_time_column(load_cached_data(path, os.path.getmtime(path)))
+
+
+def window(x, y, x_range):
+    """Restricts a series to x_range, keeping one point beyond each edge so lines run to the plot border."""
+    if x_range is None:
+        return x, y
+    if len(x) > 1 and np.all(x[1:] >= x[:-1]):
+        start = max(np.searchsorted(x, x_range[0], side="left") - 1, 0)
+        stop = min(np.searchsorted(x, x_range[1], side="right") + 1, len(x))
+        return x[start:stop], y[start:stop]
+    mask = (x >= x_range[0]) & (x <= x_range[1])
+    return x[mask], y[mask]
+
+
+def decimate_minmax(x, y, max_points):
+    """Keeps the minimum and maximum of max_points / 2 equal buckets, which preserves peaks and the signal envelope."""
+    length = len(y)
+    if length <= max_points:
+        return x, y
+
+    bucket_count = max(max_points // 2, 1)
+    bucket_size = int(np.ceil(length / bucket_count))
+    buckets = np.pad(y, (0, bucket_count * bucket_size - length), constant_values=np.nan).reshape(bucket_count, bucket_size)
+    missing = np.isnan(buckets)
+    low = np.where(missing, np.inf, buckets).argmin(axis=1)
+    high = np.where(missing, -np.inf, buckets).argmax(axis=1)
+
+    offsets = np.arange(bucket_count) * bucket_size
+    indices = (np.sort(np.stack([low, high], axis=1), axis=1) + offsets[:, None]).ravel()
+    indices = np.unique(np.minimum(indices, length - 1))
+    return x[indices], y[indices]
+
+
+def decimate(x, y, max_points=None):
+    return decimate_minmax(x, y, max_points or MAX_POINTS_PER_TRACE)
+
+
+def relayout_x_range(relayout_data):
+    """Returns the x range of a plotly relayout event, "auto" when the axis was reset, or None if x didn't change."""
+    if not relayout_data:
+        return None
+    if relayout_data.get("xaxis.autorange"):
+        return "auto"
+    if "xaxis.range[0]" in relayout_data and "xaxis.range[1]" in relayout_data:
+        return [float(relayout_data["xaxis.range[0]"]), float(relayout_data["xaxis.range[1]"])]
+    if "xaxis.range" in relayout_data:
+        return [float(value) for value in relayout_data["xaxis.range"]]
+    return None
+
+
+def build_figure(experiments, x_range=None, max_points=None):
+    """Builds a figure of every channel of the given (label, datapath) experiments.
+    Each trace is cut to x_range and decimated server-side, so no trace holds more than max_points points."""
+    figure = go.Figure()
+    failed = []
+    for label, datapath in experiments[:MAX_PLOTTED_EXPERIMENTS]:
+        try:
+            x, channels = load_series(datapath, x_range)
+        except (OSError, ValueError):
+            failed.append(label)
+            continue
+        for channel, y in channels.items():
+            trace_x, trace_y = decimate(*window(x, y, x_range), max_points=max_points)
+            figure.add_trace(go.Scattergl(x=trace_x, y=trace_y, mode="lines", name=f"{label}: {channel}"))
+
+    figure.update_layout(uirevision="plot", margin={"l": 40, "r": 10, "t": 40, "b": 40})
+    if x_range is not None:
+        figure.update_xaxes(range=x_range)
+    if failed:
+        figure.update_layout(title=f"Could not load: {', '.join(failed)}")
+    return figure
@@ -0,0 +1,153 @@
+import os
+import sys
+import io
+import csv
+import json
+import sqlite3
+import itertools
+from flask import Response, abort, jsonify, request, stream_with_context
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from utils import lazy
+from database import db
+from callbacks import callbacks
+from metrics import metrics
+
+pa = lazy.lazy_import("pyarrow")
+pq = lazy.lazy_import("pyarrow.parquet")
+
+EXPORT_CHUNK_SIZE = 10000
+
+EXPORT_MIMETYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class StreamSink:
+    """Write-only file object that hands written bytes to the response stream as they are produced."""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer.write(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+def stream_csv(chunks, schema):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    header_written = False
+    for column_names, rows in chunks:
+        if not header_written:
+            writer.writerow(column_names)
+            header_written = True
+        writer.writerows(rows)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    # An empty result still gets its header
+    if not header_written:
+        writer.writerow(schema.names)
+        yield output.getvalue()
+
+
+def stream_ndjson(chunks):
+    for column_names, rows in chunks:
+        yield "".join(json.dumps(dict(zip(column_names, row)), default=str) + "\n" for row in rows)
+
+
+def stream_parquet(chunks, schema):
+    sink = StreamSink()
+    writer = None
+    for column_names, rows in chunks:
+        if writer is None:
+            # Untyped columns take the type of the first chunk
+            schema = db.infer_arrow_schema(schema, rows)
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(db.rows_to_arrow(column_names, rows, schema))
+        yield sink.drain()
+    if writer is None:
+        writer = pq.ParquetWriter(sink, db.infer_arrow_schema(schema, []))
+    writer.close()
+    yield sink.drain()
+
+
+def register_routes(app):
+    server = app.server
+
+    @server.route("/export/<export_format>")
+    def export_table(export_format):
+        """Streams the (optionally filtered, sorted and projected) database table as CSV, NDJSON or Parquet.
+        Query parameters: columns (comma separated), filter (AgGrid filterModel JSON), sort (AgGrid sortModel JSON)."""
+        if export_format not in EXPORT_MIMETYPES:
+            abort(404)
+
+        try:
+            columns = [column for column in request.args.get("columns", "").split(",") if column] or None
+            filters = callbacks.grid_filter_to_filters(json.loads(request.args.get("filter", "{}")))
+            sort_model = callbacks.grid_sort_to_sort(json.loads(request.args.get("sort", "[]")))
+            schema = db.get_arrow_schema(columns)
+            # The rows are read lazily, so the first chunk is read before responding to report a bad filter or sort
+            # as a 400 instead of failing the stream after the headers went out
+            chunks = db.iter_table_rows(EXPORT_CHUNK_SIZE, columns=columns, filters=filters, sort_model=sort_model)
+            first_chunk = next(chunks, None)
+        except (ValueError, KeyError, TypeError, AttributeError, sqlite3.Error):
+            abort(400)
+
+        chunks = itertools.chain([first_chunk] if first_chunk is not None else [], chunks)
+        if export_format == "csv":
+            body = stream_csv(chunks, schema)
+        elif export_format == "ndjson":
+            body = stream_ndjson(chunks)
+        else:
+            body = stream_parquet(chunks, schema)
+
+        headers = {"Content-Disposition": f"attachment; filename={db.default_database_table_name}.{export_format}"}
+        return Response(stream_with_context(body), mimetype=EXPORT_MIMETYPES[export_format], headers=headers)
+
+    @server.route("/mutations", methods=["POST"])
+    def apply_mutations():
+        """Applies a batch of grid edits and deletes in one transaction. Body: {"mutations": [...], "version": change
+        version the rows were read at}, see db.apply_mutations. Responds 409 with the conflicting ids when rows changed
+        since that version, and 400 with the message when a value violates a constraint."""
+        body = request.get_json(silent=True) or {}
+        try:
+            result = db.apply_mutations(body.get("mutations", []), expected_version=body.get("version"))
+        except db.ConflictError as error:
+            return jsonify({"conflicts": error.row_ids, "version": db.get_change_version()}), 409
+        except sqlite3.IntegrityError as error:
+            # e.g. clearing a NOT NULL column, nothing of the batch is applied
+            return jsonify({"error": str(error)}), 400
+        except (ValueError, KeyError, TypeError, AttributeError):
+            abort(400)
+        return jsonify(result)
+
+    @server.route("/metrics")
+    def export_metrics():
+        """Serves the database, callback and request metrics in the Prometheus text format."""
+        return Response(metrics.render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    pass
@@ -0,0 +1,82 @@
+import os
+import sys
+import hashlib
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from database import db
+from storage import chunked
+
+HASH_ALGORITHM = "sha256"
+HASH_CHUNK_SIZE = 1024 * 1024
+BLOB_EXTENSION = chunked.CHUNKED_EXTENSION
+# Shared by MINER, which stores experiments here, and SPEED, which collects them once their rows are deleted
+BLOB_ROOT = os.path.join(os.path.abspath(AMAIAS_DIRECTORY), "experiments")
+
+blob_root:str = BLOB_ROOT
+
+
+def set_blob_root(directory):
+    global blob_root
+    blob_root = os.path.abspath(directory)
+
+
+def new_hash():
+    """Returns a hash object to feed an incoming stream into chunk by chunk."""
+    return hashlib.new(HASH_ALGORITHM)
+
+
+def hash_file(path):
+    """Returns the hex digest of a file's content, read in chunks so memory stays constant."""
+    digest = new_hash()
+    with open(path, "rb") as fin:
+        for chunk in iter(lambda: fin.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_path(digest, extension=BLOB_EXTENSION):
+    """Returns where the content with the given digest is stored, fanned out over two directory levels so no single
+    directory grows too large."""
+    return os.path.join(blob_root, digest[:2], digest[2:4], digest + extension)
+
+
+def find_blob(digest, extension=BLOB_EXTENSION):
+    """Returns the path of the stored blob of a digest, or None when that content hasn't been stored yet."""
+    path = blob_path(digest, extension)
+    return path if os.path.exists(path) else None
+
+
+def is_blob_path(path):
+    """Returns whether a datapath points into the blob store. Only those files are ever garbage collected."""
+    if blob_root is None or not path:
+        return False
+    path = os.path.abspath(path)
+    return os.path.commonpath([blob_root, path]) == blob_root
+
+
+def collect_garbage(datapaths, db_file=None, table_name=None):
+    """Removes the blobs among datapaths that no row references anymore and returns their paths. References are
+    counted and blobs removed under the database write lock, which MINER also holds while it registers rows that
+    reference stored blobs."""
+    datapaths = [datapath for datapath in datapaths if is_blob_path(datapath)]
+    if not datapaths:
+        return []
+
+    removed = []
+    with db.transaction(db_file):
+        for datapath, references in db.count_datapath_references(datapaths, db_file, table_name).items():
+            if references == 0 and os.path.exists(datapath):
+                os.remove(datapath)
+                removed.append(datapath)
+    return removed
+
+
+def collect_deleted_rows(db_file, table_name, deleted_rows):
+    collect_garbage([row.get("datapath") for row in deleted_rows], db_file, table_name)
+
+
+def enable_garbage_collection():
+    """Collects the blobs of deleted rows once db.delete_row has removed them."""
+    db.register_delete_callback(collect_deleted_rows)
@@ -0,0 +1,260 @@
+import os
+import mmap
+import json
+import struct
+import warnings
+
+from utils import lazy
+from storage import codecs
+
+np = lazy.lazy_import("numpy")
+
+# File layout: MAGIC, format version, header length, JSON header, then every column as one contiguous array starting
+# at an ALIGNMENT boundary. Columns are split into chunks of chunk_rows rows, and the header holds the min and max of
+# every chunk (its zone map) so reads can skip chunks that can't hold matching values. Columns written with
+# compression are instead stored chunk by chunk in the encoding storage/codecs.py picked for them (version 2), and
+# only the chunks a read spans are decoded.
+CHUNKED_EXTENSION = ".chunks"
+MAGIC = b"SPEEDCHK"
+FORMAT_VERSION = 2
+READABLE_VERSIONS = (1, 2)
+PREAMBLE = struct.Struct("<8sIQ")
+ALIGNMENT = 64
+CHUNK_ROWS = 65536
+
+# Column kinds stored as raw arrays. Zone maps are kept for every kind but text.
+STORED_KINDS = "biufMmSU"
+TEXT_KINDS = "SU"
+
+
+def aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def zone_value(value):
+    """Converts a chunk minimum or maximum to JSON, NaN (a chunk without values) becoming None."""
+    value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def comparable(array):
+    """Returns the array as values that zone maps and predicates compare, i.e. integers for dates and durations."""
+    return array.view(np.int64) if array.dtype.kind in "Mm" else array
+
+
+def build_zone_map(array, chunk_rows):
+    """Returns the (mins, maxs) of every chunk of a column, ignoring NaN."""
+    values = comparable(array)
+    mins, maxs = [], []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for start in range(0, len(values), chunk_rows):
+            chunk = values[start:start + chunk_rows]
+            mins.append(zone_value(np.nanmin(chunk) if chunk.dtype.kind == "f" else chunk.min()))
+            maxs.append(zone_value(np.nanmax(chunk) if chunk.dtype.kind == "f" else chunk.max()))
+    return mins, maxs
+
+
+def write_chunked(path, data, chunk_rows=CHUNK_ROWS, compression=None):
+    """Writes {column: 1-D array} experiment data in the chunked format. Object columns are stored as fixed-width text.
+    With compression="auto", codecs.choose_encoding picks the encoding of every column from a sample of it, and the
+    encoding, compression ratio and encode/decode throughput of each column are recorded in the header."""
+    arrays = {}
+    for name, values in data.items():
+        array = np.asarray(values)
+        if array.dtype.kind not in STORED_KINDS:
+            array = array.astype(str)
+        arrays[str(name)] = np.ascontiguousarray(array)
+    num_rows = len(next(iter(arrays.values()))) if arrays else 0
+    if any(len(array) != num_rows for array in arrays.values()):
+        raise ValueError("All columns of an experiment must have the same length")
+
+    # (offset, bytes) of everything in the data section
+    columns, parts, offset = [], [], 0
+    for name, array in arrays.items():
+        column = {"name": name, "dtype": array.dtype.str, "offset": offset}
+        if array.dtype.kind not in TEXT_KINDS:
+            column["min"], column["max"] = build_zone_map(array, chunk_rows)
+            values = comparable(array)
+            column["sorted"] = bool(np.all(values[1:] >= values[:-1])) and None not in column["min"]
+
+        encoding = dictionary = None
+        if compression == "auto":
+            encoding, dictionary, column["compression"] = codecs.choose_encoding(array)
+        if encoding is None:
+            parts.append((offset, array.view(np.uint8).data))
+            offset += array.nbytes
+        else:
+            if dictionary is not None:
+                column["dictionary"] = {"offset": offset, "count": len(dictionary)}
+                parts.append((offset, dictionary.view(np.uint8).data))
+                offset += dictionary.nbytes
+            column["encoding"], column["chunks"] = encoding, []
+            for start in range(0, num_rows, chunk_rows):
+                encoded = codecs.encode_chunk(array[start:start + chunk_rows], encoding, dictionary)
+                column["chunks"].append([offset, len(encoded)])
+                parts.append((offset, encoded))
+                offset += len(encoded)
+            # The ratio is that of the whole column, the throughputs were measured on the sample
+            column["compression"]["ratio"] = array.nbytes / max(offset - column["offset"], 1)
+        columns.append(column)
+        offset = aligned(offset)
+
+    # Column offsets are relative to the data section, which starts after the header at an aligned position
+    header = json.dumps({"num_rows": num_rows, "chunk_rows": chunk_rows, "columns": columns}).encode()
+    data_start = aligned(PREAMBLE.size + len(header))
+    with open(path, "wb") as fout:
+        fout.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        fout.write(header)
+        for part_offset, part in parts:
+            fout.seek(data_start + part_offset)
+            fout.write(part)
+        fout.truncate(data_start + offset)
+
+
+class ChunkedReader:
+    """Memory-mapped reader of a chunked experiment file. Columns are returned as zero-copy NumPy views of the
+    mapping, so only the pages a caller touches are ever read from disk."""
+
+    def __init__(self, path):
+        with open(path, "rb") as fin:
+            magic, version, header_length = PREAMBLE.unpack(fin.read(PREAMBLE.size))
+            if magic != MAGIC or version not in READABLE_VERSIONS:
+                raise ValueError(f"Not a chunked experiment file: {path}")
+            header = json.loads(fin.read(header_length))
+            self.buffer = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.path = path
+        self.num_rows = header["num_rows"]
+        self.chunk_rows = header["chunk_rows"]
+        self.data_start = aligned(PREAMBLE.size + header_length)
+        self.column_info = {column["name"]: column for column in header["columns"]}
+        self.columns = list(self.column_info)
+        self.dictionaries = {}
+
+    def is_encoded(self, name):
+        return "encoding" in self.column_info[name]
+
+    def dictionary(self, name):
+        info = self.column_info[name]
+        if "dictionary" not in info:
+            return None
+        if name not in self.dictionaries:
+            dictionary = info["dictionary"]
+            self.dictionaries[name] = np.frombuffer(self.buffer, dtype=np.dtype(info["dtype"]), count=dictionary["count"], offset=self.data_start + dictionary["offset"])
+        return self.dictionaries[name]
+
+    def column(self, name):
+        """Returns a whole column, as a view of the mapping when it is stored plain and decoded otherwise."""
+        info = self.column_info[name]
+        if self.is_encoded(name):
+            return self.rows(name, 0, self.num_rows)
+        return np.frombuffer(self.buffer, dtype=np.dtype(info["dtype"]), count=self.num_rows, offset=self.data_start + info["offset"])
+
+    def chunk(self, name, index):
+        """Returns the values of one chunk of a column."""
+        start = index * self.chunk_rows
+        if not self.is_encoded(name):
+            return self.column(name)[start:start + self.chunk_rows]
+        info = self.column_info[name]
+        offset, length = info["chunks"][index]
+        position = self.data_start + offset
+        rows = min(self.chunk_rows, self.num_rows - start)
+        return codecs.decode_chunk(memoryview(self.buffer)[position:position + length], info["encoding"], info["dtype"], rows, self.dictionary(name))
+
+    def rows(self, name, start, stop):
+        """Returns the values of rows [start, stop) of a column, decoding only the chunks they span."""
+        if not self.is_encoded(name):
+            return self.column(name)[start:stop]
+        stop = min(stop, self.num_rows)
+        if stop <= start:
+            return np.empty(0, dtype=np.dtype(self.column_info[name]["dtype"]))
+        first, last = start // self.chunk_rows, (stop - 1) // self.chunk_rows
+        values = self.chunk(name, first) if first == last else np.concatenate([self.chunk(name, index) for index in range(first, last + 1)])
+        offset = first * self.chunk_rows
+        return values[start - offset:stop - offset]
+
+    def compression_report(self):
+        """Returns {column: {"encoding", "ratio", "encode_mbps", "decode_mbps"}} as recorded when the file was written."""
+        plain = {"encoding": "plain", "ratio": 1.0, "encode_mbps": None, "decode_mbps": None}
+        return {name: info.get("compression", plain) for name, info in self.column_info.items()}
+
+    def is_sorted(self, name):
+        return self.column_info[name].get("sorted", False)
+
+    def zone_map(self, name):
+        """Returns the (mins, maxs) of every chunk of a column, or None for text columns."""
+        info = self.column_info[name]
+        return (info["min"], info["max"]) if "min" in info else None
+
+    def candidate_ranges(self, name, low=None, high=None):
+        """Returns the merged (start, stop) row ranges of the chunks whose zone map overlaps [low, high]."""
+        zone_map = self.zone_map(name)
+        if zone_map is None:
+            return [(0, self.num_rows)] if self.num_rows else []
+        ranges = []
+        for chunk, (chunk_min, chunk_max) in enumerate(zip(*zone_map)):
+            if chunk_min is None or (low is not None and chunk_max < low) or (high is not None and chunk_min > high):
+                continue
+            start, stop = chunk * self.chunk_rows, min((chunk + 1) * self.chunk_rows, self.num_rows)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], stop)
+            else:
+                ranges.append((start, stop))
+        return ranges
+
+    def row_slice(self, name, low=None, high=None):
+        """Returns the (start, stop) rows of a sorted column holding values in [low, high]. The zone map picks the
+        chunk of each bound, so the binary searches only touch (and decode) those two chunks."""
+        if not self.is_sorted(name):
+            raise ValueError(f"Column {name} is not sorted")
+        mins, maxs = self.zone_map(name)
+
+        start = 0
+        if low is not None:
+            chunk = int(np.searchsorted(maxs, low, side="left"))
+            start = chunk * self.chunk_rows
+            if chunk < len(maxs):
+                start += int(np.searchsorted(comparable(self.chunk(name, chunk)), low, side="left"))
+        stop = self.num_rows
+        if high is not None:
+            chunk = int(np.searchsorted(mins, high, side="right")) - 1
+            stop = 0 if chunk < 0 else chunk * self.chunk_rows + int(np.searchsorted(comparable(self.chunk(name, chunk)), high, side="right"))
+        start = min(start, self.num_rows)
+        return start, max(stop, start)
+
+    def read(self, columns=None, where=None, rows=None):
+        """Returns {column: values} for the given columns (all by default), restricted to a slice of rows or to the rows
+        where a predicate (column, low, high) holds, low and high being inclusive and optional. Sorted predicate columns
+        and row slices yield zero-copy views of plain columns, other predicates gather and filter only the chunks their
+        zone map allows. Encoded columns only decode the chunks that are read."""
+        columns = [column for column in (columns or self.columns) if column in self.column_info]
+        if where is None:
+            start, stop, step = (rows or slice(None)).indices(self.num_rows)
+            return {column: self.rows(column, start, max(stop, start))[::step] for column in columns}
+
+        name, low, high = where
+        if self.is_sorted(name):
+            start, stop = self.row_slice(name, low, high)
+            return {column: self.rows(column, start, stop) for column in columns}
+
+        ranges = self.candidate_ranges(name, low, high)
+        gathered = comparable(self.gather(name, ranges))
+        mask = np.ones(len(gathered), dtype=bool)
+        if low is not None:
+            mask &= gathered >= low
+        if high is not None:
+            mask &= gathered <= high
+        return {column: self.gather(column, ranges)[mask] for column in columns}
+
+    def gather(self, name, ranges):
+        """Returns the values of a column in the given (start, stop) row ranges, concatenated."""
+        if not ranges:
+            return self.rows(name, 0, 0)
+        return np.concatenate([self.rows(name, start, stop) for start, stop in ranges])
+
+
+def is_chunked(path):
+    return os.path.splitext(path)[1].lower() == CHUNKED_EXTENSION
@@ -0,0 +1,259 @@
+import os
+import sys
+import time
+import argparse
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from utils import lazy
+
+np = lazy.lazy_import("numpy")
+pa = lazy.lazy_import("pyarrow")
+
+# A column encoding is {"transform", "shuffle", "codec", "level"}, applied to each chunk in that order:
+#   transform: None, "delta" (differences of consecutive integers, dates and durations, wrapping so it is lossless)
+#              or "dictionary" (indexes into the column's sorted distinct values)
+#   shuffle:   byte-transposes the values so the n-th bytes of all values are adjacent, which exposes the slowly
+#              changing high bytes of floats and deltas to the codec
+#   codec:     None, "lz4" or "zstd" (through pyarrow) at the given level
+# Columns without an encoding are stored plain.
+
+# Codec used to compare transforms, then the codecs and levels tried on the best transform, fastest first. Higher zstd
+# levels encode at a few tens of MB/s, too close to MIN_ENCODE_THROUGHPUT for the choice to be reproducible.
+TRANSFORM_CODEC = ("zstd", 1)
+CODEC_LEVELS = [(None, None), ("lz4", None), ("zstd", 1), ("zstd", 3)]
+# A slower codec or level is only picked when it shrinks the column by this fraction more than the faster one
+MIN_LEVEL_GAIN = 0.05
+
+# Rows sampled per column, as SAMPLE_BLOCKS evenly spaced contiguous blocks so deltas stay representative
+SAMPLE_ROWS = 16384
+SAMPLE_BLOCKS = 4
+
+# Sanity check against pathologically slow encodings: encodings whose best of TIMING_RUNS timings decodes slower than
+# this (bytes of decoded values per second) are never picked, so SPEED's reads stay fast, and encodings encoding slower
+# than this aren't either, so ingestion keeps up. Both are far below what the codecs reach, so the choice of encoding
+# only depends on compressed sizes and is reproducible regardless of machine load.
+MIN_DECODE_THROUGHPUT = 100e6
+MIN_ENCODE_THROUGHPUT = 10e6
+TIMING_RUNS = 3
+# Columns that don't shrink by at least this factor are stored plain, which SPEED memory-maps without decoding
+MIN_RATIO = 1.2
+# Dictionary encoding is tried when the sample has at most this many distinct values
+DICTIONARY_MAX_VALUES = 4096
+
+
+def describe(encoding):
+    """Returns a short label of an encoding, e.g. "delta+shuffle/zstd-3"."""
+    if encoding is None:
+        return "plain"
+    steps = [step for step in (encoding["transform"], "shuffle" if encoding["shuffle"] else None) if step]
+    codec = f"{encoding['codec']}-{encoding['level']}" if encoding["level"] is not None else encoding["codec"]
+    return "+".join(steps or ["plain"]) + (f"/{codec}" if codec else "")
+
+
+def integer_view(values):
+    """Returns dates and durations as integers, the representation delta encoding works on."""
+    return values.view(np.int64) if values.dtype.kind in "Mm" else values
+
+
+def build_dictionary(values):
+    """Returns the sorted distinct values of a column, or None when there are too many to index with 16 bits or when
+    looking them up doesn't give back the column bit for bit. np.unique merges 0.0 and -0.0 and NaNs with different
+    payloads, which the sample measure() checks may not contain, so the whole column is checked here."""
+    dictionary = np.unique(values)
+    if len(dictionary) > 65536:
+        return None
+    values = np.ascontiguousarray(values)
+    decoded = dictionary[np.searchsorted(dictionary, values)]
+    return dictionary if np.array_equal(decoded.view(np.uint8), values.view(np.uint8)) else None
+
+
+def code_dtype(dictionary):
+    return np.uint8 if len(dictionary) <= 256 else np.uint16
+
+
+def shuffle(data, itemsize):
+    if itemsize <= 1:
+        return data
+    return np.ascontiguousarray(data.reshape(-1, itemsize).T).reshape(-1)
+
+
+def unshuffle(data, itemsize):
+    if itemsize <= 1:
+        return data
+    return np.ascontiguousarray(data.reshape(itemsize, -1).T).reshape(-1)
+
+
+def encode_chunk(values, encoding, dictionary=None):
+    """Encodes a chunk of a column and returns the encoded bytes."""
+    if encoding["transform"] == "delta":
+        values = integer_view(values)
+        values = np.concatenate((values[:1], values[1:] - values[:-1]))
+    elif encoding["transform"] == "dictionary":
+        values = np.searchsorted(dictionary, values).astype(code_dtype(dictionary))
+    data = np.ascontiguousarray(values).view(np.uint8).reshape(-1)
+    if encoding["shuffle"]:
+        data = shuffle(data, values.dtype.itemsize)
+    if encoding["codec"] is None:
+        return data.tobytes()
+    return pa.Codec(encoding["codec"], encoding["level"]).compress(data, asbytes=True)
+
+
+def decode_chunk(buffer, encoding, dtype, rows, dictionary=None):
+    """Decodes a chunk encoded by encode_chunk back into rows values of dtype."""
+    dtype = np.dtype(dtype)
+    if encoding["transform"] == "dictionary":
+        stored_dtype = np.dtype(code_dtype(dictionary))
+    elif encoding["transform"] == "delta" and dtype.kind in "Mm":
+        stored_dtype = np.dtype(np.int64)
+    else:
+        stored_dtype = dtype
+
+    size = rows * stored_dtype.itemsize
+    if encoding["codec"] is not None:
+        buffer = pa.Codec(encoding["codec"], encoding["level"]).decompress(buffer, decompressed_size=size)
+    data = np.frombuffer(buffer, dtype=np.uint8, count=size)
+    if encoding["shuffle"]:
+        data = unshuffle(data, stored_dtype.itemsize)
+    values = data.view(stored_dtype)
+
+    if encoding["transform"] == "delta":
+        return np.cumsum(values, dtype=stored_dtype).view(dtype)
+    if encoding["transform"] == "dictionary":
+        return dictionary[values]
+    return values
+
+
+def sample_column(array, sample_rows=SAMPLE_ROWS):
+    if len(array) <= sample_rows:
+        return array
+    block_rows = sample_rows // SAMPLE_BLOCKS
+    starts = np.linspace(0, len(array) - block_rows, SAMPLE_BLOCKS).astype(int)
+    return np.concatenate([array[start:start + block_rows] for start in starts])
+
+
+def candidate_transforms(array, sample):
+    """Returns the (transform, shuffle) pairs that apply to a column's dtype."""
+    kind, itemsize = array.dtype.kind, array.dtype.itemsize
+    candidates = [(None, False)]
+    if kind in "fiumM" and itemsize > 1:
+        candidates.append((None, True))
+    if kind in "iumM":
+        candidates.append(("delta", False))
+        if itemsize > 1:
+            candidates.append(("delta", True))
+    if kind != "b" and len(np.unique(sample)) <= DICTIONARY_MAX_VALUES:
+        candidates.append(("dictionary", False))
+    return candidates
+
+
+def measure(sample, encoding, dictionary):
+    """Returns the encoded size of a sample, or None when the decoded values differ bit for bit, e.g. a dictionary
+    merging 0.0 and -0.0."""
+    encoded = encode_chunk(sample, encoding, dictionary)
+    decoded = decode_chunk(encoded, encoding, sample.dtype, len(sample), dictionary)
+    if not np.array_equal(np.ascontiguousarray(decoded).view(np.uint8), sample.view(np.uint8)):
+        return None
+    return len(encoded)
+
+
+def time_encoding(sample, encoding, dictionary, runs=TIMING_RUNS):
+    """Returns the best (encode seconds, decode seconds) of several encodes and decodes of a sample."""
+    encode_seconds, decode_seconds = float("inf"), float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        encoded = encode_chunk(sample, encoding, dictionary)
+        encoded_at = time.perf_counter()
+        decode_chunk(encoded, encoding, sample.dtype, len(sample), dictionary)
+        decoded_at = time.perf_counter()
+        encode_seconds = min(encode_seconds, encoded_at - started)
+        decode_seconds = min(decode_seconds, decoded_at - encoded_at)
+    return encode_seconds, decode_seconds
+
+
+def pick_codec(candidates):
+    """Returns the (size, encoding) of the fastest codec and level that no slower one shrinks by MIN_LEVEL_GAIN more,
+    from candidates ordered fastest first."""
+    best = None
+    for size, encoding in candidates:
+        if best is None or size < best[0] * (1 - MIN_LEVEL_GAIN):
+            best = (size, encoding)
+    return best
+
+
+def choose_encoding(array, sample_rows=SAMPLE_ROWS):
+    """Picks the encoding of a column from compressed sizes of a sample of it: the transform that compresses the sample
+    best, then the fastest codec and level that no slower one beats by MIN_LEVEL_GAIN. An encoding failing the
+    throughput sanity check is replaced by the next pick without it. Returns
+    (encoding or None for plain, dictionary or None, {"encoding", "ratio", "encode_mbps", "decode_mbps"} measured on
+    the sample)."""
+    sample = np.ascontiguousarray(sample_column(array, sample_rows))
+    raw_bytes = sample.nbytes
+    report = {"encoding": "plain", "ratio": 1.0, "encode_mbps": None, "decode_mbps": None}
+    if raw_bytes == 0 or array.dtype.kind not in "biufMmSU":
+        return None, None, report
+
+    dictionary = None
+    best_transform = None
+    for transform, shuffled in candidate_transforms(array, sample):
+        if transform == "dictionary":
+            dictionary = build_dictionary(array)
+            if dictionary is None:
+                continue
+        codec, level = TRANSFORM_CODEC
+        encoding = {"transform": transform, "shuffle": shuffled, "codec": codec, "level": level}
+        size = measure(sample, encoding, dictionary)
+        if size is not None and (best_transform is None or size < best_transform[0]):
+            best_transform = (size, transform, shuffled)
+    _, transform, shuffled = best_transform
+    if transform != "dictionary":
+        dictionary = None
+
+    candidates = []
+    for codec, level in CODEC_LEVELS:
+        encoding = {"transform": transform, "shuffle": shuffled, "codec": codec, "level": level}
+        size = measure(sample, encoding, dictionary)
+        if size is not None:
+            candidates.append((size, encoding))
+
+    while candidates:
+        size, encoding = pick_codec(candidates)
+        if raw_bytes / size < MIN_RATIO:
+            break
+        encode_seconds, decode_seconds = time_encoding(sample, encoding, dictionary)
+        encode_throughput = raw_bytes / max(encode_seconds, 1e-9)
+        decode_throughput = raw_bytes / max(decode_seconds, 1e-9)
+        if encode_throughput >= MIN_ENCODE_THROUGHPUT and decode_throughput >= MIN_DECODE_THROUGHPUT:
+            report = {
+                "encoding": describe(encoding),
+                "ratio": raw_bytes / size,
+                "encode_mbps": encode_throughput / 1e6,
+                "decode_mbps": decode_throughput / 1e6,
+            }
+            return encoding, dictionary, report
+        candidates = [candidate for candidate in candidates if candidate[1] is not encoding]
+    return None, None, report
+
+
+def format_report(report):
+    """Formats {column: compression report} as a table, as recorded by the chunked format."""
+    lines = [f"{'column':24} {'encoding':28} {'ratio':>8} {'encode MB/s':>12} {'decode MB/s':>12}"]
+    for column, entry in report.items():
+        encode = f"{entry['encode_mbps']:.0f}" if entry.get("encode_mbps") else "-"
+        decode = f"{entry['decode_mbps']:.0f}" if entry.get("decode_mbps") else "-"
+        lines.append(f"{column:24} {entry['encoding']:28} {entry['ratio']:8.2f} {encode:>12} {decode:>12}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from storage import chunked
+
+    parser = argparse.ArgumentParser(description="Reports the per-column encodings recorded in chunked experiment files.")
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        reader = chunked.ChunkedReader(path)
+        print(f"{path}: {reader.num_rows} rows, {os.path.getsize(path)} bytes")
+        print(format_report(reader.compression_report()))
@@ -0,0 +1,92 @@
+import os
+
+from utils import lazy
+from storage import chunked
+
+np = lazy.lazy_import("numpy")
+pd = lazy.lazy_import("pandas")
+pq = lazy.lazy_import("pyarrow.parquet")
+feather = lazy.lazy_import("pyarrow.feather")
+
+data_root:str = None
+
+# Channels with one of these (case-insensitive) names are used as the x axis of an experiment
+TIME_COLUMNS = ("time", "t", "timestamp", "x")
+
+
+def set_data_root(directory):
+    global data_root
+    data_root = directory
+
+
+def resolve_datapath(datapath):
+    """Returns the absolute path of an experiment's datapath, relative paths being resolved against the data root."""
+    if os.path.isabs(datapath) or data_root is None:
+        return os.path.abspath(datapath)
+    return os.path.join(data_root, datapath)
+
+
+def load_experiment_data(datapath, columns=None):
+    """Loads the experiment data behind a datapath as an ordered {channel: 1-D numpy array} dictionary.
+    Supports chunked (memory-mapped, see storage/chunked.py), CSV, Parquet, Feather/Arrow, .npy and .npz files."""
+    path = resolve_datapath(datapath)
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == chunked.CHUNKED_EXTENSION:
+        data = chunked.ChunkedReader(path).read(columns)
+    elif extension == ".csv":
+        frame = pd.read_csv(path, usecols=columns)
+        data = {str(column): frame[column].to_numpy() for column in frame.columns}
+    elif extension == ".parquet":
+        table = pq.read_table(path, columns=columns)
+        data = {name: table[name].to_numpy() for name in table.column_names}
+    elif extension in (".feather", ".arrow"):
+        table = feather.read_table(path, columns=columns)
+        data = {name: table[name].to_numpy() for name in table.column_names}
+    elif extension == ".npy":
+        array = np.load(path, mmap_mode="r")
+        array = array.reshape(-1, 1) if array.ndim == 1 else array
+        data = {f"channel_{i}": array[:, i] for i in range(array.shape[1])}
+    elif extension == ".npz":
+        with np.load(path) as archive:
+            data = {name: archive[name] for name in archive.files}
+    else:
+        raise ValueError(f"Unsupported experiment data format: {extension}")
+
+    if columns is not None:
+        data = {column: data[column] for column in columns if column in data}
+    return data
+
+
+def load_experiment_range(datapath, column, low=None, high=None, columns=None):
+    """Loads the rows of an experiment whose column lies in [low, high] (both inclusive and optional). Chunked files
+    only read the chunks their zone maps allow, other formats are loaded in full and filtered."""
+    path = resolve_datapath(datapath)
+    if chunked.is_chunked(path):
+        return chunked.ChunkedReader(path).read(columns, where=(column, low, high))
+
+    data = load_experiment_data(path)
+    mask = np.ones(len(data[column]), dtype=bool)
+    if low is not None:
+        mask &= data[column] >= low
+    if high is not None:
+        mask &= data[column] <= high
+    return {name: values[mask] for name, values in data.items() if columns is None or name in columns}
+
+
+def find_time_column(names):
+    """Returns the name of the time column among channel names, or None."""
+    return next((name for name in names if name.lower() in TIME_COLUMNS), None)
+
+
+def split_time_column(data):
+    """Returns (x, {channel: float64 values}) for loaded experiment data, keeping only numeric channels.
+    x is the experiment's time column when it has one and the sample index otherwise."""
+    channels = {}
+    for name, values in data.items():
+        if np.issubdtype(values.dtype, np.number) or np.issubdtype(values.dtype, np.bool_):
+            channels[name] = np.asarray(values, dtype=np.float64)
+    x_name = find_time_column(channels)
+    length = len(next(iter(data.values()))) if data else 0
+    x = channels.pop(x_name) if x_name else np.arange(length, dtype=np.float64)
+    return x, channels
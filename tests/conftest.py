@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+AMAIAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(AMAIAS_DIRECTORY)
+
+from database import db
+
+TABLE_NAME = "data"
+
+
+def make_rows(count, start=0, month="2024-01"):
+    """Returns count experiment rows dated within the given month."""
+    return [
+        {"name": f"run {index}", "date": f"{month}-{index % 28 + 1:02d}", "product": f"product_{index % 3}", "datapath": f"/data/{index}.npz"}
+        for index in range(start, start + count)
+    ]
+
+
+@pytest.fixture
+def database(tmp_path):
+    """An initialized, empty experiment table set as the default database and table."""
+    db_file = str(tmp_path / "test.db")
+    db.set_default_database_file(db_file)
+    db.set_default_database_table_name(TABLE_NAME)
+    db.initialize_database(db_file, TABLE_NAME)
+    yield db_file
+    db.close_db_connections()
+    db.set_default_database_file(None)
+    db.set_default_database_table_name(None)
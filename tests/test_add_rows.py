@@ -0,0 +1,70 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from conftest import make_rows
+from database import db, partitions
+
+
+def test_missing_keys_get_column_defaults(database):
+    with db.transaction() as conn:
+        conn.execute("ALTER TABLE data ADD COLUMN status TEXT NOT NULL DEFAULT 'new'")
+    db.invalidate_table_schema()
+
+    rows = make_rows(4)
+    rows[1]["status"] = "done"
+    rows[2]["status"] = "failed"
+    ids = db.add_rows(rows)
+    assert [db.get_row(row_id)["status"] for row_id in ids] == ["new", "done", "failed", "new"]
+
+
+def test_missing_required_keys_fail(database):
+    rows = make_rows(3)
+    del rows[1]["name"]
+    with pytest.raises(sqlite3.IntegrityError, match="NOT NULL"):
+        db.add_rows(rows)
+    assert db.get_table_as_list() == []
+
+
+def test_ids_are_returned_in_order(database):
+    rows = make_rows(25)
+    ids = db.add_rows(rows, chunk_size=10)
+    assert ids == list(range(1, 26))
+    assert [db.get_row(row_id)["name"] for row_id in ids] == [row["name"] for row in rows]
+    assert db.add_rows(make_rows(3, start=25)) == [26, 27, 28]
+
+
+def test_ids_of_explicit_and_generated_rows(database):
+    rows = make_rows(4)
+    rows[1]["id"] = 100
+    ids = db.add_rows(rows)
+    assert ids[1] == 100
+    assert len(set(ids)) == 4
+    assert [db.get_row(row_id)["name"] for row_id in ids] == [row["name"] for row in rows]
+
+
+def test_ids_of_dataframes_and_iterators(database):
+    frame = pd.DataFrame(make_rows(5))
+    frame["date"] = pd.to_datetime(frame["date"])
+    assert db.add_rows(frame) == [1, 2, 3, 4, 5]
+    assert db.get_row(1)["date"] == "2024-01-01"
+    assert db.add_rows(iter(make_rows(3, start=5)), chunk_size=2) == [6, 7, 8]
+
+
+def test_new_columns_are_added(database):
+    rows = make_rows(3)
+    rows[2]["Input1"] = 1.5
+    ids = db.add_rows(rows)
+    assert "Input1" in db.get_column_names()
+    assert db.get_row(ids[2])["Input1"] == 1.5
+    assert db.get_row(ids[0])["Input1"] is None
+
+
+def test_ids_of_partitioned_rows(database):
+    db.add_rows(make_rows(2))
+    partitions.enable_partitioning("month")
+    rows = make_rows(3, start=2, month="2024-02") + make_rows(3, start=5, month="2024-03")
+    ids = db.add_rows(rows)
+    assert ids == [3, 4, 5, 6, 7, 8]
+    assert [db.get_row(row_id)["name"] for row_id in ids] == [row["name"] for row in rows]
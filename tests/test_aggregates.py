@@ -0,0 +1,93 @@
+import pytest
+
+from conftest import make_rows
+from database import db, partitions, aggregates
+
+
+@pytest.fixture(params=[False, True], ids=["plain", "partitioned"])
+def filled_database(database, request):
+    rows = make_rows(20, month="2024-01") + make_rows(20, start=20, month="2024-02")
+    rows[3]["product"] = None
+    rows[5]["date"] = "2024-01-06 12:30:00"
+    db.add_rows(rows)
+    if request.param:
+        partitions.enable_partitioning("month")
+    return database
+
+
+def expected_counts():
+    """Recomputes the aggregates from the rows: {product: (count, latest_id, latest_date)} and the same by (product, day)."""
+    products, days = {}, {}
+    for row in db.get_table_as_list():
+        product = row["product"] or ""
+        for groups, key in ((products, product), (days, (product, row["date"][:10]))):
+            count, latest_id, latest_date = groups.get(key, (0, None, None))
+            if latest_date is None or (row["date"], row["id"]) > (latest_date, latest_id):
+                latest_id, latest_date = row["id"], row["date"]
+            groups[key] = (count + 1, latest_id, latest_date)
+    return products, days
+
+
+def stored_counts():
+    products = {row["product"]: (row["count"], row["latest_id"], row["latest_date"]) for row in db.get_product_counts().to_dict("records")}
+    days = {(row["product"], row["day"]): (row["count"], row["latest_id"], row["latest_date"]) for row in db.get_daily_counts().to_dict("records")}
+    return products, days
+
+
+def assert_aggregates_match():
+    assert stored_counts() == expected_counts()
+
+
+def test_inserts(filled_database):
+    assert_aggregates_match()
+    db.add_rows(make_rows(5, start=40, month="2024-03") + [{"name": "late", "date": "2024-02-28", "product": "new", "datapath": "/data/late"}])
+    assert_aggregates_match()
+    assert db.get_product_counts(["new"]).to_dict("records") == [{"product": "new", "count": 1, "latest_id": 46, "latest_date": "2024-02-28"}]
+
+
+def test_updates(filled_database):
+    db.edit_cell(1, "product", "product_2")
+    db.edit_cell(2, "date", "2024-02-27")
+    db.edit_row(4, {"product": "renamed", "date": "2024-01-02"})
+    db.edit_cell(5, "product", None)
+    assert_aggregates_match()
+
+
+def test_deletes(filled_database):
+    latest_id = db.get_product_counts(["product_0"])["latest_id"].item()
+    db.delete_row(latest_id)
+    db.apply_mutations([{"op": "delete", "ids": [4]}])
+    assert_aggregates_match()
+    assert db.get_product_counts(["product_0"])["latest_id"].item() != latest_id
+    assert "" not in stored_counts()[0]
+
+
+def test_emptied_groups_are_removed(filled_database):
+    ids = [row["id"] for row in db.query_rows(filters=[{"column": "product", "op": "=", "value": "product_1"}])]
+    db.apply_mutations([{"op": "delete", "ids": ids}])
+    assert db.get_product_counts(["product_1"]).empty
+    assert db.get_daily_counts(["product_1"]).empty
+    assert_aggregates_match()
+
+
+def test_daily_counts_by_range(filled_database):
+    days = db.get_daily_counts(["product_0"], start_day="2024-01-05", end_day="2024-01-31")
+    assert days["day"].between("2024-01-05", "2024-01-31").all()
+    assert days["count"].sum() == sum(
+        1 for row in db.get_table_as_list() if row["product"] == "product_0" and "2024-01-05" <= row["date"][:10] <= "2024-01-31"
+    )
+
+
+def test_rebuild_matches_the_triggers(filled_database):
+    db.edit_cell(1, "product", "product_2")
+    db.delete_row(7)
+    maintained = stored_counts()
+    assert aggregates.rebuild_aggregates() == len(maintained[0])
+    assert stored_counts() == maintained
+
+
+def test_latest_runs(filled_database):
+    latest = db.get_latest_runs(["product_0", "product_1"])
+    products = expected_counts()[0]
+    assert sorted(row["id"] for row in latest) == sorted(products[product][1] for product in ("product_0", "product_1"))
+    assert [row["date"] for row in latest] == sorted((row["date"] for row in latest), reverse=True)
@@ -0,0 +1,107 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import conftest
+from database import db
+
+sys.path.append(os.path.join(conftest.AMAIAS_DIRECTORY, "speed"))
+from analysis import analysis
+
+
+def batch(values, x=None, channels=None):
+    values = np.asarray(values, dtype=np.float64)
+    experiments, channel_count, samples = values.shape
+    return analysis.ExperimentBatch(
+        list(range(1, experiments + 1)),
+        [f"run {index}" for index in range(experiments)],
+        channels or [f"c{index}" for index in range(channel_count)],
+        np.arange(samples, dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64),
+        values,
+    )
+
+
+def test_summary():
+    result = analysis.summarize(batch([[[1, 2, 3, np.nan]], [[-1, -1, -1, -1]]]))
+    assert result["c0"]["mean"] == [2.0, -1.0]
+    assert result["c0"]["min"] == [1.0, -1.0] and result["c0"]["max"] == [3.0, -1.0]
+    assert result["c0"]["rms"][1] == 1.0
+    assert result["c0"]["std"] == pytest.approx([np.std([1, 2, 3]), 0.0])
+
+
+def test_deviation_finds_the_outlier():
+    values = [[[1, 1, 1]], [[1, 1, 1]], [[1, 1, 7]]]
+    result = analysis.deviation(batch(values))["c0"]
+    assert result["most_deviating"] == 3
+    assert result["max_abs"] == pytest.approx([2.0, 2.0, 4.0])
+
+
+def test_correlation_uses_shared_samples():
+    values = [[[1, 2, 3, 4]], [[2, 4, 6, np.nan]], [[3, 2, 1, 0]]]
+    result = analysis.correlation(batch(values))["c0"]
+    assert result["samples"] == 3
+    np.testing.assert_allclose(result["matrix"], [[1, 1, -1], [1, 1, -1], [-1, -1, 1]])
+    assert analysis.correlation(batch([[[1, np.nan]], [[np.nan, 1]]]))["c0"] == {"matrix": None, "samples": 0}
+
+
+def test_peaks():
+    result = analysis.peaks(batch([[[1, -5, 2]], [[np.nan, np.nan, np.nan]]], x=[10, 20, 30]))["c0"]
+    assert result == {"value": [-5.0, None], "x": [20.0, None]}
+
+
+def test_trend():
+    x = np.linspace(0, 10, 11)
+    result = analysis.trend(batch([[2 * x + 1], [-x]], x=x))["c0"]
+    assert result["slope"] == pytest.approx([2.0, -1.0])
+    assert result["intercept"] == pytest.approx([1.0, 0.0], abs=1e-9)
+
+
+def test_envelope():
+    values = np.stack([np.zeros((1, 1000)), np.ones((1, 1000))])
+    result = analysis.envelope(batch(values))["c0"]
+    assert len(result["x"]) == analysis.ENVELOPE_POINTS
+    assert set(result["min"]) == {0.0} and set(result["max"]) == {1.0} and set(result["mean"]) == {0.5}
+
+
+def test_channels_are_analysed_independently():
+    random = np.random.default_rng(0)
+    values = random.normal(size=(3, 4, 50))
+    whole = batch(values)
+    for name, function in analysis.ANALYSES.items():
+        expected = function(whole)
+        split = {**function(batch(values[:, :2], channels=whole.channels[:2])), **function(batch(values[:, 2:], channels=whole.channels[2:]))}
+        assert split == expected, name
+
+
+@pytest.fixture
+def experiments(database, tmp_path):
+    rows = []
+    for index in range(3):
+        path = str(tmp_path / f"run{index}.npz")
+        time = np.linspace(0, 10, 101 + index)
+        np.savez(path, time=time, a=time * (index + 1), b=np.full(len(time), float(index)))
+        rows.append({"name": f"run {index}", "date": "2024-01-01", "product": "a", "datapath": path})
+    rows.append({"name": "missing", "date": "2024-01-01", "product": "a", "datapath": str(tmp_path / "missing.npz")})
+    return db.add_rows(rows)
+
+
+@pytest.mark.parametrize("block_bytes", [analysis.ANALYSIS_BLOCK_BYTES, 1])
+def test_run_analysis(experiments, monkeypatch, block_bytes):
+    monkeypatch.setattr(analysis, "ANALYSIS_BLOCK_BYTES", block_bytes)
+    reports = []
+    result = analysis.run_analysis("summary", experiments, lambda fraction, message=None: reports.append(fraction))
+    assert [experiment["name"] for experiment in result["experiments"]] == ["run 0", "run 1", "run 2"]
+    assert result["failed"] == [experiments[3]]
+    assert list(result["channels"]) == ["a", "b"]
+    assert result["channels"]["b"]["mean"] == pytest.approx([0.0, 1.0, 2.0])
+    assert result["x_range"] == [0.0, 10.0]
+    assert reports == sorted(reports) and reports[-1] <= 1.0
+    if block_bytes == 1:
+        assert reports[-1] == 1.0
+
+
+def test_unknown_analysis(database):
+    with pytest.raises(ValueError):
+        analysis.run_analysis("missing", [1], lambda fraction, message=None: None)
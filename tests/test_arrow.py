@@ -0,0 +1,82 @@
+import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from conftest import make_rows
+from database import db, partitions
+
+
+@pytest.fixture(params=[False, True], ids=["plain", "partitioned"])
+def filled_database(database, request):
+    db.add_rows(make_rows(20, month="2024-01") + make_rows(20, start=20, month="2024-02"))
+    if request.param:
+        partitions.enable_partitioning("month")
+    return database
+
+
+def test_columns_are_projected_and_typed(filled_database):
+    table = db.get_table_as_arrow(["id", "date", "product"])
+    assert table.column_names == ["id", "date", "product"]
+    assert table.schema.field("id").type == pa.int64()
+    assert table.schema.field("date").type == pa.date32()
+    assert pa.types.is_dictionary(table.schema.field("product").type)
+    assert table.column("id").to_pylist() == list(range(1, 41))
+    assert table.column("date").to_pylist()[0] == datetime.date(2024, 1, 1)
+
+
+def test_table_matches_the_rows(filled_database):
+    table = db.get_table_as_arrow()
+    assert table.column_names == db.get_column_names()
+    rows = db.get_table_as_list()
+    assert table.column("name").to_pylist() == [row["name"] for row in rows]
+    assert table.column("datapath").to_pylist() == [row["datapath"] for row in rows]
+
+
+def test_filters_and_order(filled_database):
+    table = db.get_table_as_arrow(["id", "name"], filters=[{"column": "product", "op": "=", "value": "product_2"}], order_by=[("id", "desc")], chunk_size=3)
+    expected = sorted((row for row in db.get_table_as_list() if row["product"] == "product_2"), key=lambda row: -row["id"])
+    assert table.column("id").to_pylist() == [row["id"] for row in expected]
+    assert table.column("name").to_pylist() == [row["name"] for row in expected]
+
+
+def test_empty_results_keep_the_schema(filled_database):
+    table = db.get_table_as_arrow(["id", "name"], filters=[{"column": "id", "op": ">", "value": 1000}])
+    assert table.num_rows == 0
+    assert table.column_names == ["id", "name"]
+    assert table.schema.field("id").type == pa.int64()
+
+
+def test_untyped_columns_are_inferred(filled_database):
+    db.add_column("Input1")
+    db.edit_cell(3, "Input1", 1.5)
+    table = db.get_table_as_arrow(["id", "Input1"])
+    assert table.schema.field("Input1").type == pa.float64()
+    assert table.column("Input1").to_pylist()[:3] == [None, None, 1.5]
+
+
+def test_values_that_do_not_fit_the_type_are_coerced(filled_database):
+    # SQLite keeps blobs in TEXT columns as they are
+    db.edit_cell(1, "datapath", b"run\xff")
+    assert db.get_table_as_arrow(["datapath"]).column("datapath").to_pylist()[0] == "run\ufffd"
+
+
+def test_unknown_columns_are_rejected(filled_database):
+    with pytest.raises((ValueError, KeyError)):
+        db.get_table_as_arrow(["id", "missing"])
+
+
+def test_arrow_dataframe(filled_database):
+    frame = db.get_table_as_arrow_df(["id", "product"])
+    assert list(frame.columns) == ["id", "product"]
+    assert isinstance(frame["id"].dtype, pd.ArrowDtype)
+    assert frame["product"].tolist() == [row["product"] for row in db.get_table_as_list()]
+
+
+def test_arrow_schema_follows_declared_types():
+    assert db.sqlite_type_to_arrow("INTEGER") == pa.int64()
+    assert db.sqlite_type_to_arrow("VARCHAR(20)") == pa.string()
+    assert db.sqlite_type_to_arrow("DOUBLE") == pa.float64()
+    assert db.sqlite_type_to_arrow(None) == pa.null()
+    assert db.sqlite_type_to_arrow("NUMERIC") == pa.null()
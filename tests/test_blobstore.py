@@ -0,0 +1,112 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from database import db
+from miner import app as miner_app, ingest
+from storage import blobstore
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    """Runs uploads in threads and counts how many were submitted for processing."""
+
+    def __init__(self):
+        super().__init__(max_workers=2)
+        self.submitted = []
+
+    def submit(self, function, *args, **kwargs):
+        self.submitted.append(args[0])
+        return super().submit(function, *args, **kwargs)
+
+
+@pytest.fixture
+def blob_root(database, tmp_path, monkeypatch):
+    root = str(tmp_path / "experiments")
+    monkeypatch.setattr(blobstore, "blob_root", root)
+    monkeypatch.setattr(db, "delete_callbacks", [])
+    blobstore.enable_garbage_collection()
+    return root
+
+
+def write_experiment(path, scale=1.0):
+    np.savez(path, time=np.arange(100, dtype=np.float64), value=np.linspace(0, scale, 100))
+    return str(path)
+
+
+def experiment(path, name):
+    return {"path": path, "digest": blobstore.hash_file(path), "name": name, "date": "2024-01-01", "product": "a", "row_id": None}
+
+
+def test_hash_file_matches_whole_file_hash(tmp_path, monkeypatch):
+    monkeypatch.setattr(blobstore, "HASH_CHUNK_SIZE", 7)
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(1000))
+    assert blobstore.hash_file(str(path)) == hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def test_upload_is_hashed_while_streaming(tmp_path, monkeypatch):
+    monkeypatch.setattr(miner_app, "UPLOAD_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(miner_app, "UPLOAD_CHUNK_SIZE", 10)
+    content = os.urandom(1000)
+    response = miner_app.app.test_client().put("/uploads/run.npz", data=content)
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body["bytes"] == len(content)
+    assert body["digest"] == hashlib.sha256(content).hexdigest()
+
+    upload_path = miner_app.find_upload(body["upload_id"])
+    assert upload_path.endswith(".npz")
+    assert miner_app.upload_digest(upload_path) == body["digest"]
+    assert not [file_name for file_name in os.listdir(tmp_path) if file_name.endswith(".part")]
+
+
+def test_duplicates_skip_processing(blob_root, tmp_path):
+    first = write_experiment(tmp_path / "first.npz")
+    repeated = str(tmp_path / "repeated.npz")
+    with open(first, "rb") as fin, open(repeated, "wb") as fout:
+        fout.write(fin.read())
+    other = write_experiment(tmp_path / "other.npz", scale=2.0)
+
+    with CountingExecutor() as executor:
+        registered, failed = ingest.ingest_files(
+            [experiment(first, "first"), experiment(repeated, "repeated"), experiment(other, "other")], executor, remove_files=False,
+        )
+    assert failed == []
+    # The repeated file has the content of the first, so only two files were processed
+    assert executor.submitted == [first, other]
+    results = {experiment["name"]: result for experiment, _, result in registered}
+    first_id = next(row_id for experiment, row_id, _ in registered if experiment["name"] == "first")
+    assert results["repeated"]["deduplicated"] and results["repeated"]["stored_bytes"] == 0
+    assert results["repeated"]["datapath"] == results["first"]["datapath"]
+    assert os.path.commonpath([blob_root, results["first"]["datapath"]]) == blob_root
+
+    # Content stored by an earlier batch isn't processed again either
+    with CountingExecutor() as executor:
+        registered, failed = ingest.ingest_files([experiment(repeated, "again")], executor, remove_files=False)
+    assert failed == [] and executor.submitted == []
+    assert registered[0][2]["deduplicated"]
+    # Its statistics are copied from the experiment that already references the content
+    assert len(db.get_statistics([registered[0][1]])) == len(db.get_statistics([first_id])) > 0
+
+
+def test_blobs_are_removed_with_their_last_reference(blob_root, tmp_path):
+    path = write_experiment(tmp_path / "run.npz")
+    with CountingExecutor() as executor:
+        registered, _ = ingest.ingest_files([experiment(path, "a"), experiment(path, "b")], executor, remove_files=False)
+    (_, first_id, result), (_, second_id, _) = registered
+    datapath = result["datapath"]
+
+    db.delete_row(first_id)
+    assert os.path.exists(datapath)
+    db.apply_mutations([{"op": "delete", "ids": [second_id]}])
+    assert not os.path.exists(datapath)
+
+
+def test_files_outside_the_blob_store_are_kept(blob_root, tmp_path):
+    path = write_experiment(tmp_path / "run.npz")
+    [row_id] = db.add_rows([{"name": "external", "date": "2024-01-01", "product": "a", "datapath": path}])
+    db.delete_row(row_id)
+    assert os.path.exists(path)
@@ -0,0 +1,69 @@
+import pytest
+
+from conftest import make_rows
+from database import db, partitions
+
+
+@pytest.fixture(params=[False, True], ids=["unpartitioned", "partitioned"])
+def filled_database(request, database):
+    db.add_rows(make_rows(5))
+    if request.param:
+        partitions.enable_partitioning("month")
+    return database
+
+
+def test_every_write_moves_the_version(filled_database):
+    version = db.get_change_version()
+    db.add_row(make_rows(1, start=5)[0])
+    assert db.get_change_version() == version + 1
+    db.edit_cell(1, "name", "edited")
+    assert db.get_change_version() == version + 2
+    db.delete_row(2)
+    assert db.get_change_version() == version + 3
+
+
+def test_changes_since(filled_database):
+    version = db.get_change_version()
+    assert db.get_changes_since(version) == {"version": version, "added": [], "updated": [], "deleted": [], "truncated": False}
+
+    added_id, = db.add_rows(make_rows(1, start=5, month="2024-02"))
+    db.edit_row(1, {"name": "edited"})
+    db.delete_row(2)
+    changes = db.get_changes_since(version)
+    assert changes["version"] == version + 3
+    assert [row["id"] for row in changes["added"]] == [added_id]
+    assert [(row["id"], row["name"]) for row in changes["updated"]] == [(1, "edited")]
+    assert changes["deleted"] == [2]
+    assert not changes["truncated"]
+
+    # Deltas are relative to the given version
+    later = db.get_changes_since(version + 2)
+    assert later["added"] == [] and later["updated"] == [] and later["deleted"] == [2]
+
+
+def test_rows_added_and_removed_since_are_left_out(filled_database):
+    version = db.get_change_version()
+    added_id, = db.add_rows(make_rows(1, start=5))
+    db.edit_cell(added_id, "name", "edited")
+    db.delete_row(added_id)
+    changes = db.get_changes_since(version)
+    assert changes["added"] == [] and changes["updated"] == [] and changes["deleted"] == []
+    assert changes["version"] == version + 3
+
+
+def test_added_then_updated_rows_are_added(filled_database):
+    version = db.get_change_version()
+    added_id, = db.add_rows(make_rows(1, start=5))
+    db.edit_cell(added_id, "name", "edited")
+    changes = db.get_changes_since(version)
+    assert [(row["id"], row["name"]) for row in changes["added"]] == [(added_id, "edited")]
+    assert changes["updated"] == []
+
+
+def test_too_many_changes_are_truncated(filled_database):
+    version = db.get_change_version()
+    db.add_rows(make_rows(20, start=5))
+    changes = db.get_changes_since(version, max_changes=10)
+    assert changes["truncated"]
+    assert changes["version"] == version + 20
+    assert changes["added"] == []
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from storage import chunked
+
+ROWS = 3500
+CHUNK_ROWS = 1000
+
+
+def columns():
+    random = np.random.default_rng(0)
+    data = {}
+    for dtype in ["int8", "int16", "int32", "int64", "uint8", "uint16", "uint32", "uint64"]:
+        info = np.iinfo(dtype)
+        values = random.integers(info.min, info.max, ROWS, dtype=dtype, endpoint=True)
+        values[:3] = [info.min, info.max, 0]
+        data[f"random_{dtype}"] = values
+        data[f"steps_{dtype}"] = (np.arange(ROWS) // 7).astype(dtype)
+    for dtype in ["float32", "float64"]:
+        values = np.sin(np.linspace(0, 20, ROWS)).astype(dtype)
+        values[:5] = [np.nan, np.inf, -np.inf, -0.0, 0.0]
+        data[f"float_{dtype}"] = values
+        data[f"levels_{dtype}"] = (np.arange(ROWS) % 5).astype(dtype)
+    data["bool"] = random.integers(0, 2, ROWS).astype(bool)
+    data["datetime"] = np.datetime64("2024-01-01T00:00:00", "ns") + np.arange(ROWS).astype("timedelta64[ms]")
+    data["date"] = np.datetime64("2024-01-01") + (np.arange(ROWS) // 100).astype("timedelta64[D]")
+    data["duration"] = random.integers(0, 10**6, ROWS).astype("timedelta64[us]")
+    data["unicode"] = np.array(["idle", "running", "stopped", "ünïcode"])[random.integers(0, 4, ROWS)]
+    data["bytes"] = np.array([b"a", b"bb", b"ccc"])[random.integers(0, 3, ROWS)]
+    return data
+
+
+@pytest.fixture(scope="module", params=[None, "auto"], ids=["plain", "auto"])
+def reader(request, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("chunked") / f"experiment{chunked.CHUNKED_EXTENSION}")
+    chunked.write_chunked(path, columns(), chunk_rows=CHUNK_ROWS, compression=request.param)
+    return chunked.ChunkedReader(path)
+
+
+def assert_identical(actual, expected):
+    assert actual.dtype == expected.dtype
+    assert actual.shape == expected.shape
+    assert np.ascontiguousarray(actual).tobytes() == np.ascontiguousarray(expected).tobytes()
+
+
+@pytest.mark.parametrize("name", list(columns()))
+def test_columns_round_trip(reader, name):
+    expected = columns()[name]
+    assert reader.num_rows == ROWS
+    assert_identical(reader.column(name), expected)
+    assert_identical(reader.rows(name, 950, 2100), expected[950:2100])
+    assert_identical(reader.chunk(name, 3), expected[3000:])
+    assert_identical(reader.read([name], rows=slice(10, 3000, 7))[name], expected[10:3000:7])
+
+
+def test_auto_compression_encodes_compressible_columns(reader):
+    report = reader.compression_report()
+    if reader.is_encoded("steps_int64"):
+        assert report["steps_int64"]["ratio"] > 1
+        assert report["unicode"]["encoding"] != "plain"
+    else:
+        assert all(entry["encoding"] == "plain" for entry in report.values())
+
+
+def test_object_columns_are_stored_as_text(tmp_path):
+    path = str(tmp_path / f"experiment{chunked.CHUNKED_EXTENSION}")
+    chunked.write_chunked(path, {"label": np.array(["a", "bc", None], dtype=object)}, compression="auto")
+    assert chunked.ChunkedReader(path).column("label").tolist() == ["a", "bc", "None"]
+
+
+@pytest.mark.parametrize("name", ["steps_int32", "float_float64", "datetime", "random_uint64"])
+def test_predicate_reads_match_a_scan(reader, name):
+    values = columns()[name]
+    finite = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+    low, high = np.sort(finite)[[ROWS // 4, ROWS // 2]]
+    mask = (values >= low) & (values <= high)
+    # Predicates on dates compare their integer representation, like zone maps
+    low, high = chunked.comparable(np.array([low, high])).tolist()
+    result = reader.read([name, "unicode"], where=(name, low, high))
+    assert_identical(result[name], values[mask])
+    assert_identical(result["unicode"], columns()["unicode"][mask])
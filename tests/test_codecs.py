@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import test_chunked
+from storage import codecs
+
+
+def sample_columns():
+    random = np.random.default_rng(0)
+    rows = 50000
+    return {
+        "time": np.linspace(0, 100, rows),
+        "noisy": np.sin(np.linspace(0, 100, rows)) + random.normal(scale=0.1, size=rows),
+        "counter": np.arange(rows, dtype=np.int64) * 3,
+        "state": random.integers(0, 4, rows).astype(np.int32),
+        "flag": random.integers(0, 2, rows).astype(bool),
+        "label": np.array(["idle", "run", "stop"])[random.integers(0, 3, rows)],
+        "stamp": np.datetime64("2024-01-01T00:00:00") + np.arange(rows).astype("timedelta64[s]"),
+    }
+
+
+@pytest.mark.parametrize("name", list(sample_columns()))
+def test_choice_only_depends_on_sizes(monkeypatch, name):
+    array = sample_columns()[name]
+    chosen = [codecs.choose_encoding(array)[0] for _ in range(3)]
+    monkeypatch.setattr(codecs, "time_encoding", lambda *args, **kwargs: (1e-9, 1e-9))
+    assert chosen == [codecs.choose_encoding(array)[0]] * 3
+
+
+def test_slow_encodings_fall_back_to_faster_ones(monkeypatch):
+    array = sample_columns()["counter"]
+    fastest = dict(codecs.choose_encoding(array)[0], codec=None, level=None)
+
+    def time_encoding(sample, encoding, dictionary, runs=codecs.TIMING_RUNS):
+        return (1e-9, 1e-9) if encoding["codec"] is None else (1.0, 1.0)
+
+    monkeypatch.setattr(codecs, "time_encoding", time_encoding)
+    encoding = codecs.choose_encoding(array)[0]
+    assert encoding is None or encoding == fastest
+
+
+@pytest.mark.parametrize("name", list(test_chunked.columns()))
+@pytest.mark.parametrize("codec, level", codecs.CODEC_LEVELS + [("zstd", 9)])
+def test_encodings_round_trip(name, codec, level):
+    array = test_chunked.columns()[name]
+    for transform, shuffled in codecs.candidate_transforms(array, array):
+        dictionary = codecs.build_dictionary(array) if transform == "dictionary" else None
+        if transform == "dictionary" and dictionary is None:
+            continue
+        encoding = {"transform": transform, "shuffle": shuffled, "codec": codec, "level": level}
+        decoded = codecs.decode_chunk(codecs.encode_chunk(array, encoding, dictionary), encoding, array.dtype, len(array), dictionary)
+        test_chunked.assert_identical(decoded, array)
+
+
+@pytest.mark.parametrize("name", list(test_chunked.columns()))
+def test_chosen_encodings_round_trip(name):
+    array = test_chunked.columns()[name]
+    encoding, dictionary, report = codecs.choose_encoding(array)
+    if encoding is None:
+        assert report["encoding"] == "plain"
+        return
+    assert report["ratio"] >= codecs.MIN_RATIO
+    decoded = codecs.decode_chunk(codecs.encode_chunk(array, encoding, dictionary), encoding, array.dtype, len(array), dictionary)
+    test_chunked.assert_identical(decoded, array)
+
+
+def test_lossy_dictionaries_are_rejected_outside_the_sample():
+    array = np.tile(np.array([0.0, 1.0, 2.0]), 100000)
+    # Outside of every sampled block, so only the whole column shows the dictionary would merge it with 0.0
+    array[50000] = -0.0
+    assert 50000 not in codecs.sample_column(np.arange(len(array)))
+    assert codecs.build_dictionary(array) is None
+    encoding, dictionary, _ = codecs.choose_encoding(array)
+    assert encoding is not None and encoding["transform"] != "dictionary"
+    decoded = codecs.decode_chunk(codecs.encode_chunk(array, encoding, dictionary), encoding, array.dtype, len(array), dictionary)
+    test_chunked.assert_identical(decoded, array)
@@ -0,0 +1,89 @@
+import io
+import os
+import csv
+import sys
+import json
+
+import pyarrow.parquet as pq
+import pytest
+from dash import Dash, html
+
+import conftest
+from conftest import make_rows
+from database import db
+
+sys.path.append(os.path.join(conftest.AMAIAS_DIRECTORY, "speed"))
+from routes import routes
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    db.add_rows(make_rows(25))
+    # Small chunks so the exports span several of them
+    monkeypatch.setattr(routes, "EXPORT_CHUNK_SIZE", 10)
+    app = Dash("SPEED")
+    app.layout = html.Div()
+    routes.register_routes(app)
+    return app.server.test_client()
+
+
+def export(client, export_format, **params):
+    query = {key: value if isinstance(value, str) else json.dumps(value) for key, value in params.items()}
+    return client.get(f"/export/{export_format}", query_string=query)
+
+
+def test_csv_export(client):
+    response = export(client, "csv", columns="id,name,product", filter={"product": {"filterType": "text", "type": "equals", "filter": "product_1"}}, sort=[{"colId": "id", "sort": "desc"}])
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == ["id", "name", "product"]
+    expected = [row for row in db.get_table_as_list() if row["product"] == "product_1"][::-1]
+    assert rows[1:] == [[str(row["id"]), row["name"], row["product"]] for row in expected]
+
+
+def test_empty_csv_export_has_a_header(client):
+    response = export(client, "csv", columns="id,name", filter={"name": {"filterType": "text", "type": "equals", "filter": "missing"}})
+    assert response.status_code == 200
+    assert list(csv.reader(io.StringIO(response.get_data(as_text=True)))) == [["id", "name"]]
+
+
+def test_ndjson_export(client):
+    response = export(client, "ndjson", columns="id,date")
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert records == [{"id": row["id"], "date": row["date"]} for row in db.get_table_as_list()]
+
+
+def test_parquet_export(client):
+    response = export(client, "parquet", sort=[{"colId": "name", "sort": "asc"}])
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.get_data()))
+    assert table.num_rows == 25
+    assert table.column_names == db.get_arrow_schema().names
+    assert table.column("name").to_pylist() == sorted(row["name"] for row in db.get_table_as_list())
+
+
+def test_empty_parquet_export_keeps_the_schema(client):
+    response = export(client, "parquet", columns="id,name", filter={"id": {"filterType": "number", "type": "greaterThan", "filter": 1000}})
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.get_data()))
+    assert table.num_rows == 0 and table.column_names == ["id", "name"]
+
+
+@pytest.mark.parametrize("export_format", ["csv", "ndjson", "parquet"])
+@pytest.mark.parametrize("params", [
+    {"filter": {"missing": {"filterType": "text", "type": "equals", "filter": "a"}}},
+    {"filter": {"name": {"filterType": "text", "type": "unknown", "filter": "a"}}},
+    {"filter": {"name": "not a condition"}},
+    {"filter": "{not json"},
+    {"sort": [{"colId": "missing", "sort": "asc"}]},
+    {"sort": [{"colId": "name", "sort": "sideways"}]},
+    {"columns": "id,missing"},
+])
+def test_bad_requests_are_rejected_before_streaming(client, export_format, params):
+    assert export(client, export_format, **params).status_code == 400
+
+
+def test_unknown_format(client):
+    assert export(client, "xlsx").status_code == 404
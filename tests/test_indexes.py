@@ -0,0 +1,43 @@
+import pytest
+
+from conftest import make_rows
+from database import db
+
+
+@pytest.fixture
+def filled_database(database):
+    db.add_rows(make_rows(500))
+    return database
+
+
+@pytest.mark.parametrize("filters, index_name", [
+    ([{"column": "product", "op": "=", "value": "product_1"}], "data_product_date"),
+    ([{"column": "date", "op": "between", "value": ["2024-01-05", "2024-01-10"]}], "data_date"),
+    ([{"column": "name", "op": "prefix", "value": "run 1"}], "data_name"),
+    ([{"column": "name", "op": "match", "value": "run"}], "data_fts"),
+])
+def test_filters_use_index(filled_database, filters, index_name):
+    plan = db.explain_query_rows(filters=filters)
+    assert db.plan_uses_index(plan, index_name), plan
+
+
+def test_indexed_filters_match_scan(filled_database):
+    rows = db.query_rows(filters=[{"column": "name", "op": "prefix", "value": "run 1"}])
+    assert sorted(row["name"] for row in rows) == sorted(row["name"] for row in db.get_table_as_list() if row["name"].startswith("run 1"))
+
+
+@pytest.mark.parametrize("column", ["product", "date", "name", "datapath"])
+def test_delete_indexed_column_is_rejected(filled_database, column):
+    with pytest.raises(ValueError, match=column):
+        db.delete_column(column)
+    assert column in db.get_column_names()
+
+    db.add_row({"name": "after", "date": "2024-02-01", "product": "product_0", "datapath": "/data/after.npz"})
+    db.delete_row(1)
+    assert len(db.get_table_as_list()) == 500
+
+
+def test_delete_unindexed_column(filled_database):
+    db.add_column("Input1")
+    db.delete_column("Input1")
+    assert "Input1" not in db.get_column_names()
@@ -0,0 +1,75 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from database import db
+from miner import app as miner_app, ingest
+from storage import blobstore
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+@pytest.fixture
+def client(database, tmp_path, monkeypatch, executor):
+    os.makedirs(tmp_path / "uploads")
+    monkeypatch.setattr(miner_app, "UPLOAD_DIRECTORY", str(tmp_path / "uploads"))
+    monkeypatch.setattr(blobstore, "blob_root", str(tmp_path / "experiments"))
+    monkeypatch.setattr(miner_app, "get_ingest_executor", lambda: executor)
+    return miner_app.app.test_client()
+
+
+def experiment_bytes(tmp_path, scale):
+    path = tmp_path / f"{scale}.npz"
+    np.savez(path, time=np.arange(50, dtype=np.float64), value=np.linspace(0, scale, 50))
+    return path.read_bytes()
+
+
+def upload(client, file_name, content):
+    return client.put(f"/uploads/{file_name}", data=content).get_json()["upload_id"]
+
+
+def test_bad_files_fail_without_failing_the_batch(client, tmp_path, executor):
+    good = str(tmp_path / "good.npz")
+    with open(good, "wb") as fout:
+        fout.write(experiment_bytes(tmp_path, 1.0))
+    # Truncated archives raise zipfile.BadZipFile
+    broken = str(tmp_path / "broken.npz")
+    with open(broken, "wb") as fout:
+        fout.write(experiment_bytes(tmp_path, 2.0)[:200])
+
+    experiments = [
+        {"path": path, "digest": blobstore.hash_file(path), "name": name, "date": "2024-01-01", "product": "a"}
+        for path, name in ((broken, "broken"), (good, "good"))
+    ]
+    registered, failed = ingest.ingest_files(experiments, executor, remove_files=False)
+    assert [experiment["name"] for experiment, _, _ in registered] == ["good"]
+    assert [experiment["name"] for experiment, _ in failed] == ["broken"]
+    assert failed[0][1]
+    assert [row["name"] for row in db.get_table_as_list()] == ["good"]
+
+
+def test_ingest_lists_the_staging_directory_once(client, tmp_path, monkeypatch):
+    upload_ids = [upload(client, f"run{index}.npz", experiment_bytes(tmp_path, index + 1.0)) for index in range(3)]
+
+    listings = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: listings.append(path) or listdir(path))
+    response = client.post("/ingest", json={"experiments": [
+        {"upload_id": upload_id, "name": f"run {index}", "date": "2024-01-01", "product": "a"} for index, upload_id in enumerate(upload_ids)
+    ]})
+    assert response.status_code == 200
+    assert len(response.get_json()["ids"]) == 3
+    assert listings == [miner_app.UPLOAD_DIRECTORY]
+
+
+def test_unknown_uploads_are_rejected(client, tmp_path):
+    upload(client, "run.npz", experiment_bytes(tmp_path, 1.0))
+    response = client.post("/ingest", json={"experiments": [{"upload_id": "missing", "name": "run", "date": "2024-01-01"}]})
+    assert response.status_code == 400
+    assert miner_app.find_upload("../uploads") is None
@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import conftest
+from conftest import make_rows
+from database import db
+
+sys.path.append(os.path.join(conftest.AMAIAS_DIRECTORY, "speed"))
+from jobs import jobs
+
+
+@pytest.fixture
+def job_store(database, tmp_path, monkeypatch):
+    job_store_file = str(tmp_path / "jobs.db")
+    monkeypatch.setattr(jobs, "default_job_store_file", job_store_file)
+    monkeypatch.setattr(jobs, "job_futures", {})
+    jobs.initialize_job_store()
+    db.add_rows(make_rows(5))
+    # Jobs run in threads here, so the job functions below can share state with the tests
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        monkeypatch.setattr(jobs, "job_executor", executor)
+        yield job_store_file
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def count(row_ids, progress, db_file, table_name):
+        calls.append(row_ids)
+        progress(0.5, "Halfway")
+        return {"rows": len(row_ids)}
+
+    def fail(row_ids, progress, db_file, table_name):
+        calls.append(row_ids)
+        raise RuntimeError("broken")
+
+    monkeypatch.setitem(jobs.JOB_FUNCTIONS, "count", count)
+    monkeypatch.setitem(jobs.JOB_FUNCTIONS, "fail", fail)
+    return calls
+
+
+def wait_for(job_id, statuses=("done", "failed", "cancelled")):
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        job = jobs.get_job(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} is still {job['status']}")
+
+
+def test_job_runs_and_stores_its_result(job_store, calls):
+    job_id = jobs.submit_job("count", [3, 1, 2])
+    job = wait_for(job_id)
+    assert job["status"] == "done"
+    assert job["result"] == {"rows": 3}
+    assert job["row_ids"] == [1, 2, 3] and job["progress"] == 1.0
+    assert calls == [[1, 2, 3]]
+
+
+def test_identical_submissions_share_a_job(job_store, calls):
+    job_id = jobs.submit_job("count", [1, 2])
+    assert jobs.submit_job("count", [2, 1]) == job_id
+    wait_for(job_id)
+    # A finished job is served from its stored result
+    assert jobs.submit_job("count", [1, 2]) == job_id
+    assert calls == [[1, 2]]
+    assert jobs.submit_job("count", [1, 3]) != job_id
+
+
+def test_writes_start_a_new_job(job_store, calls):
+    job_id = jobs.submit_job("count", [1, 2])
+    wait_for(job_id)
+    db.edit_cell(1, "name", "edited")
+    new_job_id = jobs.submit_job("count", [1, 2])
+    assert new_job_id != job_id
+    wait_for(new_job_id)
+    assert calls == [[1, 2], [1, 2]]
+
+
+def test_failed_jobs_are_retried(job_store, calls):
+    job_id = jobs.submit_job("fail", [1])
+    job = wait_for(job_id)
+    assert job["status"] == "failed" and job["error"] == "RuntimeError: broken"
+    assert jobs.submit_job("fail", [1]) == job_id
+    wait_for(job_id)
+    assert calls == [[1], [1]]
+
+
+def test_queued_jobs_can_be_cancelled(job_store, calls, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setitem(jobs.JOB_FUNCTIONS, "block", lambda row_ids, progress, db_file, table_name: release.wait(10))
+    blocking_id = jobs.submit_job("block", [1])
+    job_id = jobs.submit_job("count", [1])
+    jobs.cancel_job(job_id)
+    release.set()
+    wait_for(blocking_id)
+    assert jobs.get_job(job_id)["status"] == "cancelled"
+    assert calls == []
+
+
+def test_running_jobs_stop_at_their_next_progress_report(job_store, monkeypatch):
+    started = threading.Event()
+
+    def spin(row_ids, progress, db_file, table_name):
+        started.set()
+        while True:
+            progress(0.1)
+            time.sleep(0.01)
+
+    monkeypatch.setitem(jobs.JOB_FUNCTIONS, "spin", spin)
+    job_id = jobs.submit_job("spin", [1])
+    assert started.wait(10)
+    jobs.cancel_job(job_id)
+    job = wait_for(job_id)
+    assert job["status"] == "cancelled" and job["cancel_requested"] == 1
+
+
+def test_unknown_job_functions_are_rejected(job_store):
+    with pytest.raises(ValueError):
+        jobs.submit_job("missing", [1])
+    assert jobs.get_job("missing") is None
+
+
+def test_restart_fails_unfinished_jobs(job_store, calls):
+    job_id = jobs.submit_job("count", [1])
+    wait_for(job_id)
+    jobs.update_job(job_id, job_store, status="running")
+    jobs.initialize_job_store()
+    job = jobs.get_job(job_id)
+    assert job["status"] == "failed" and job["error"] == "Interrupted by a server restart"
+
+
+def test_analyses_are_job_functions(job_store):
+    for name in ("summary", "deviation", "correlation", "peaks", "trend", "envelope"):
+        assert name in jobs.JOB_FUNCTIONS
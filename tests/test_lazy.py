@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import subprocess
+
+import conftest
+from utils import lazy
+
+HEAVY_MODULES = ["numpy", "pandas", "pyarrow", "pyarrow.parquet", "pyarrow.compute"]
+
+STARTUP_SCRIPT = """
+import sys, json
+sys.path.insert(0, {amaias_directory!r})
+sys.path.insert(0, {speed_directory!r})
+heavy = {heavy!r}
+loaded = {{}}
+
+from database import db
+from jobs import jobs
+db.set_default_database_file({db_file!r})
+db.set_default_database_table_name("data")
+db.initialize_database()
+jobs.initialize_job_store({job_store_file!r})
+import app
+loaded["startup"] = [name for name in heavy if name in sys.modules]
+
+client = app.app.server.test_client()
+assert client.get("/").status_code == 200
+assert client.get("/_dash-layout").status_code == 200
+loaded["layout"] = [name for name in heavy if name in sys.modules]
+
+from utils import lazy
+lazy.preload()
+loaded["preloaded"] = [name for name in heavy if name in sys.modules]
+print(json.dumps(loaded))
+"""
+
+
+def test_heavy_modules_stay_unloaded_at_startup(database, tmp_path):
+    script = STARTUP_SCRIPT.format(
+        amaias_directory=conftest.AMAIAS_DIRECTORY,
+        speed_directory=os.path.join(conftest.AMAIAS_DIRECTORY, "speed"),
+        heavy=HEAVY_MODULES,
+        db_file=database,
+        job_store_file=str(tmp_path / "jobs.db"),
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True, cwd=str(tmp_path)).stdout
+    loaded = json.loads(output.splitlines()[-1])
+    assert loaded["startup"] == []
+    # Serializing the layout may import numpy through orjson, but the grid shell needs neither pandas nor pyarrow
+    assert not {"pandas", "pyarrow"}.intersection(loaded["layout"])
+    assert loaded["preloaded"] == HEAVY_MODULES
+
+
+def test_lazy_modules_import_on_first_use(monkeypatch):
+    name = "tabnanny"
+    monkeypatch.delitem(sys.modules, name, raising=False)
+    monkeypatch.delitem(lazy.lazy_modules, name, raising=False)
+    module = lazy.lazy_import(name)
+    assert lazy.lazy_import(name) is module
+    assert not lazy.is_loaded(name)
+    assert callable(module.check)
+    assert lazy.is_loaded(name)
+    # Attributes are copied over, so later lookups don't go through __getattr__
+    assert "check" in vars(module)
@@ -0,0 +1,132 @@
+import sqlite3
+import logging
+
+import pytest
+from flask import Flask
+
+from metrics import metrics
+
+
+def count(counter, *labels):
+    return counter.values.get(labels, 0)
+
+
+def observations(histogram, *labels):
+    counts, total = histogram.values.get(labels) or ([0], 0)
+    return sum(counts), total
+
+
+def test_counter_and_gauge():
+    counter = metrics.Counter("test_total", "Test counter.", ("kind",))
+    counter.inc("a")
+    counter.inc("a", amount=2)
+    counter.inc("b")
+    assert counter.render() == ["# HELP test_total Test counter.", "# TYPE test_total counter", 'test_total{kind="a"} 3', 'test_total{kind="b"} 1']
+
+    gauge = metrics.Gauge("test_open", "Test gauge.")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.render()[1:] == ["# TYPE test_open gauge", "test_open 1"]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "Test histogram.", ("function",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, "read")
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{function="read",le="0.1"} 1',
+        'test_seconds_bucket{function="read",le="1"} 3',
+        'test_seconds_bucket{function="read",le="+Inf"} 4',
+        'test_seconds_sum{function="read"} 6.05',
+        'test_seconds_count{function="read"} 4',
+    ]
+
+
+def test_labels_are_escaped():
+    assert metrics.format_labels(("name",), ('a "b"\n',)) == '{name="a \\"b\\"\\n"}'
+
+
+def test_instrumented_functions_count_calls_rows_and_errors():
+    def read(fail=False):
+        if fail:
+            raise ValueError("failed")
+        return [1, 2, 3]
+
+    wrapped = metrics.instrument_function(read, "test_read")
+    calls, _ = observations(metrics.db_call_seconds, "test_read")
+    assert wrapped() == [1, 2, 3]
+    with pytest.raises(ValueError):
+        wrapped(fail=True)
+    assert observations(metrics.db_call_seconds, "test_read")[0] == calls + 2
+    assert observations(metrics.db_call_rows, "test_read") == (1, 3)
+    assert count(metrics.db_call_errors, "test_read") == 1
+
+
+def test_instrumented_generators_count_every_chunk():
+    def chunks():
+        yield ["a", "b"], [(1, 2), (3, 4)]
+        yield ["a", "b"], [(5, 6)]
+
+    wrapped = metrics.instrument_function(chunks, "test_chunks")
+    assert len(list(wrapped())) == 2
+    assert observations(metrics.db_call_rows, "test_chunks") == (1, 3)
+    assert observations(metrics.db_call_seconds, "test_chunks")[0] == 1
+
+
+def test_count_rows():
+    assert metrics.count_rows(([{"id": 1}], 10)) == 1
+    assert metrics.count_rows((["id"], [(1,), (2,)])) == 2
+    assert metrics.count_rows({"id": 1}) is None
+
+
+def test_statements_and_connections_are_counted():
+    opened, open_now = count(metrics.connections_opened), count(metrics.connections_open)
+    selects, _ = observations(metrics.sql_seconds, "SELECT")
+    conn = sqlite3.connect(":memory:", factory=metrics.InstrumentedConnection)
+    assert count(metrics.connections_opened) == opened + 1
+    assert count(metrics.connections_open) == open_now + 1
+
+    conn.execute("CREATE TABLE t (x)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(1,), (2,)])
+    assert conn.execute("SELECT x FROM t").fetchall() == [(1,), (2,)]
+    assert [row for row in conn.execute("SELECT x FROM t WHERE x > ?", (1,))] == [(2,)]
+    assert observations(metrics.sql_seconds, "SELECT")[0] == selects + 2
+    conn.close()
+    conn.close()
+    assert count(metrics.connections_open) == open_now
+
+
+def test_slow_queries_are_logged_with_their_plan(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "SLOW_QUERY_SECONDS", 0)
+    slow = count(metrics.slow_queries, "SELECT")
+    conn = sqlite3.connect(":memory:", factory=metrics.InstrumentedConnection)
+    conn.execute("CREATE TABLE t (x)")
+    with caplog.at_level(logging.WARNING, logger="speed.slow_queries"):
+        conn.execute("SELECT x FROM t WHERE x = ?", (1,)).fetchall()
+    conn.close()
+    assert count(metrics.slow_queries, "SELECT") == slow + 1
+    assert any("SELECT x FROM t WHERE x = ?" in record.message and "SCAN t" in record.message for record in caplog.records)
+
+
+def test_requests_are_measured():
+    server = Flask("test")
+    metrics.instrument_server(server)
+
+    @server.route("/rows")
+    def rows():
+        conn = sqlite3.connect(":memory:", factory=metrics.InstrumentedConnection)
+        conn.execute("SELECT 1").fetchall()
+        conn.close()
+        return "x" * 500
+
+    server.add_url_rule("/metrics", "metrics", lambda: metrics.render_metrics())
+    client = server.test_client()
+    assert client.get("/rows").status_code == 200
+    assert observations(metrics.request_seconds, "rows")[0] >= 1
+    assert observations(metrics.request_connections, "rows")[1] >= 1
+    assert observations(metrics.response_bytes, "rows")[1] >= 500
+
+    rendered = client.get("/metrics").get_data(as_text=True)
+    assert 'speed_http_request_seconds_count{endpoint="rows"}' in rendered
+    assert all(f"# TYPE {metric.name} " in rendered for metric in metrics.METRICS)
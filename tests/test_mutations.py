@@ -0,0 +1,97 @@
+import os
+import sys
+
+import pytest
+from dash import Dash, html
+
+import conftest
+from conftest import make_rows
+from database import db
+
+sys.path.append(os.path.join(conftest.AMAIAS_DIRECTORY, "speed"))
+from routes import routes
+
+
+@pytest.fixture
+def filled_database(database):
+    db.add_rows(make_rows(10))
+    return database
+
+
+@pytest.fixture
+def client(filled_database):
+    app = Dash("SPEED")
+    app.layout = html.Div()
+    routes.register_routes(app)
+    return app.server.test_client()
+
+
+def test_batch_is_applied_in_order(filled_database):
+    version = db.get_change_version()
+    result = db.apply_mutations([
+        {"op": "edit_cell", "id": 1, "column": "name", "value": "a"},
+        {"op": "edit_cell", "id": 2, "column": "name", "value": "b"},
+        {"op": "edit_row", "id": 3, "values": {"name": "c", "product": "other"}},
+        {"op": "delete", "ids": [4, 5, 404]},
+        {"op": "edit_cell", "id": 4, "column": "name", "value": "deleted before"},
+        {"op": "edit_cell", "id": 404, "column": "name", "value": "missing"},
+    ], expected_version=version)
+    assert result == {"affected": [1, 1, 1, 2, 0, 0], "version": version + 5}
+    assert [db.get_row(row_id)["name"] for row_id in (1, 2, 3)] == ["a", "b", "c"]
+    assert db.get_row(3)["product"] == "other"
+    assert [row["id"] for row in db.get_table_as_list()] == [1, 2, 3, 6, 7, 8, 9, 10]
+
+
+def test_conflicting_batch_is_rejected(filled_database):
+    version = db.get_change_version()
+    db.edit_cell(2, "name", "changed elsewhere")
+    db.delete_row(3)
+    with pytest.raises(db.ConflictError) as error:
+        db.apply_mutations([
+            {"op": "edit_cell", "id": 1, "column": "name", "value": "a"},
+            {"op": "edit_cell", "id": 2, "column": "name", "value": "b"},
+            {"op": "delete", "ids": [3]},
+        ], expected_version=version)
+    assert sorted(error.value.row_ids) == [2, 3]
+    assert error.value.version == version
+    # Nothing of the batch is applied
+    assert db.get_row(1)["name"] == "run 0"
+    assert db.get_row(2)["name"] == "changed elsewhere"
+
+
+def test_unknown_columns_are_rejected(filled_database):
+    with pytest.raises(ValueError):
+        db.apply_mutations([{"op": "edit_cell", "id": 1, "column": "name", "value": "a"}, {"op": "edit_cell", "id": 1, "column": "missing", "value": 1}])
+    assert db.get_row(1)["name"] == "run 0"
+
+
+def test_route_applies_mutations(client):
+    version = db.get_change_version()
+    response = client.post("/mutations", json={"mutations": [{"op": "edit_cell", "id": 1, "column": "name", "value": "a"}], "version": version})
+    assert response.status_code == 200
+    assert response.get_json() == {"affected": [1], "version": version + 1}
+
+
+def test_route_responds_409_on_conflict(client):
+    version = db.get_change_version()
+    db.edit_cell(1, "name", "changed elsewhere")
+    response = client.post("/mutations", json={"mutations": [{"op": "edit_cell", "id": 1, "column": "name", "value": "a"}], "version": version})
+    assert response.status_code == 409
+    assert response.get_json() == {"conflicts": [1], "version": version + 1}
+    assert db.get_row(1)["name"] == "changed elsewhere"
+
+
+def test_route_rejects_malformed_mutations(client):
+    response = client.post("/mutations", json={"mutations": [{"op": "rename", "id": 1}]})
+    assert response.status_code == 400
+
+
+def test_route_reports_constraint_violations(client):
+    response = client.post("/mutations", json={"mutations": [
+        {"op": "edit_cell", "id": 1, "column": "name", "value": "a"},
+        {"op": "edit_cell", "id": 2, "column": "date", "value": None},
+    ]})
+    assert response.status_code == 400
+    assert "NOT NULL" in response.get_json()["error"]
+    assert db.get_row(1)["name"] == "run 0"
+    assert db.get_row(2)["date"] is not None
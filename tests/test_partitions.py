@@ -0,0 +1,97 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import make_rows
+from database import db, partitions
+
+
+@pytest.fixture
+def partitioned_database(database):
+    db.add_rows(make_rows(6, month="2024-01") + make_rows(6, start=6, month="2024-02"))
+    partitions.enable_partitioning("month")
+    db.add_statistics([{"id": 1, "channel": "x", "count": 10, "mean": 1.5}])
+    return database
+
+
+def partition_of(row_id):
+    with db.transaction(write=False) as conn:
+        return partitions.find_row_table(conn, db.default_database_file, "data", row_id)
+
+
+def test_rows_are_routed_by_date(partitioned_database):
+    assert partitions.get_partition_names() == ["data_p202401", "data_p202402"]
+    assert partition_of(1) == "data_p202401"
+    assert partition_of(7) == "data_p202402"
+    row_id, = db.add_rows(make_rows(1, start=12, month="2024-03"))
+    assert partition_of(row_id) == "data_p202403"
+
+
+def test_date_edit_moves_row_across_partitions(partitioned_database):
+    version = db.get_change_version()
+    db.edit_row(1, {"date": "2024-03-15", "name": "moved"})
+    assert partition_of(1) == "data_p202403"
+    row = db.get_row(1)
+    assert (row["date"], row["name"], row["product"]) == ("2024-03-15", "moved", "product_0")
+    assert len(db.get_table_as_list()) == 12
+    assert db.query_rows(filters=[{"column": "date", "op": ">=", "value": "2024-03-01"}])[0]["id"] == 1
+
+    # The move is an update of the row, which keeps its statistics
+    changes = db.get_changes_since(version)
+    assert changes["added"] == [] and changes["deleted"] == []
+    assert [row["id"] for row in changes["updated"]] == [1]
+    assert db.get_statistics([1])["mean"].tolist() == [1.5]
+
+
+def test_date_edit_within_partition_stays(partitioned_database):
+    db.edit_cell(2, "date", "2024-01-20")
+    assert partition_of(2) == "data_p202401"
+    assert db.get_row(2)["date"] == "2024-01-20"
+
+
+def test_batch_with_moves_updates_aggregates(partitioned_database):
+    result = db.apply_mutations([
+        {"op": "edit_cell", "id": 1, "column": "date", "value": "2024-02-10"},
+        {"op": "edit_cell", "id": 1, "column": "name", "value": "moved"},
+        {"op": "edit_row", "id": 7, "values": {"date": "2024-05-01", "product": "product_9"}},
+        {"op": "delete", "ids": [8]},
+    ])
+    assert result["affected"] == [1, 1, 1, 1]
+    assert (partition_of(1), partition_of(7), partition_of(8)) == ("data_p202402", "data_p202405", None)
+    assert db.get_row(1)["name"] == "moved"
+
+    daily = db.get_daily_counts()
+    assert daily["count"].sum() == 11
+    assert daily.set_index(["product", "day"]).loc[("product_9", "2024-05-01"), "count"] == 1
+    products = db.get_product_counts().set_index("product")
+    assert products.loc["product_9", "latest_id"] == 7
+
+
+def test_reads_merge_partitions_in_order(partitioned_database):
+    db.edit_row(1, {"date": "2024-03-15"})
+    rows, count = db.get_table_page(0, 5, sort_model=[("date", "desc")])
+    assert count == 12
+    assert [row["id"] for row in rows][:1] == [1]
+    assert [row["id"] for row in db.get_table_as_list()] == list(range(1, 13))
+
+
+def test_parallel_reads_share_one_snapshot(partitioned_database, monkeypatch):
+    # One worker reads the partitions one after the other, and a row moves across them between the two reads
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        monkeypatch.setattr(partitions, "get_partition_executor", lambda: executor)
+        read = []
+
+        def function(table):
+            with db.transaction(write=False) as conn:
+                ids = [row_id for row_id, in conn.execute(f"SELECT id FROM {table}")]
+            if not read:
+                writer = threading.Thread(target=db.edit_row, args=(1, {"date": "2024-02-20"}))
+                writer.start()
+                writer.join()
+            read.append(table)
+            return ids
+
+        ids = partitions.map_tables(function, ["data_p202401", "data_p202402"])
+    assert sorted(row_id for table_ids in ids for row_id in table_ids) == list(range(1, 13))
+    assert 1 in ids[1] and 1 not in ids[0]
@@ -0,0 +1,81 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import conftest
+
+sys.path.append(os.path.join(conftest.AMAIAS_DIRECTORY, "speed"))
+from plotting import plotting
+
+
+@pytest.fixture
+def signal():
+    random = np.random.default_rng(0)
+    x = np.linspace(0, 100, 100003)
+    y = np.sin(x) + random.normal(scale=0.1, size=len(x))
+    y[12345], y[67890] = 50.0, -50.0
+    return x, y
+
+
+@pytest.mark.parametrize("max_points", [10, 1000, 4000])
+def test_minmax_point_count(signal, max_points):
+    x, y = signal
+    trace_x, trace_y = plotting.decimate(x, y, max_points=max_points)
+    assert len(trace_x) == len(trace_y) <= max_points
+    assert len(trace_y) >= max_points // 2
+
+
+def test_minmax_keeps_the_extremes(signal):
+    x, y = signal
+    trace_x, trace_y = plotting.decimate(x, y, max_points=100)
+    assert trace_y.max() == 50.0 and trace_y.min() == -50.0
+    assert x[12345] in trace_x and x[67890] in trace_x
+    # The kept points stay in x order
+    assert np.all(np.diff(trace_x) > 0)
+
+
+def test_minmax_keeps_every_bucket_envelope(signal):
+    x, y = signal
+    max_points = 200
+    _, trace_y = plotting.decimate(x, y, max_points=max_points)
+    bucket_size = int(np.ceil(len(y) / (max_points // 2)))
+    for start in range(0, len(y), bucket_size):
+        bucket = y[start:start + bucket_size]
+        assert bucket.max() in trace_y and bucket.min() in trace_y
+
+
+def test_short_series_are_kept(signal):
+    x, y = signal
+    trace_x, trace_y = plotting.decimate(x[:50], y[:50], max_points=100)
+    np.testing.assert_array_equal(trace_x, x[:50])
+    np.testing.assert_array_equal(trace_y, y[:50])
+
+
+def test_missing_values_are_skipped():
+    y = np.full(1000, np.nan)
+    y[::10] = np.arange(100)
+    trace_x, trace_y = plotting.decimate(np.arange(1000.0), y, max_points=20)
+    assert 0.0 in trace_y and 99.0 in trace_y
+    assert len(trace_y) <= 20
+
+
+def test_window_keeps_one_point_beyond_each_edge(signal):
+    x, y = signal
+    window_x, window_y = plotting.window(x, y, [10.0, 20.0])
+    assert window_x[0] < 10.0 <= window_x[1] and window_x[-2] <= 20.0 < window_x[-1]
+    assert len(window_x) == len(window_y)
+
+
+def test_data_cache_is_bounded_by_bytes():
+    cache = plotting.DataCache(max_bytes=3000)
+    for index in range(4):
+        cache.set(index, {"value": np.zeros(100)})
+    assert cache.size <= 3000
+    assert cache.get(0) is None and cache.get(3) is not None
+    cache.get(1)
+    cache.set(4, {"value": np.zeros(100)})
+    assert cache.get(1) is not None and cache.get(2) is None
+    cache.set("large", {"value": np.zeros(1000)})
+    assert cache.get("large") is None
@@ -0,0 +1,49 @@
+import pytest
+
+from conftest import make_rows
+from database import db, partitions
+
+
+@pytest.fixture(params=[False, True], ids=["unpartitioned", "partitioned"])
+def filled_database(request, database):
+    db.add_rows(make_rows(50) + make_rows(50, start=50, month="2024-02"))
+    if request.param:
+        partitions.enable_partitioning("month")
+    return database
+
+
+def insert_and_delete(expected_rows):
+    db.add_row({"name": "after refactor", "date": "2024-03-01", "product": "product_0", "datapath": "/data/after.npz"})
+    db.apply_mutations([{"op": "delete", "ids": [1, 2]}])
+    db.delete_row(3)
+    rows = db.get_table_as_list()
+    assert len(rows) == expected_rows
+    assert db.query_rows(filters=[{"column": "name", "op": "match", "value": "after refactor"}])
+    counts = db.get_product_counts()
+    assert counts["count"].sum() == expected_rows
+
+
+@pytest.mark.parametrize("column", ["product", "date", "name"])
+def test_refactor_dropping_dependent_column_is_rejected(filled_database, column):
+    columns = [name for name in db.get_column_names() if name != column]
+    with pytest.raises(ValueError, match=column):
+        db.refactor_columns(columns + ["Input1"])
+    assert db.get_column_names() == ["id", "name", "date", "product", "datapath"]
+    insert_and_delete(98)
+
+
+def test_refactor_drops_and_adds_columns(filled_database):
+    db.refactor_columns(["id", "name", "date", "product", "datapath", "Input1", "Input2"])
+    db.refactor_columns(["id", "name", "date", "product", "datapath", "Input2", "Input3"])
+    assert db.get_column_names() == ["id", "name", "date", "product", "datapath", "Input2", "Input3"]
+    insert_and_delete(98)
+
+
+def test_delete_column(filled_database):
+    db.add_rows([dict(row, Input1=1.0, Input2=2.0) for row in make_rows(10, start=100)])
+    version = db.get_change_version()
+    db.delete_column("Input1")
+    assert db.get_change_version() == version
+    assert db.get_column_names() == ["id", "name", "date", "product", "datapath", "Input2"]
+    assert db.get_row(101)["Input2"] == 2.0
+    insert_and_delete(108)
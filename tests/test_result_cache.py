@@ -0,0 +1,77 @@
+import sys
+import subprocess
+
+import pytest
+
+import conftest
+from conftest import make_rows
+from cache import redis_cache
+from database import db
+
+
+@pytest.fixture
+def cached_database(database):
+    redis_cache.set_cache_backend(redis_cache.MemoryBackend())
+    db.set_result_cache_enabled(True)
+    yield database
+    db.set_result_cache_enabled(False)
+    redis_cache.set_cache_backend(None)
+
+
+def cache_version(db_file):
+    return redis_cache.get_table_version(db.table_cache_namespace(db_file, "data"))
+
+
+def test_writes_invalidate_cached_reads(cached_database):
+    assert db.get_table_page(0, 10)[1] == 0
+    db.add_rows(make_rows(3))
+    assert db.get_table_page(0, 10)[1] == 3
+    db.edit_cell(1, "name", "edited")
+    assert db.get_table_page(0, 10)[0][0]["name"] == "edited"
+
+
+def test_invalidation_waits_for_outer_commit(cached_database):
+    version = cache_version(cached_database)
+    with db.transaction():
+        db.add_rows(make_rows(3))
+        db.edit_row(1, {"name": "edited"})
+        assert cache_version(cached_database) == version
+    assert cache_version(cached_database) > version
+    assert db.get_table_page(0, 10)[1] == 3
+
+
+def test_rolled_back_writes_leave_the_cache(cached_database):
+    version = cache_version(cached_database)
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.add_rows(make_rows(3))
+            raise RuntimeError
+    assert cache_version(cached_database) == version
+    assert not db.get_pending_invalidations()
+    assert db.get_table_page(0, 10)[1] == 0
+
+
+def run_in_other_process(db_file, code):
+    script = f"from database import db\ndb.set_default_database_file({db_file!r})\ndb.set_default_database_table_name('data')\n{code}"
+    subprocess.run([sys.executable, "-c", script], cwd=conftest.AMAIAS_DIRECTORY, check=True)
+
+
+def test_writes_of_other_processes_invalidate_cached_reads(cached_database):
+    assert db.get_table_page(0, 10)[1] == 0
+    assert db.get_statistics().empty
+    run_in_other_process(cached_database, "db.add_rows([{'name': 'a', 'date': '2024-01-01', 'datapath': '/a'}] * 3)")
+    assert db.get_table_page(0, 10)[1] == 3
+    run_in_other_process(cached_database, "db.add_statistics([{'id': 1, 'channel': 'x', 'count': 1}])")
+    assert len(db.get_statistics()) == 1
+    run_in_other_process(cached_database, "db.delete_statistics([1])")
+    assert db.get_statistics().empty
+
+
+def test_reads_inside_a_transaction_are_not_cached(cached_database):
+    assert db.get_table_page(0, 10)[1] == 0
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.add_rows(make_rows(3))
+            assert db.get_table_page(0, 10)[1] == 3
+            raise RuntimeError
+    assert db.get_table_page(0, 10)[1] == 0
@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+import pytest
+
+from cache import redis_cache
+from conftest import make_rows
+from database import db, partitions, statistics
+
+
+@pytest.fixture
+def experiments(database, tmp_path):
+    rows = make_rows(3)
+    for index, row in enumerate(rows):
+        row["datapath"] = str(tmp_path / f"run{index}.npz")
+        np.savez(row["datapath"], time=np.arange(101.0), value=np.arange(101.0) * (index + 1), label=np.array(["a"] * 101))
+    rows.append({**make_rows(1, start=3)[0], "datapath": str(tmp_path / "missing.npz")})
+    return db.add_rows(rows)
+
+
+def test_summarize_channel():
+    values = np.concatenate([np.arange(101.0), [np.nan, np.inf]])
+    summary = statistics.summarize_channel(values)
+    assert summary["count"] == 101
+    assert (summary["min"], summary["max"], summary["mean"], summary["q50"]) == (0.0, 100.0, 50.0, 50.0)
+    assert summary["q05"] == pytest.approx(5.0) and summary["q95"] == pytest.approx(95.0)
+    histogram = json.loads(summary["histogram"])
+    assert sum(histogram["counts"]) == 101 and len(histogram["edges"]) == statistics.HISTOGRAM_BINS + 1
+    assert statistics.summarize_channel([np.nan]) == {"count": 0}
+
+
+def test_only_numeric_channels_are_summarized():
+    summaries = statistics.summarize_experiment(7, {"value": np.arange(5.0), "label": np.array(["a"] * 5)})
+    assert [(summary["id"], summary["channel"]) for summary in summaries] == [(7, "value")]
+
+
+def test_compute_and_get_statistics(experiments):
+    failed = statistics.compute_statistics()
+    assert failed == [experiments[3]]
+    stored = db.get_statistics()
+    assert sorted(zip(stored["id"], stored["channel"])) == [(row_id, channel) for row_id in experiments[:3] for channel in ("time", "value")]
+
+    means = db.get_statistics(experiments[:2], ["value"]).sort_values("id")["mean"].tolist()
+    assert means == [50.0, 100.0]
+    assert db.get_statistics([404]).empty
+
+
+def test_compare_statistics(experiments):
+    statistics.compute_statistics(experiments[:3])
+    compared = statistics.compare_statistics(experiments[:3], ["value"], "max")
+    assert compared["value"].tolist() == [100.0, 200.0, 300.0]
+    assert statistics.compare_statistics([404]).empty
+
+
+def test_statistics_are_replaced(experiments):
+    db.add_statistics([{"id": experiments[0], "channel": "value", "count": 1, "mean": 1.0}])
+    db.add_statistics([{"id": experiments[0], "channel": "value", "count": 2, "mean": 2.0}])
+    stored = db.get_statistics([experiments[0]])
+    assert stored[["count", "mean"]].values.tolist() == [[2, 2.0]]
+    db.delete_statistics([experiments[0]])
+    assert db.get_statistics([experiments[0]]).empty
+
+
+@pytest.mark.parametrize("partitioned", [False, True])
+def test_deleting_rows_removes_their_statistics(experiments, partitioned):
+    if partitioned:
+        partitions.enable_partitioning("month")
+    statistics.compute_statistics(experiments[:3])
+    db.delete_row(experiments[0])
+    assert set(db.get_statistics()["id"]) == set(experiments[1:3])
+
+
+def test_cached_statistics_follow_writes(experiments):
+    redis_cache.set_cache_backend(redis_cache.MemoryBackend())
+    db.set_result_cache_enabled(True)
+    try:
+        db.add_statistics([{"id": experiments[0], "channel": "value", "count": 1, "mean": 1.0}])
+        assert db.get_statistics([experiments[0]])["mean"].tolist() == [1.0]
+        db.add_statistics([{"id": experiments[0], "channel": "value", "count": 1, "mean": 3.0}])
+        assert db.get_statistics([experiments[0]])["mean"].tolist() == [3.0]
+    finally:
+        db.set_result_cache_enabled(False)
+        redis_cache.set_cache_backend(None)
@@ -0,0 +1,108 @@
+import os
+import sys
+
+import pytest
+
+import conftest
+from conftest import make_rows
+from database import db, partitions
+
+sys.path.append(os.path.join(conftest.AMAIAS_DIRECTORY, "speed"))
+from callbacks import callbacks
+
+
+@pytest.fixture(params=[False, True], ids=["plain", "partitioned"])
+def filled_database(database, request):
+    db.add_rows(make_rows(30, month="2024-01") + make_rows(30, start=30, month="2024-02"))
+    if request.param:
+        partitions.enable_partitioning("month")
+    return database
+
+
+def expected_rows(predicate=lambda row: True, key=lambda row: row["id"], reverse=False):
+    return sorted((row for row in db.get_table_as_list() if predicate(row)), key=key, reverse=reverse)
+
+
+def test_pages_cover_the_table(filled_database):
+    pages = [db.get_table_page(start, start + 25) for start in range(0, 60, 25)]
+    assert [row_count for _, row_count in pages] == [60, 60, 60]
+    assert [row["id"] for rows, _ in pages for row in rows] == list(range(1, 61))
+    assert db.get_table_page(100, 125) == ([], 60)
+
+
+def test_sorted_pages(filled_database):
+    rows, _ = db.get_table_page(10, 20, sort_model=[("name", "desc")])
+    expected = expected_rows(key=lambda row: row["name"], reverse=True)[10:20]
+    assert [row["id"] for row in rows] == [row["id"] for row in expected]
+
+
+def test_ties_are_ordered_by_id(filled_database):
+    rows, _ = db.get_table_page(0, 60, sort_model=[("product", "asc")])
+    assert [row["id"] for row in rows] == [row["id"] for row in expected_rows(key=lambda row: (row["product"], row["id"]))]
+
+
+def test_filtered_pages(filled_database):
+    filters = [{"column": "product", "op": "=", "value": "product_1"}, {"column": "date", "op": ">=", "value": "2024-01-20"}]
+    rows, row_count = db.get_table_page(0, 5, filters=filters)
+    expected = expected_rows(lambda row: row["product"] == "product_1" and row["date"] >= "2024-01-20")
+    assert row_count == len(expected)
+    assert rows == expected[:5]
+
+
+def test_pages_follow_writes(filled_database):
+    assert db.get_table_page(0, 1)[0][0]["name"] == "run 0"
+    db.edit_cell(1, "name", "renamed")
+    assert db.get_table_page(0, 1)[0][0]["name"] == "renamed"
+    db.delete_row(1)
+    assert db.get_table_page(0, 1) == ([db.get_row(2)], 59)
+
+
+def test_unknown_sort_columns_are_rejected(filled_database):
+    with pytest.raises(ValueError):
+        db.get_table_page(0, 10, sort_model=[("missing", "asc")])
+
+
+def test_text_and_number_filters():
+    filter_model = {
+        "name": {"filterType": "text", "type": "contains", "filter": "run 1"},
+        "id": {"filterType": "number", "type": "inRange", "filter": 5, "filterTo": 15},
+    }
+    assert callbacks.grid_filter_to_filters(filter_model) == [
+        {"column": "name", "op": "contains", "value": "run 1"},
+        {"column": "id", "op": "between", "value": (5, 15)},
+    ]
+
+
+def test_date_filters_compare_dates():
+    filter_model = {"date": {"filterType": "date", "type": "greaterThan", "dateFrom": "2024-01-10 00:00:00", "dateTo": None}}
+    assert callbacks.grid_filter_to_filters(filter_model) == [{"column": "date", "op": ">", "value": "2024-01-10"}]
+
+
+def test_combined_conditions():
+    filter_model = {"product": {
+        "filterType": "text",
+        "operator": "OR",
+        "conditions": [{"filterType": "text", "type": "equals", "filter": "product_0"}, {"filterType": "text", "type": "blank"}],
+    }}
+    assert callbacks.grid_filter_to_filters(filter_model) == [{"any": [
+        {"column": "product", "op": "=", "value": "product_0"},
+        {"column": "product", "op": "is_null", "value": None},
+    ]}]
+    legacy = {"product": {"operator": "AND", "condition1": {"type": "startsWith", "filter": "p"}, "condition2": {"type": "notEqual", "filter": "product_2"}}}
+    assert callbacks.grid_filter_to_filters(legacy)[0]["all"][1] == {"column": "product", "op": "!=", "value": "product_2"}
+
+
+def test_translated_filters_select_rows(filled_database):
+    filter_model = {"product": {"filterType": "text", "operator": "OR", "conditions": [
+        {"filterType": "text", "type": "equals", "filter": "product_0"},
+        {"filterType": "text", "type": "equals", "filter": "product_2"},
+    ]}}
+    rows, row_count = db.get_table_page(0, None, filters=callbacks.grid_filter_to_filters(filter_model))
+    assert rows == expected_rows(lambda row: row["product"] in ("product_0", "product_2"))
+    assert row_count == 40
+
+
+def test_empty_filter_model():
+    assert callbacks.grid_filter_to_filters(None) == []
+    assert callbacks.grid_filter_to_filters({}) == []
+    assert callbacks.grid_sort_to_sort([{"colId": "date", "sort": "desc"}]) == [("date", "desc")]
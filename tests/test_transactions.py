@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+from conftest import make_rows
+from database import db
+
+
+def row_count():
+    with db.transaction(write=False) as conn:
+        return conn.execute("SELECT COUNT(*) FROM data").fetchone()[0]
+
+
+def test_connections_are_pooled_per_thread(database):
+    conn = db.get_db_connection()
+    assert db.get_db_connection() is conn
+    other = []
+    thread = threading.Thread(target=lambda: other.append(db.get_db_connection(database)))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+    db.close_db_connections()
+    assert db.get_db_connection() is not conn
+
+
+def test_transaction_commits(database):
+    with db.transaction() as conn:
+        db.add_rows(make_rows(2))
+        assert conn.in_transaction
+    assert not db.get_db_connection().in_transaction
+    assert row_count() == 2
+
+
+def test_error_rolls_back(database):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.add_rows(make_rows(2))
+            raise RuntimeError
+    assert not db.get_db_connection().in_transaction
+    assert row_count() == 0
+
+
+def test_nested_transactions_join_the_outer_one(database):
+    with pytest.raises(RuntimeError):
+        with db.transaction() as outer:
+            with db.transaction() as inner:
+                assert inner is outer
+                db.add_row(make_rows(1)[0])
+            # The inner block exiting doesn't commit
+            assert outer.in_transaction
+            db.edit_cell(1, "name", "edited")
+            raise RuntimeError
+    assert row_count() == 0
+
+
+def test_error_in_nested_transaction_rolls_back_the_outer_one(database):
+    db.add_rows(make_rows(1))
+    with pytest.raises(ValueError):
+        with db.transaction():
+            db.add_rows(make_rows(2, start=1))
+            db.apply_mutations([{"op": "edit_cell", "id": 1, "column": "missing", "value": 1}])
+    assert row_count() == 1
+
+
+def test_uncommitted_writes_are_invisible_to_other_threads(database):
+    counts = []
+    with db.transaction():
+        db.add_rows(make_rows(3))
+        thread = threading.Thread(target=lambda: counts.append(row_count()))
+        thread.start()
+        thread.join()
+    assert counts == [0]
+    assert row_count() == 3
@@ -0,0 +1,156 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from database import db
+from miner import watch
+from storage import blobstore
+
+
+@pytest.fixture
+def drop_directory(database, tmp_path, monkeypatch):
+    monkeypatch.setattr(blobstore, "blob_root", str(tmp_path / "experiments"))
+    monkeypatch.setattr(watch, "POLL_INTERVAL", 0.05)
+    monkeypatch.setattr(watch, "SETTLE_SECONDS", 0.05)
+    directory = tmp_path / "drop"
+    os.makedirs(directory / "product_a")
+    return str(directory)
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+@pytest.fixture
+def watcher(drop_directory, executor):
+    """A watcher that isn't started, to drive its steps directly."""
+    watcher = watch.Watcher([drop_directory], executor, poll=True, workers=1, queue_size=4)
+    db.execute_sql_script(watch.MANIFEST_SCHEMA_FILE, {"table_name": watcher.table_name})
+    return watcher
+
+
+def drop(path, scale=1.0, age=60):
+    np.savez(path, time=np.arange(20.0), value=np.arange(20.0) * scale)
+    # Old enough to have settled
+    modified = time.time() - age
+    os.utime(path, (modified, modified))
+    return str(path)
+
+
+def manifest():
+    with db.transaction(write=False) as conn:
+        return {path: (state, row_id, error) for path, state, row_id, error in conn.execute("SELECT path, state, row_id, error FROM data_watch_manifest")}
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.02)
+    raise AssertionError("Timed out")
+
+
+def test_file_metadata(drop_directory):
+    path = drop(os.path.join(drop_directory, "product_a", "run1.npz"))
+    metadata = watch.file_metadata(path, drop_directory)
+    assert metadata["name"] == os.path.join("product_a", "run1")
+    assert metadata["product"] == "product_a"
+    assert metadata["date"] == time.strftime("%Y-%m-%d", time.localtime(os.path.getmtime(path)))
+    assert watch.file_metadata(drop(os.path.join(drop_directory, "loose.npz")), drop_directory)["product"] is None
+
+
+def test_files_are_queued_once(watcher, drop_directory):
+    path = drop(os.path.join(drop_directory, "run.npz"))
+    watcher.consider(path)
+    watcher.consider(path)
+    assert watcher.queue.qsize() == 1
+    # A change while queued is checked again once its worker is done
+    assert watcher.changed == {path}
+    watcher.consider(os.path.join(drop_directory, "notes.txt"))
+    assert watcher.queue.qsize() == 1
+
+
+def test_unsettled_files_wait(watcher, drop_directory):
+    path = drop(os.path.join(drop_directory, "run.npz"), age=0)
+    watcher.consider(path)
+    assert watcher.queue.empty() and path in watcher.settling
+    watcher.consider(path, closed=True)
+    assert watcher.queue.qsize() == 1 and path not in watcher.settling
+
+
+def test_ingest_records_the_manifest(watcher, drop_directory):
+    good = drop(os.path.join(drop_directory, "product_a", "good.npz"))
+    broken = os.path.join(drop_directory, "broken.npz")
+    with open(broken, "wb") as fout:
+        fout.write(b"PK\x03\x04 truncated")
+    watcher.ingest([good, broken])
+
+    entries = manifest()
+    assert entries[good][0] == "ingested" and entries[broken][0] == "failed"
+    row = db.get_row(entries[good][1])
+    assert row["name"] == os.path.join("product_a", "good") and row["product"] == "product_a"
+    # Files in the manifest with their current size and time aren't queued again
+    watcher.consider(good)
+    assert watcher.queue.empty()
+
+
+def test_changed_files_replace_their_row(watcher, drop_directory):
+    path = drop(os.path.join(drop_directory, "run.npz"))
+    watcher.ingest([path])
+    row_id = manifest()[path][1]
+    first_datapath = db.get_row(row_id)["datapath"]
+
+    drop(path, scale=2.0, age=30)
+    watcher.ingest([path])
+    assert manifest()[path][1] == row_id
+    assert db.get_row(row_id)["datapath"] != first_datapath
+    assert len(db.get_table_as_list()) == 1
+
+    # Touching a file without changing its content only updates the manifest
+    os.utime(path, (time.time() - 10, time.time() - 10))
+    watcher.ingest([path])
+    assert watcher.manifest[path][1] == os.stat(path).st_mtime_ns
+    assert len(db.get_table_as_list()) == 1
+
+
+def test_polling_watcher_ingests_dropped_files(drop_directory, executor):
+    existing = drop(os.path.join(drop_directory, "existing.npz"))
+    watcher = watch.Watcher([drop_directory], executor, poll=True, workers=2)
+    watcher.start()
+    try:
+        wait_for(lambda: existing in manifest())
+        dropped = drop(os.path.join(drop_directory, "product_a", "dropped.npz"), scale=3.0)
+        wait_for(lambda: dropped in manifest())
+    finally:
+        watcher.stop()
+    assert sorted(row["name"] for row in db.get_table_as_list()) == ["existing", os.path.join("product_a", "dropped")]
+
+    # A restarted watcher resumes from the manifest
+    restarted = watch.Watcher([drop_directory], executor, poll=True, workers=1)
+    restarted.start()
+    try:
+        time.sleep(0.3)
+    finally:
+        restarted.stop()
+    assert len(db.get_table_as_list()) == 2
+
+
+def test_watcher_falls_back_to_polling(drop_directory, executor, monkeypatch, caplog):
+    def unavailable():
+        raise OSError("inotify is not supported")
+
+    monkeypatch.setattr(watch, "Inotify", unavailable)
+    watcher = watch.Watcher([drop_directory], executor, workers=1)
+    watcher.start()
+    try:
+        dropped = drop(os.path.join(drop_directory, "dropped.npz"))
+        wait_for(lambda: dropped in manifest())
+    finally:
+        watcher.stop()
+    assert "polling" in caplog.text
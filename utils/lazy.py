@@ -0,0 +1,42 @@
+import sys
+import types
+import threading
+import importlib
+
+# Every module handed out by lazy_import, so startup can load them ahead of their first use
+lazy_modules = {}
+lazy_modules_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported the first time one of its attributes is used. Its attributes are then
+    copied over, so later lookups cost the same as on the module itself."""
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+
+def lazy_import(name):
+    """Returns a LazyModule standing in for a module. Heavy modules that are only needed once a request comes in
+    (pandas, pyarrow, plotly...) are imported this way to keep startup fast. Module-level code must not use them, or
+    they load right away."""
+    with lazy_modules_lock:
+        if name not in lazy_modules:
+            lazy_modules[name] = LazyModule(name)
+        return lazy_modules[name]
+
+
+def is_loaded(name):
+    """Returns whether a module has been imported. Until it has, no value can be an instance of its types, so
+    isinstance checks against them can be skipped without importing it."""
+    return name in sys.modules
+
+
+def preload(names=None):
+    """Imports the given lazily imported modules (all of them by default)."""
+    for name in names or list(lazy_modules):
+        module = lazy_import(name)
+        module.__dict__.update(importlib.import_module(name).__dict__)
+